@@ -1 +1,11 @@
-from .client import KurentoClient
\ No newline at end of file
+from .client import KurentoClient
+from .client import AsyncKurentoClient
+from .cluster import KurentoCluster
+from .events import EventBuffer
+from .retry import RetryPolicy
+from .tracing import Tracer
+from .tracing import SpanRecorder
+from .tracing import CallSetupTimer
+from .exceptions import KurentoOperationException
+from .exceptions import KurentoTimeoutException
+from .exceptions import KurentoConnectionException
\ No newline at end of file
@@ -1,92 +1,233 @@
+from .callbacks import CallbackPool
+from .codec import get_codec
+from .events import Event
+from .events import EventBuffer
+from .events import EventRecord
+from .metrics import ClientMetrics
+from .metrics import prometheus_text
+from .recording import WireRecorder
+from .registry import MediaObjectRegistry
 from .parse_payloads import rpc_payload
+from .parse_payloads import PayloadTemplate
+from .parse_payloads import event_envelope
+from .parse_payloads import Response
+from .retry import RetryPolicy
 from .exceptions import KurentoOperationException
+from .exceptions import KurentoConnectionException
+from .exceptions import KurentoTimeoutException
 
-import json
+import concurrent.futures
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
 import threading
 import time
 import websocket
 
+from concurrent.futures import Future
+from queue import Full
 from queue import Queue
 from random import randint
 
+logger = logging.getLogger(__name__)
+
+request_deadline = contextvars.ContextVar("request_deadline", default = None) # Monotonic time set by BaseKurentoClient.deadline()
+
+DEFAULT_RECONNECT_POLICY = RetryPolicy(retries = 10, backoff = 0.5, max_backoff = 30.0, jitter = 0.5)
+
+
+class PendingRequest(Future):
+    """ Future of the reply to an in-flight request. Keeps the payload, so the request can be replayed after a reconnect
+    """
+
+    def __init__(self, req_id, load = None, method = None, params = None, context = None):
+        super().__init__()
+        self.req_id = req_id
+        self.load = load
+        self.method = method # For metrics & tracing. None for requests that aren't measured
+        self.params = params
+        self.operation = params.get("operation") if params else None
+        self.created_at = time.monotonic()
+        self.generation = None # Connection generation the payload was last written on
+        self.queued = False # Waiting in the writer queue, so a replay would send it twice
+        self.context = context # Caller's contextvars, when tracing
+        self.trace = None # Record passed to tracers, once sent
+
+
 class BaseKurentoClient(object):
     """ Base Kurento client
     """
 
-    def __init__(self, kurento_server_url: str):
+    REPLAY = "replay"
+    FAIL = "fail"
+    HEARTBEAT_MISSES = 2 # Unanswered pings in a row before the connection is considered dead
+    TEMPLATED = {"addIceCandidate": "candidate", "connect": "sink"} # Invoked operations serialised from a template -> the param that changes
+    MAX_TEMPLATES = 1024
+    MAX_QUEUED_EVENTS = 4096 # Events read but not yet dispatched. Once reached, reading from KMS pauses until the dispatcher catches up
+
+    def __init__(self, kurento_server_url: str, callback_pool = None, request_timeout = 20, retry_policy = None, heartbeat_interval = 10, reconnect_policy = DEFAULT_RECONNECT_POLICY, in_flight_policy = "fail", tracers = None, recorder = None, codec = None, property_ttl = 5.0):
         """ Connect to the Kurento server
 
         Params:
             kurento_server_url (str) - The Kurento server WebSockets url
+            callback_pool (BaseCallbackPool) - Where event callbacks run. Defaults to a CallbackPool of 4 threads
+            request_timeout (float) - Seconds to wait for a reply before raising KurentoTimeoutException. None waits forever
+            retry_policy (RetryPolicy) - Retries for idempotent requests. None never retries
+            heartbeat_interval (float) - Seconds between keepalive pings. None turns the heartbeat off
+            reconnect_policy (RetryPolicy) - Backoff between attempts to reconnect after the connection drops. None never reconnects
+            in_flight_policy (str) - What happens to requests in flight when the connection drops. 'fail' fails them with KurentoConnectionException straight away. 'replay' holds them & re-sends them once reconnected, except non-idempotent ones already written to the dead connection, which fail
+            tracers (list) - Tracer objects told about every request, reply & event. See add_tracer()
+            recorder (str or WireRecorder) - File to record every frame sent & received to, for replaying with ReplayKurentoClient
+            codec (str or JsonCodec) - JSON library, 'orjson', 'ujson' or 'json'. Defaults to the fastest installed
+            property_ttl (float) - Seconds the registry caches values read from media objects. 0 turns caching off
         """
 
+        if(in_flight_policy not in (self.REPLAY, self.FAIL)):
+            raise KurentoOperationException(f"Unknown in-flight policy {in_flight_policy}")
+
         self.kurento_url = kurento_server_url
-        self.conn_id = randint(5, 12345678)# Incremented everytime a transaction is complete
-        self.kurento_conn = websocket.WebSocket()
-        self.kurento_conn.connect(kurento_server_url)
+        self.request_ids = itertools.count(randint(5, 12345678)) # JSON-RPC ids. next() on it is atomic, so concurrent callers never share an id
+        self.codec = get_codec(codec)
+        self.templates = {} # (object, operation, session id) -> PayloadTemplate of its hot invokes
+        self.registry = MediaObjectRegistry(property_ttl)
+        self.recorder = WireRecorder(recorder) if isinstance(recorder, str) else recorder
+        self.kurento_conn = self.open_connection(kurento_server_url)
+
+        self.state_cond = threading.Condition() # Guards the connection state below. Notified when it changes
+        self.connected = True
+        self.closing = False # Set once the connection is closed on purpose
+        self.generation = 0 # Bumped on every reconnect
+        self.heartbeat_interval = heartbeat_interval
+        self.reconnect_policy = reconnect_policy
+        self.in_flight_policy = in_flight_policy
+
+        self.session_ids = set() # KMS sessions seen on this connection. Resumed after a reconnect
+        self.disconnects = 0
+        self.reconnects = 0
+        self.sessions_resumed = 0
+        self.heartbeats_missed = 0
+        self.events_skipped = 0 # Received while nothing listened for them, so never decoded
+        self.events_paused = 0 # Times reading from KMS paused for the dispatcher to catch up
+        self.reading_paused = False # Replies KMS sent meanwhile aren't read, so the heartbeat doesn't count them missed
+        self.rtt = None # Seconds, of the last heartbeat
+        self.rtt_avg = None # Moving average
+        self.rtt_min = None
+        self.rtt_max = None
+        self.metrics = ClientMetrics()
+        self.tracers = tuple(tracers or ()) # Replaced, never changed in place, so threads can iterate it without a lock
+
+        self.subscriptions_queue = Queue(self.MAX_QUEUED_EVENTS) # Holds subscriptions responses from server. None stops the dispatcher
+        self.listeners = {} # (subscriber object id, event type) -> EventBuffers of the callbacks. A subscriber of None matches every object
+        self.listeners_lock = threading.Lock()
+        self.callback_pool = callback_pool if callback_pool is not None else CallbackPool()
+
+        self.pending = {} # Futures of in-flight requests, keyed by JSON-RPC id. Completed by the listener thread
+        self.request_timeout = request_timeout
+        self.retry_policy = retry_policy
 
-        self.operations_queue = Queue() # Holds pending server responses
-        self.subscriptions_queue = Queue() # Holds subscriptions responses from server
-        self.tracking_q = Queue() # Contains None if all operations are finished
+        self.writer_queue = Queue() # Holds payloads waiting to be sent
 
-        self.thread = threading.Thread(target = self.listen_to_replies, args = (self.operations_queue, self.subscriptions_queue, self.tracking_q))
+        self.expiries = [] # Heap of (monotonic time, request id) of requests nobody blocks on, timed out by the expiry thread
+        self.expiries_cond = threading.Condition()
+
+        self.thread = threading.Thread(target = self.listen_to_replies, args = (self.subscriptions_queue,))
         self.thread.daemon = True
         self.thread.start()
 
-        self.thread1 = threading.Thread(target = self.main, args = (self.operations_queue, self.tracking_q))
-        self.thread1.daemon = True
-        self.thread1.start()
+        self.dispatcher_thread = threading.Thread(target = self.dispatch_events, args = (self.subscriptions_queue,))
+        self.dispatcher_thread.daemon = True
+        self.dispatcher_thread.start()
 
-        self.operations = [] # Holds pending server responses
-        self.subscriptions = [] # Holds responses from the server, initialised via subscription
+        self.writer_thread = threading.Thread(target = self.write_payloads, args = (self.writer_queue,))
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
 
-    
-    def main(self, operations_q, tracking_q):
-        try:
-            work = True
-            while work:
-                if((tracking_q.get() is None)):
-                    # No more info
-                    operations_q.join()
-                    tracking_q.join()
-                    work = False
+        self.expiry_thread = threading.Thread(target = self.expire_requests)
+        self.expiry_thread.daemon = True
+        self.expiry_thread.start()
 
-                else:
-                    operation = operations_q.get(block = True)
-                    self.operations.append(operation)
-                    tracking_q.put(True)
-        except Exception as e:
-           raise KurentoOperationException(e)
+        if heartbeat_interval is not None:
+            self.heartbeat_thread = threading.Thread(target = self.keep_alive)
+            self.heartbeat_thread.daemon = True
+            self.heartbeat_thread.start()
 
+        self.subscriptions = [] # Holds responses from the server, initialised via subscription
 
     def __del__(self):
         # Destructor
-        self.operations = []
+        if not hasattr(self, "writer_queue"):
+            return # The connection was never opened
+        self.writer_queue.put(None)
+        self.writer_thread.join()
+        self.close_connection()
         self.thread.join()
-        self.thread1.join()
-        self.kurento_conn.close()
+        with self.expiries_cond:
+            self.expiries_cond.notify_all()
+        self.expiry_thread.join()
+        self.kurento_conn.shutdown()
+        for buffers in list(self.listeners.values()):
+            for buffer in buffers:
+                buffer.close() # In case the dispatcher is blocked on a full one
+        self.subscriptions_queue.put(None)
+        self.dispatcher_thread.join()
+        self.callback_pool.shutdown()
+        if self.recorder is not None:
+            self.recorder.close()
 
-    def listen_to_replies(self, operations_q, subscriptions_q, tracking_q):
-        """ Seperate thread to listen for replies from the server
+    def listen_to_replies(self, subscriptions_q):
+        """ Seperate thread to listen for replies from the server. Reconnects when the connection drops
         """
 
-        while self.kurento_conn.connected:
-            try:
-                self.parse_reply(self.kurento_conn.recv(), operations_q, subscriptions_q, tracking_q)
-            except Exception as e:
-                raise KurentoOperationException(e)
+        try:
+            while True:
+                try:
+                    resp = self.kurento_conn.recv()
+                except Exception as e:
+                    if(self.closing or not self.recover_connection(e)):
+                        break
+                    continue
+
+                if not resp:
+                    continue # Control frames
+
+                if self.recorder is not None:
+                    self.recorder.received(resp)
+
+                try:
+                    self.parse_reply(resp, subscriptions_q)
+                except KurentoOperationException:
+                    logger.exception("Dropped a message from KMS that could not be parsed")
+        finally:
+            with self.state_cond:
+                self.connected = False
+                self.closing = True # Nothing reconnects from here on
+                self.state_cond.notify_all()
+
+            # Nobody else will complete what is still pending
+            self.fail_pending_requests(KurentoConnectionException("Connection to KMS was lost"))
 
 
     # Deconstruct JSONRPC replies & add to queue
-    def parse_reply(self, resp, operations_q, subscriptions_q, tracking_q):
+    def parse_reply(self, resp, subscriptions_q):
         """ Listens for server response & deconstructs
         """
 
         try:
-            if not self.kurento_conn.connected:
-                self.reconnect()
+            envelope = event_envelope(resp)
+            if envelope is not None:
+                # An event. Its data is only decoded if a listener reads it
+                what_event, subscriber = envelope
+                self.metrics.event(what_event)
+                self.registry.on_event(what_event, subscriber)
+                if(self.tracers or (subscriber, what_event) in self.listeners or (None, what_event) in self.listeners):
+                    self.queue_event(subscriptions_q, Event("onEvent", what_event, subscriber, time.monotonic(), frame = resp, decode = self.codec.loads))
+                else:
+                    self.events_skipped = self.events_skipped + 1
+                return
 
-            resp = json.loads(resp)
+            resp = self.codec.loads(resp)
 
             if("method" not in resp):
                 # Server responded to a request
@@ -94,177 +235,927 @@ class BaseKurentoClient(object):
 
                 if("error" in resp):
                     # An error occured
-                    transaction = {"resp_id": resp_id, "resp_success": False, "payload": resp["error"]}
+                    transaction = Response(resp_id, False, resp["error"])
 
                 elif("result" in resp):
                     # Server responded
-                    transaction = {"resp_id": resp_id, "resp_success": True, "payload": resp["result"]}
+                    transaction = Response(resp_id, True, resp["result"])
 
-                operations_q.put(transaction)    
+                    session_id = resp["result"].get("sessionId")
+                    if session_id is not None:
+                        self.session_ids.add(session_id)
+
+                self.resolve_request(transaction)
 
             elif("method" in resp):
                 # Server POSTed a message after subscription
                 sub_params = resp["params"]["value"]
-                subscription = {"method": resp["method"], "subscription_type": sub_params["type"], "subscriber": sub_params["object"], "payload": sub_params["data"]}
-                subscriptions_q.put(subscription)
-
-            else:
-                # No data
-                operations_q.put(None)
-                subscriptions_q.put(None)
-            
-            self.conn_id = self.conn_id + 1
-            tracking_q.put(True)
+                self.metrics.event(sub_params["type"])
+                self.registry.on_event(sub_params["type"], sub_params["object"])
+                self.queue_event(subscriptions_q, Event(resp["method"], sub_params["type"], sub_params["object"], time.monotonic(), sub_params["data"]))
 
         except Exception as e:
-            tracking_q.put(None)
-            subscriptions_q.put(None)
             raise KurentoOperationException(e)
 
+    def queue_event(self, subscriptions_q, event):
+        """ Hand an event to the dispatcher. While its queue is full, e.g. a 'block' EventBuffer is waiting on a slow callback, this waits, so a storm backs up in the socket instead of in memory
+        """
+
+        try:
+            subscriptions_q.put_nowait(event)
+            return
+        except Full:
+            pass
+
+        self.events_paused = self.events_paused + 1
+        self.reading_paused = True
+        try:
+            while not self.closing:
+                try:
+                    subscriptions_q.put(event, timeout = 0.1)
+                    return
+                except Full:
+                    continue
+        finally:
+            self.reading_paused = False
+
     # ===== UTILITY METHODS =====
+    def open_connection(self, kurento_server_url):
+        """ Open the websocket to KMS
+
+        Returns:
+            - Connected websocket.WebSocket object
+        """
+
+        conn = websocket.WebSocket()
+        conn.connect(kurento_server_url)
+        return conn
+
     def reconnect(self):
-        """ Reconnect to Kurento if connection was killed
+        """ Reconnect to Kurento if connection was killed. Opens a new websocket in place of the dead one
+
+        Returns:
+            - None once connected, otherwise the exception that stopped it
+        """
+
+        try:
+            conn = self.open_connection(self.kurento_url)
+        except Exception as e:
+            return e
+
+        with self.state_cond:
+            if self.closing:
+                conn.abort()
+                return KurentoConnectionException("Connection was closed while reconnecting")
+
+            dead, self.kurento_conn = self.kurento_conn, conn
+            self.generation = self.generation + 1
+            self.connected = True
+            self.state_cond.notify_all()
+
+        dead.shutdown()
+
+    def recover_connection(self, reason):
+        """ Called by the listener thread when the connection drops. Reconnects per the reconnect policy, then resumes the KMS sessions in another thread
+
+        Params:
+            reason (Exception): Why the connection dropped
+
+        Returns:
+            - True once reconnected. False if the client is closing or gave up
         """
 
-        if not self.kurento_conn.connected:
+        with self.state_cond:
+            self.connected = False
+            self.disconnects = self.disconnects + 1
+
+        logger.warning(f"Connection to KMS lost: {reason}")
+
+        if(self.in_flight_policy == self.FAIL):
+            self.fail_pending_requests(KurentoConnectionException(f"Connection to KMS was lost: {reason}"))
+
+        if self.reconnect_policy is None:
+            return False
+
+        retry = 0
+        while True:
+            # Jittered, so that clients dropped together don't all come back at once
+            if self.wait_unless_closing(self.reconnect_policy.delay(retry)):
+                return False
+
+            error = self.reconnect()
+            if error is None:
+                break
+
+            if not self.reconnect_policy.should_retry(retry, KurentoConnectionException(error)):
+                logger.error(f"Gave up reconnecting to KMS after {retry + 1} attempts: {error}")
+                return False
+
+            retry = retry + 1
+
+        self.reconnects = self.reconnects + 1
+        logger.info(f"Reconnected to KMS after {retry + 1} attempts")
+
+        # The listener has to get back to reading replies, so the resuming happens elsewhere
+        resume = threading.Thread(target = self.resume_sessions)
+        resume.daemon = True
+        resume.start()
+
+        return True
+
+    def resume_sessions(self):
+        """ Re-attach the KMS sessions of this connection to the new websocket with the 'connect' method, so their media objects & subscriptions carry on. Then replay held requests
+        """
+
+        for session_id in list(self.session_ids):
+            req_id = self.next_request_id()
             try:
-                self.kurento_conn.connect(self.kurento_url)
+                resp = self.request_nowait(rpc_payload("connect", req_id, {"sessionId": session_id}, self.codec), req_id, "connect", {"sessionId": session_id}).result(self.request_timeout)
             except Exception as e:
-                return e
+                self.request_timed_out(req_id)
+                logger.warning(f"Could not resume KMS session {session_id}: {e}")
+                continue
+
+            if(resp["resp_success"]):
+                self.sessions_resumed = self.sessions_resumed + 1
+            else:
+                # Expired. Its media objects are gone
+                self.session_ids.discard(session_id)
+                logger.warning(f"KMS could not resume session {session_id}: {resp['payload'].get('message')}")
+
+        if(self.in_flight_policy == self.REPLAY):
+            self.replay_pending()
+
+    def replay_pending(self):
+        """ Re-send the in-flight requests not yet written to the current connection, in the order they were made
+
+        Requests never written, & no longer waiting for the writer, are sent. Ones written to the dead connection are only re-sent if they're idempotent, as KMS may have carried them out already. The others fail with KurentoConnectionException
+        """
+
+        generation = self.generation
+        for req_id, fut in sorted(list(self.pending.items())):
+            if(fut.load is None or fut.generation == generation or fut.queued):
+                continue # Nothing to send, already sent, or about to be
+
+            if(fut.generation is None or RetryPolicy.is_idempotent(fut.method, fut.params or {})):
+                self.send_payload(fut.load, req_id)
+            elif self.pending.pop(req_id, None) is not None:
+                self.request_failed(fut, "connection")
+                if not fut.done():
+                    fut.set_exception(KurentoConnectionException(f"Connection to KMS was lost after request {req_id} was sent. Not re-sent, as KMS may have carried it out"))
+
+    def wait_unless_closing(self, seconds):
+        """ Sleep, waking up early if the connection is closed
+
+        Returns:
+            - True if the connection is closing
+        """
+
+        with self.state_cond:
+            return self.state_cond.wait_for(lambda: self.closing, seconds)
+
+    def keep_alive(self):
+        """ Seperate thread that pings KMS every heartbeat_interval & records the round trip time. Too many unanswered pings drop the connection, which makes the listener reconnect
+        """
+
+        missed = 0
+        while not self.wait_unless_closing(self.heartbeat_interval):
+            if not self.connected:
+                continue
+
+            conn = self.kurento_conn
+            req_id = self.next_request_id()
+            sent_at = time.monotonic()
+            try:
+                # 'interval' tells KMS how long to keep the session once pings stop
+                self.request_nowait(rpc_payload("ping", req_id, {"interval": int(self.heartbeat_interval * 3000)}, self.codec), req_id, "ping").result(self.heartbeat_interval)
+            except concurrent.futures.TimeoutError:
+                self.request_timed_out(req_id)
+                if self.reading_paused:
+                    missed = 0 # KMS likely answered; the reply is waiting behind the events
+                    continue
+                self.heartbeats_missed = self.heartbeats_missed + 1
+                missed = missed + 1
+                if(missed >= self.HEARTBEAT_MISSES):
+                    logger.warning(f"KMS missed {missed} heartbeats in a row")
+                    missed = 0
+                    conn.abort() # Wakes up the listener thread, which reconnects
+                continue
+            except Exception:
+                missed = 0 # Connection already lost; the listener deals with it
+                continue
+
+            missed = 0
+            self.record_rtt(time.monotonic() - sent_at)
+
+    def record_rtt(self, rtt):
+        """ Track the round trip time of a heartbeat
+        """
+
+        self.rtt = rtt
+        self.rtt_avg = rtt if self.rtt_avg is None else 0.8 * self.rtt_avg + 0.2 * rtt
+        self.rtt_min = rtt if self.rtt_min is None else min(self.rtt_min, rtt)
+        self.rtt_max = rtt if self.rtt_max is None else max(self.rtt_max, rtt)
+
+    def connection_stats(self):
+        """ Health of the connection to KMS
+
+        Returns:
+            - Dict with whether it's connected, disconnect, reconnect & resumed session counts, missed heartbeats, times reading paused for the event dispatcher, and heartbeat round trip times in seconds (last, average, min, max)
+        """
+
+        return {
+            "connected": self.connected,
+            "disconnects": self.disconnects,
+            "reconnects": self.reconnects,
+            "sessions_resumed": self.sessions_resumed,
+            "heartbeats_missed": self.heartbeats_missed,
+            "events_paused": self.events_paused,
+            "rtt": self.rtt,
+            "rtt_avg": self.rtt_avg,
+            "rtt_min": self.rtt_min,
+            "rtt_max": self.rtt_max
+        }
+
+    def metrics_gauges(self):
+        """ Point-in-time values for the metrics
+
+        Returns:
+            - Dict of metric name -> (Prometheus type, help, value)
+        """
+
+        pending = list(self.pending.values())
+        registry = self.registry.stats()
+        return {
+            "requests_in_flight": ("gauge", "Requests written to the socket & waiting for a reply", len([fut for fut in pending if fut.generation is not None])),
+            "pending_requests": ("gauge", "Entries in the table of requests waiting for a reply, including ones not yet written", len(pending)),
+            "writer_queue_depth": ("gauge", "Payloads waiting for the writer thread", self.writer_queue.qsize()),
+            "event_queue_depth": ("gauge", "Events waiting for the dispatcher thread", self.subscriptions_queue.qsize()),
+            "event_buffer_depth": ("gauge", "Events waiting in listeners' buffers", sum(len(buffer) for buffers in list(self.listeners.values()) for buffer in buffers)),
+            "callback_queue_depth": ("gauge", "Callbacks waiting for the callback pool", self.callback_pool.queue_depth()),
+            "connected": ("gauge", "1 while connected to KMS", int(self.connected)),
+            "disconnects_total": ("counter", "Times the connection to KMS dropped", self.disconnects),
+            "reconnects_total": ("counter", "Times the connection to KMS was re-established", self.reconnects),
+            "sessions_resumed_total": ("counter", "KMS sessions resumed after a reconnect", self.sessions_resumed),
+            "heartbeats_missed_total": ("counter", "Heartbeat pings KMS did not answer in time", self.heartbeats_missed),
+            "events_skipped_total": ("counter", "Events dropped undecoded because nothing listened for them", self.events_skipped),
+            "events_paused_total": ("counter", "Times reading from KMS paused until the event dispatcher caught up", self.events_paused),
+            "heartbeat_rtt_seconds": ("gauge", "Round trip time of the last heartbeat", self.rtt),
+            "registry_objects": ("gauge", "Media objects in the client's registry", registry["objects"]),
+            "property_cache_hits_total": ("counter", "Media object reads answered from the registry's cache", registry["hits"]),
+            "property_cache_misses_total": ("counter", "Media object reads sent to KMS", registry["misses"]),
+            "property_reads_coalesced_total": ("counter", "Media object reads that shared a request already in flight", registry["coalesced"])
+        }
+
+    def metrics_snapshot(self):
+        """ What the client is doing, as a dict. Cheap enough to poll
+
+        Returns:
+            - Dict with request latency percentiles (estimated from histograms) & failure counts by method & operation, event totals & rates by type, in-flight & pending request counts, queue depths, and reconnect counts
+        """
+
+        return self.metrics.snapshot({name: value for name, (_, _, value) in self.metrics_gauges().items()})
+
+    def metrics_prometheus(self, labels = None):
+        """ The client's metrics in the Prometheus text exposition format, e.g. to serve from a /metrics endpoint
+
+        Params:
+            labels (dict): Labels added to every sample
+
+        Returns:
+            - str
+        """
+
+        return prometheus_text(self.metrics.samples(self.metrics_gauges(), labels))
 
     def close_connection(self):
         """ Close an existing connection to Kurento
         """
 
-        if(self.kurento_conn.connected):
-            self.kurento_conn.close()
+        with self.state_cond:
+            self.closing = True
+            self.state_cond.notify_all()
+
+        conn = self.kurento_conn
+        if(conn.connected):
+            try:
+                conn.send_close()
+            finally:
+                conn.abort() # Wakes up the listener thread
 
-    def send_payload(self, payload):
-        """ Websockets send with delay
+    def send_payload(self, payload, req_id = None):
+        """ Queue a payload for the writer thread. Returns immediately
+
+        Params:
+            payload (str or bytes): Serialised JSON-RPC payload
+            req_id (int): Id of the pending request to fail if the payload can't be sent
         """
 
-        try:
-            self.kurento_conn.send(payload)
-            time.sleep(0.005) # Wait for reply
-        except Exception as e:
-            return e
+        fut = None if req_id is None else self.pending.get(req_id)
+        if fut is not None:
+            fut.queued = True
+        self.writer_queue.put((payload, req_id))
+
+    def write_payloads(self, writer_q):
+        """ Seperate thread to send queued payloads to the server
+
+        Frames queued while a write is in progress are sent together in a single socket write
+        """
+
+        work = True
+        while work:
+            batch = [writer_q.get()]
+            while not writer_q.empty():
+                batch.append(writer_q.get_nowait())
+
+            if None in batch:
+                # Told to stop. Send what came before
+                batch = batch[:batch.index(None)]
+                work = False
+
+            if(work and self.in_flight_policy == self.REPLAY):
+                # Hold the batch while reconnecting
+                with self.state_cond:
+                    self.state_cond.wait_for(lambda: self.connected or self.closing)
+
+            with self.state_cond:
+                conn, generation = self.kurento_conn, self.generation
+
+            sending = []
+            taken = set()
+            for payload, req_id in batch:
+                fut = None if req_id is None else self.pending.get(req_id)
+                if(req_id is not None and (fut is None or fut.generation == generation or req_id in taken)):
+                    continue # Timed out, already replayed on this connection, or queued twice
+
+                if fut is not None:
+                    fut.queued = False
+                    taken.add(req_id)
+                sending.append((payload, fut))
+
+            if sending:
+                if self.tracers:
+                    # Before the write, so a quick reply always finds its trace record
+                    self.trace_sent([fut for _, fut in sending if fut is not None])
+
+                try:
+                    self.send_frames([payload for payload, _ in sending], conn)
+                except Exception as e:
+                    if(self.in_flight_policy == self.REPLAY and not self.closing):
+                        with self.state_cond:
+                            reconnected = self.generation != generation
+                        if reconnected:
+                            # replay_pending() may have passed them over while they were queued. Never written, so safe to send
+                            for payload, fut in sending:
+                                if fut is not None:
+                                    self.send_payload(payload, fut.req_id)
+                        continue # Still pending. Replayed once reconnected
+
+                    for _, fut in sending:
+                        if(fut is not None and self.pending.pop(fut.req_id, None) is not None and not fut.done()):
+                            self.request_failed(fut, "connection")
+                            fut.set_exception(KurentoConnectionException(e))
+                    continue
+
+                for _, fut in sending:
+                    if fut is not None:
+                        fut.generation = generation
+
+    def send_frames(self, payloads, conn = None):
+        """ Write several text frames to the socket at once
+        """
+
+        conn = conn if conn is not None else self.kurento_conn
+        data = b"".join(websocket.ABNF.create_frame(payload, websocket.ABNF.OPCODE_TEXT).format() for payload in payloads)
+        with conn.lock: # Same lock WebSocket.send() takes
+            if not conn.connected:
+                raise websocket.WebSocketConnectionClosedException("Connection to KMS is closed")
+            if self.recorder is not None:
+                self.recorder.sent(payloads) # Before the write, so a quick reply is never recorded ahead of its request
+            while data:
+                sent = conn._send(data)
+                data = data[sent:]
+
+    def next_request_id(self):
+        """ Allocate the id of a new request
+        """
+
+        return next(self.request_ids)
+
+    def register_request(self, req_id, load = None, method = None, params = None):
+        """ Add a pending request to the table of in-flight requests
+
+        Params:
+            req_id (int): JSON-RPC id of the request about to be sent
+            load (str or bytes): Serialised payload, kept for replaying the request after a reconnect
+            method (str): JSON-RPC method, to measure & trace the request by
+            params (dict): The request's params, for the invoke operation & object id
+
+        Returns:
+            - Future completed with the response dict once the server replies
+        """
+
+        fut = PendingRequest(req_id, load, method, params, contextvars.copy_context() if self.tracers else None)
+        self.pending[req_id] = fut
+        return fut
+
+    def resolve_request(self, transaction):
+        """ Complete the future waiting on a server response. Responses to unknown ids are dropped
+        """
+
+        fut = self.pending.pop(transaction["resp_id"], None)
+        if(fut is not None and not fut.done()): # Done if its caller cancelled it, e.g. an async caller that stopped waiting
+            if fut.method is not None:
+                now = time.monotonic()
+                self.metrics.observe(fut.method, fut.operation, now - fut.created_at)
+                if not transaction["resp_success"]:
+                    self.metrics.failed(fut.method, fut.operation, "error")
+                if fut.trace is not None:
+                    if(fut.method == "create" and transaction["resp_success"]):
+                        fut.trace["object"] = transaction["payload"]["value"] # The id of what was created
+                    self.trace_done(fut, now, None if transaction["resp_success"] else "error")
+            try:
+                fut.set_result(transaction)
+            except concurrent.futures.InvalidStateError:
+                pass # Cancelled since the check above
+
+    def fail_pending_requests(self, exc):
+        """ Fail every in-flight request with the exception given
+        """
+
+        while True:
+            try:
+                _, fut = self.pending.popitem()
+            except KeyError:
+                break # Empty, maybe emptied by another thread between popitem()s. The table is shared by reference, e.g. by pooled sessions, so it isn't swapped out
+
+            if not fut.done():
+                self.request_failed(fut, "connection")
+                fut.set_exception(exc)
 
     def get_response_from_queue(self, req_id):
-        """ Find response dict from list of dicts by request id
+        """ Wait for the response to a pending request by request id
         """
 
-        resp = next((x for x in self.operations if x["resp_id"] == req_id), "ERROR: Operation not in queue")
-        return resp
+        fut = self.pending.get(req_id)
+        if fut is None:
+            return "ERROR: Operation not in queue"
+
+        return fut.result()
 
     def remove_response_from_queue(self, resp):
-        """ Remove response dict from list of dicts
+        """ Remove a request from the table of in-flight requests
         """
 
-        self.operations = [op for op in self.operations if op != resp]
+        self.pending.pop(resp["resp_id"], None)
+
+    def request_nowait(self, load, req_id, method = None, params = None):
+        """ Send a JSON-RPC payload without waiting for the reply
+
+        Params:
+            load (str or bytes): Serialised JSON-RPC payload
+            req_id (int): The id in the payload
+            method (str): JSON-RPC method, for metrics & tracing
+            params (dict): The params in the payload, for metrics & tracing
+
+        Returns:
+            - Future completed with the response dict
+        """
+
+        fut = self.register_request(req_id, load, method, params) # Before sending so that a fast reply can't be missed
+        self.send_payload(load, req_id)
+        return fut
+
+    def request(self, load, req_id, timeout = None, method = None, params = None):
+        """ Send a JSON-RPC payload and block until the server replies to it
+
+        Params:
+            load (str or bytes): Serialised JSON-RPC payload
+            req_id (int): The id in the payload
+            timeout (float): Seconds to wait for the reply. Defaults to the client's request_timeout
+            method (str): JSON-RPC method, for metrics & tracing
+            params (dict): The params in the payload, for metrics & tracing
+
+        Returns:
+            - Response dict
+        """
+
+        timeout = self.time_left(timeout) # Before sending, so nothing is sent once the deadline has passed
+        return self.wait_for_reply(self.request_nowait(load, req_id, method, params), req_id, timeout)
+
+    def wait_for_reply(self, fut, req_id, timeout):
+        """ Wait for the future of a pending request. A late reply is dropped
+        """
+
+        try:
+            return fut.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self.request_timed_out(req_id)
+            raise KurentoTimeoutException(f"KMS did not reply to request {req_id} within {timeout:.3f}s")
+
+    def request_timed_out(self, req_id):
+        """ Forget a request whose caller stopped waiting. A late reply is dropped
+        """
+
+        fut = self.pending.pop(req_id, None)
+        if fut is not None:
+            self.request_failed(fut, "timeout")
+            if not fut.done():
+                # Releases anyone else waiting on it, e.g. reads coalesced by the registry
+                fut.set_exception(KurentoTimeoutException(f"KMS did not reply to request {req_id} in time"))
+
+    def expire_after(self, req_id, timeout):
+        """ Time out a request nobody blocks on if KMS hasn't replied within timeout seconds
+        """
+
+        with self.expiries_cond:
+            heapq.heappush(self.expiries, (time.monotonic() + timeout, req_id))
+            if(self.expiries[0][1] == req_id):
+                self.expiries_cond.notify() # Sooner than what the expiry thread waits for
+
+    def expire_requests(self):
+        """ Seperate thread that times out the requests given to expire_after() once their time is up
+        """
+
+        while True:
+            with self.expiries_cond:
+                while True:
+                    if self.closing:
+                        return
+                    now = time.monotonic()
+                    if(self.expiries and self.expiries[0][0] <= now):
+                        break
+                    self.expiries_cond.wait(self.expiries[0][0] - now if self.expiries else None)
+
+                expired = []
+                while(self.expiries and self.expiries[0][0] <= now):
+                    expired.append(heapq.heappop(self.expiries)[1])
+
+            for req_id in expired:
+                self.request_timed_out(req_id) # Nothing happens for those already answered
+
+    def request_cancelled(self, req_id):
+        """ Forget a request whose caller was cancelled, e.g. an async caller that stopped waiting. A late reply is dropped
+        """
+
+        fut = self.pending.pop(req_id, None)
+        if fut is not None:
+            self.request_failed(fut, "cancelled")
+
+    def request_failed(self, fut, reason):
+        """ Count & trace a request that won't get a reply. reason is 'timeout', 'connection' or 'cancelled'
+        """
+
+        if fut.method is not None:
+            self.metrics.failed(fut.method, fut.operation, reason)
+            if fut.trace is not None:
+                self.trace_done(fut, time.monotonic(), reason)
+
+    def add_tracer(self, tracer):
+        """ Tell a Tracer about every request, reply & event from now on. Requests made before it was added aren't traced
+
+        Params:
+            tracer (Tracer): e.g. a SpanRecorder or an OpenTelemetryTracer
+        """
+
+        self.tracers = self.tracers + (tracer,)
+
+    def remove_tracer(self, tracer):
+        """ Stop telling a Tracer about requests, replies & events
+        """
+
+        self.tracers = tuple(t for t in self.tracers if t is not tracer)
+
+    def trace(self, hook, record):
+        # Tracers must not take down the client's threads
+        for tracer in self.tracers:
+            try:
+                getattr(tracer, hook)(record)
+            except Exception:
+                logger.exception(f"Tracer {tracer} failed in {hook}")
+
+    def trace_sent(self, futs):
+        """ Tell the tracers about requests about to be written to the socket. Writer thread
+        """
+
+        now = time.monotonic()
+        for fut in futs:
+            if fut.method is None:
+                continue
+
+            if fut.trace is not None:
+                fut.trace["sent_at"] = now # Replayed
+                continue
+
+            params = fut.params or {}
+            fut.trace = {
+                "id": fut.req_id,
+                "method": fut.method,
+                "operation": fut.operation,
+                "object": params.get("object", params.get("type")),
+                "session": params.get("sessionId"),
+                "params": params,
+                "created_at": fut.created_at,
+                "sent_at": now,
+                "context": fut.context
+            }
+            self.trace("on_request_sent", fut.trace)
+
+    def trace_done(self, fut, now, error):
+        """ Tell the tracers about a request that got its reply or failed
+        """
+
+        record = fut.trace
+        record["received_at"] = now
+        record["success"] = error is None
+        record["error"] = error
+        self.trace("on_response_received", record)
+
+    def time_left(self, timeout = None):
+        """ Seconds a request may wait for its reply: the timeout given, or request_timeout, capped by any deadline() in force
+
+        Returns:
+            - Seconds, or None to wait forever
+        """
+
+        timeout = timeout if timeout is not None else self.request_timeout
+
+        deadline = request_deadline.get()
+        if deadline is not None:
+            left = deadline - time.monotonic()
+            if(left <= 0):
+                raise KurentoTimeoutException("Deadline passed before the request was sent")
+            timeout = left if timeout is None else min(timeout, left)
+
+        return timeout
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """ Cap the time that all the requests made inside a with block may take together. Nested deadlines can only shorten it
 
+        Example:
+            with client.deadline(2.5):
+                rtc = pipeline.add_endpoint("WebRtcEndpoint")
+                sdp_answer = rtc.process_offer(sdp_offer)
+
+        Params:
+            seconds (float): Time from now until the deadline
+        """
+
+        at = time.monotonic() + seconds
+        outer = request_deadline.get()
+        token = request_deadline.set(at if outer is None else min(outer, at))
+        try:
+            yield
+        finally:
+            request_deadline.reset(token)
+
+    def _with_retries(self, attempt, idempotent):
+        """ Make a request by calling attempt(), retrying it per the retry policy if it's idempotent
+        """
+
+        if(self.retry_policy is None or not idempotent):
+            return attempt()
+
+        retry = 0
+        while True:
+            try:
+                return attempt()
+            except KurentoOperationException as e:
+                if not self.retry_policy.should_retry(retry, e):
+                    raise
+
+                time.sleep(self.retry_policy.delay(retry))
+                retry = retry + 1
+
+    def _then(self, resp, func):
+        """ Apply func to the result of a request. Clients whose requests return awaitables chain func instead
+        """
+
+        return func(resp)
+
+    def _chain(self, fut, func):
+        """ Future of func applied to the result of another future. Exceptions are passed along
+        """
+
+        chained = Future()
+        chained.req_id = getattr(fut, "req_id", None) # So gather() can time out the request behind it
+
+        def done(f):
+            try:
+                chained.set_result(func(f.result()))
+            except Exception as e:
+                chained.set_exception(e)
+
+        fut.add_done_callback(done)
+        return chained
+
+    def gather(self, futures, timeout = None):
+        """ Wait for several requests sent with send_request() or the *_nowait() methods
+
+        Params:
+            futures (list): Futures to wait for
+            timeout (float): Seconds to wait for all of them. Defaults to the client's request_timeout
+
+        Returns:
+            - List of results, in the same order. The first failed request raises its exception
+        """
+
+        timeout = self.time_left(timeout)
+        end = None if timeout is None else time.monotonic() + timeout
+
+        results = []
+        try:
+            for fut in futures:
+                results.append(fut.result(None if end is None else max(0, end - time.monotonic())))
+        except concurrent.futures.TimeoutError:
+            # Nobody waits for the rest any more. Their late replies are dropped
+            for fut in futures:
+                if(not fut.done() and getattr(fut, "req_id", None) is not None):
+                    self.request_timed_out(fut.req_id)
+            raise KurentoTimeoutException(f"KMS did not reply to every request within {timeout:.3f}s")
+
+        return results
 
     def ping(self):
         """ Make a ping request to the server
         """
-        
-        req_id = self.conn_id + 1
-        load = rpc_payload("ping", req_id, {})
-        self.send_payload(load)
-
-        # Get from queue
-        no_success = True
-        while no_success:
-            resp = self.get_response_from_queue(req_id)
-            if("resp_success" in resp):
-                no_success = False
-
-        # Remove from queue
-        self.remove_response_from_queue(resp)
-        
-        # Parse and return
-        if(resp["resp_success"]):
-            print("pong")
-        else:
-            payload = resp["payload"]
-            raise KurentoOperationException(f"Error: Code: {payload['code']} Message: {payload['message']}")
+
+        def attempt():
+            req_id = self.next_request_id()
+            return self.request(rpc_payload("ping", req_id, {}, self.codec), req_id, method = "ping", params = {})
+
+        def pong(resp):
+            if(resp["resp_success"]):
+                print("pong")
+            else:
+                payload = resp["payload"]
+                raise KurentoOperationException(f"Error: Code: {payload['code']} Message: {payload['message']}")
+
+        return self._then(self._with_retries(attempt, True), pong)
 
     # ===== API METHODS =====
 
+    def send_request(self, method, params):
+        """ Send a JSON-RPC request without waiting for the reply. Many requests can be in flight at once. Unanswered requests fail with KurentoTimeoutException after request_timeout, or at the deadline() in force
+
+        Params:
+            method (str): JSON-RPC method e.g. create, invoke, subscribe, release
+            params (dict): The request's params
+
+        Returns:
+            - Future completed with the response dict
+        """
+
+        timeout = self.time_left()
+        req_id = self.next_request_id()
+        load = self.invoke_payload(req_id, params) if method == "invoke" else rpc_payload(method, req_id, params, self.codec)
+        fut = self.request_nowait(load, req_id, method, params)
+        if timeout is not None:
+            self.expire_after(req_id, timeout)
+        return fut
+
+    def invoke_payload(self, req_id, params):
+        """ Serialise an invoke. Operations called over & over on one element, e.g. addIceCandidate, reuse a template of the payload so only the changing param is serialised
+        """
+
+        op_params = params.get("operationParams")
+        field = self.TEMPLATED.get(params.get("operation")) if self.codec.templated else None
+        if(field is None or len(params) != 4 or not isinstance(op_params, dict) or len(op_params) != 1 or field not in op_params):
+            return rpc_payload("invoke", req_id, params, self.codec)
+
+        key = (params.get("object"), params["operation"], params.get("sessionId"))
+        template = self.templates.get(key)
+        if template is None:
+            if(len(self.templates) >= self.MAX_TEMPLATES):
+                self.templates.clear()
+            template = self.templates[key] = PayloadTemplate(self.codec, params, field)
+
+        return template.render(req_id, op_params[field])
+
+    def forget_templates(self, object_id):
+        # Drop the templates of a released media object. Releasing a pipeline releases its elements too, whose ids start with the pipeline's
+        prefix = f"{object_id}/"
+        for key in [key for key in list(self.templates) if key[0] == object_id or str(key[0]).startswith(prefix)]:
+            self.templates.pop(key, None)
+
     def _get_response(func):
         def wrapper(self, params):
-            load, req_id = func(self, params)
-            self.send_payload(load)
-            resp = self.get_response_from_queue(req_id)
-            self.remove_response_from_queue(resp)
-            return resp
+            def attempt():
+                # A fresh id per attempt, so a late reply to an earlier one can't be mistaken for it
+                load, req_id = func(self, params)
+                return self.request(load, req_id, method = func.__name__, params = params)
+
+            return self._with_retries(attempt, RetryPolicy.is_idempotent(func.__name__, params))
 
         return wrapper
 
     @_get_response
     def create(self, params):
         # Create a KMS Media Elements & Media Pipelines
-        req_id = self.conn_id + 1
-        load = rpc_payload("create", req_id, params)
+        req_id = self.next_request_id()
+        load = rpc_payload("create", req_id, params, self.codec)
         return load, req_id
 
     @_get_response
     def invoke(self, params):
-        req_id = self.conn_id + 1
-        load = rpc_payload("invoke", req_id, params)
+        req_id = self.next_request_id()
+        load = self.invoke_payload(req_id, params)
         return load, req_id
 
     @_get_response
     def subscribe(self, params):
-        req_id = self.conn_id + 1
-        load = rpc_payload("subscribe", req_id, params)
+        req_id = self.next_request_id()
+        load = rpc_payload("subscribe", req_id, params, self.codec)
         return load, req_id
 
     
-    def parse_on_events(self, subs_q, tracking_q, callback, what_event):
-        try:
-            event = True
-            while event:
-                if((tracking_q.get() is None)):
-                    # No more info
-                    subs_q.join()
-                    tracking_q.join()
-                    event = False
+    def dispatch_events(self, subs_q):
+        """ Seperate thread to hand each event to the callbacks listening for it. Callbacks run in the callback pool, in order per media object
+        """
 
-                else:
-                    subscription = subs_q.get(block = True)
-                    if subscription is None:
-                        subs_q.join()
-                        event = False
+        while True:
+            subscription = subs_q.get()
+            if subscription is None:
+                break
 
+            what_event = subscription["subscription_type"]
+            if self.tracers:
+                self.trace("on_event_received", EventRecord(subscription))
+            buffers = self.listeners.get((subscription["subscriber"], what_event), []) + self.listeners.get((None, what_event), [])
+            for buffer in buffers:
+                buffer.offer(subscription)
 
-                    # Ugly hack for when there are multiple event listeners for different events i.e. if not needed here, put back into queue
-                    if(subscription["subscription_type"] == what_event):
-                        callback(subscription)
-                    else:
-                        subs_q.put(subscription)
+            subs_q.task_done()
 
-                    tracking_q.put(True)
-        except Exception as e:
-           raise KurentoOperationException(e)
+    def on_event(self, what_event, callback, subscriber = None, buffer = None):
+        """ Listen for events of a type. If subscriber (a media object id) is given, only its events are delivered
+
+        Params:
+            what_event (str): Event type
+            callback (func): Called with each event, in the callback pool
+            subscriber (str): Media object id
+            buffer (EventBuffer): Holds the events waiting for the callback. Defaults to an unbounded buffer
+        """
 
-    def on_event(self, what_event, callback):
-        def cb(sub_resp):
-            callback(sub_resp)
+        key = (subscriber, what_event)
+        buffer = buffer if buffer is not None else EventBuffer()
 
-        sub_thread = threading.Thread(target = self.parse_on_events, args = (self.subscriptions_queue, self.tracking_q, cb, what_event))
-        sub_thread.daemon = True
-        sub_thread.start()
+        # Callbacks of one element share an ordering key. Listeners for every element get their own
+        buffer.attach(callback, self.callback_pool, subscriber if subscriber is not None else buffer)
 
-        return sub_thread
+        with self.listeners_lock:
+            # Replaced rather than appended to, so the dispatcher never sees a list being changed
+            self.listeners[key] = self.listeners.get(key, []) + [buffer]
+
+    def off_event(self, what_event, callback, subscriber = None):
+        """ Stop calling a callback added with on_event(). Events still waiting for it are dropped
+        """
+
+        key = (subscriber, what_event)
+        with self.listeners_lock:
+            buffers = []
+            for buffer in self.listeners.get(key, []):
+                if buffer.callback is callback:
+                    buffer.close()
+                else:
+                    buffers.append(buffer)
+
+            if buffers:
+                self.listeners[key] = buffers
+            else:
+                self.listeners.pop(key, None)
+
+    def forget_listeners(self, object_id):
+        # Drop the listeners of a released media object. Releasing a pipeline releases its elements too, whose ids start with the pipeline's
+        prefix = f"{object_id}/"
+        with self.listeners_lock:
+            for key in [key for key in list(self.listeners) if key[0] is not None and (key[0] == object_id or str(key[0]).startswith(prefix))]:
+                for buffer in self.listeners.pop(key):
+                    buffer.close()
+
+    def event_stats(self):
+        """ Per-listener event buffer counters
+
+        Returns:
+            - List of dicts with the subscriber, event type & EventBuffer.stats() of every listener
+        """
+
+        return [dict(subscriber = subscriber, event = what_event, **buffer.stats()) for (subscriber, what_event), buffers in list(self.listeners.items()) for buffer in buffers]
 
     @_get_response
     def unsubscribe(self, params):
-        pass
+        req_id = self.next_request_id()
+        load = rpc_payload("unsubscribe", req_id, params, self.codec)
+        return load, req_id
 
     @_get_response
     def release(self, params):
-        req_id = self.conn_id + 1
-        load = rpc_payload("release", req_id, params)
+        req_id = self.next_request_id()
+        load = rpc_payload("release", req_id, params, self.codec)
+        self.forget_templates(params.get("object"))
+        self.forget_listeners(params.get("object"))
+        self.registry.forget(params.get("object"))
         return load, req_id
 
 
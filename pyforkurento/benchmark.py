@@ -0,0 +1,336 @@
+# Benchmarks of the client's hot paths. Run with: python -m pyforkurento.benchmark
+import argparse
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+from .client import KurentoClient
+from .endpoints import WebRTCEndpoint
+from .events import Event
+from .fake_kms import FakeKurentoServer
+from .parse_payloads import Response
+from .parse_payloads import rpc_payload
+from .stats import StatsSampler
+
+ICE_CANDIDATE = {"candidate": "candidate:1 1 UDP 2122252543 192.168.1.2 54321 typ host", "sdpMid": "0", "sdpMLineIndex": 0}
+
+
+def percentile(samples, pct):
+    """ Nearest-rank percentile of a list of numbers
+    """
+
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def summarise(latencies, elapsed, **extra):
+    """ Throughput & latency percentiles of a run
+
+    Params:
+        latencies (list): Seconds taken by each operation
+        elapsed (float): Wall clock seconds of the whole run
+        extra: Other numbers to report
+
+    Returns:
+        - Dict with ops, ops_per_s, p50_ms, p99_ms & the extras
+    """
+
+    ms = lambda s: None if s is None else round(s * 1000, 3)
+    return dict({
+        "ops": len(latencies),
+        "ops_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p99_ms": ms(percentile(latencies, 99))
+    }, **extra)
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def bench_rpc(client, requests):
+    """ Sequential invoke round trips from one thread
+    """
+
+    pipeline = client.create_media_pipeline()
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+
+    start = time.perf_counter()
+    latencies = [timed(rtc.add_ice_candidate, ICE_CANDIDATE) for _ in range(requests)]
+    elapsed = time.perf_counter() - start
+
+    pipeline.dispose()
+    return summarise(latencies, elapsed)
+
+def bench_serialise(client, requests):
+    """ Building addIceCandidate payloads, with & without the client's templates. No socket involved
+    """
+
+    params = {"object": "pipeline/rtc", "operation": "addIceCandidate", "operationParams": {"candidate": ICE_CANDIDATE}, "sessionId": "session"}
+    plain = lambda: [rpc_payload("invoke", i, params, client.codec) for i in range(requests)]
+    templated = lambda: [client.invoke_payload(i, params) for i in range(requests)]
+
+    plain_s, templated_s = timed(plain), timed(templated)
+    client.forget_templates("pipeline/rtc")
+
+    return {
+        "codec": client.codec.name,
+        "plain_us": round(plain_s * 1e6 / requests, 2),
+        "templated_us": round(templated_s * 1e6 / requests, 2)
+    }
+
+def bench_concurrent(client, requests, threads, kms = None):
+    """ Many threads sharing one client & one pipeline, alternating between element types. Also a stress test: every reply has to reach its own caller, and no element may get another's constructor params
+    """
+
+    pipeline = client.create_media_pipeline()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def work(worker):
+        mine = []
+        for i in range(requests // threads):
+            try:
+                if((worker + i) % 2):
+                    start = time.perf_counter()
+                    elem = pipeline.add_endpoint("PlayerEndpoint", uri = f"rtsp://camera/{worker}/{i}")
+                    mine.append(time.perf_counter() - start)
+                    expected = "PlayerEndpoint"
+                else:
+                    start = time.perf_counter()
+                    elem = pipeline.add_endpoint("WebRtcEndpoint")
+                    mine.append(time.perf_counter() - start)
+                    expected = "WebRtcEndpoint"
+
+                if not elem.elem_id.endswith(expected):
+                    errors.append(f"Asked for a {expected}, got {elem.elem_id}")
+            except Exception as e:
+                errors.append(repr(e))
+
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target = work, args = (worker,)) for worker in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    leaked = None
+    if kms is not None:
+        creates = [r["params"] for r in kms.requests if r["method"] == "create" and r["params"]["type"] == "WebRtcEndpoint"]
+        leaked = len([params for params in creates if "uri" in params["constructorParams"]])
+
+    pipeline.dispose()
+    return summarise(latencies, elapsed, threads = threads, errors = len(errors), leaked_params = leaked)
+
+def bench_session_setup(client, sessions):
+    """ The loopback recipe's call setup, end to end: pipeline, WebRtcEndpoint, connect, processOffer, OnIceCandidate listener, gatherCandidates, a few addIceCandidate, then dispose
+    """
+
+    def session():
+        pipeline = client.create_media_pipeline()
+        rtc = pipeline.add_endpoint("WebRtcEndpoint")
+        rtc.connect()
+        rtc.process_offer("v=0")
+        rtc.add_event_listener("OnIceCandidate", lambda event: None)
+        rtc.gather_ice_candidates()
+        for _ in range(4):
+            rtc.add_ice_candidate(ICE_CANDIDATE)
+        pipeline.dispose()
+
+    start = time.perf_counter()
+    latencies = [timed(session) for _ in range(sessions)]
+    elapsed = time.perf_counter() - start
+
+    return summarise(latencies, elapsed)
+
+def bench_events(client, kms, events):
+    """ Rate at which events sent by KMS reach a listener's callback
+    """
+
+    pipeline = client.create_media_pipeline()
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+
+    received = []
+    done = threading.Event()
+
+    def on_candidate(event):
+        received.append(time.perf_counter())
+        if(len(received) == events):
+            done.set()
+
+    rtc.add_event_listener("OnIceCandidate", on_candidate)
+
+    start = time.perf_counter()
+    sent = 0
+    while sent < events:
+        batch = min(500, events - sent)
+        kms.emit(rtc.elem_id, "OnIceCandidate", {"candidate": ICE_CANDIDATE}, count = batch)
+        sent = sent + batch
+
+    done.wait(60)
+    elapsed = (received[-1] if received else time.perf_counter()) - start
+
+    pipeline.dispose()
+    return {"events": len(received), "events_per_s": round(len(received) / elapsed, 1) if elapsed else None}
+
+def bench_unheard_events(client, kms, events):
+    """ Rate at which the client gets through events KMS still sends after their listener was removed. They're dropped without decoding their data
+    """
+
+    pipeline = client.create_media_pipeline()
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+
+    ignore = lambda event: None
+    rtc.add_event_listener("OnIceCandidate", ignore)
+    client.off_event("OnIceCandidate", ignore, rtc.elem_id) # KMS keeps sending them
+
+    skipped = client.events_skipped
+    start = time.perf_counter()
+    sent = 0
+    while sent < events:
+        batch = min(500, events - sent)
+        kms.emit(rtc.elem_id, "OnIceCandidate", {"candidate": ICE_CANDIDATE}, count = batch)
+        sent = sent + batch
+
+    give_up = start + 60
+    while client.events_skipped - skipped < events and time.perf_counter() < give_up:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    pipeline.dispose()
+    done = client.events_skipped - skipped
+    return {"events": done, "events_per_s": round(done / elapsed, 1) if elapsed else None}
+
+def bench_stats(client, kms, endpoints, rounds = 5):
+    """ Time a StatsSampler takes for a getStats round over many WebRtcEndpoints, and to aggregate what it sampled across them
+    """
+
+    if kms is not None:
+        kms.results["getStats"] = {
+            "in": {"type": "inboundrtp", "bytesReceived": 1200000, "packetsReceived": 1100, "packetsLost": 3, "jitter": 0.004},
+            "out": {"type": "outboundrtp", "bytesSent": 1500000, "packetsSent": 1300, "roundTripTime": 0.03}
+        }
+
+    pipeline = client.create_media_pipeline()
+    sampler = StatsSampler(client, timeout = 30)
+    sampler.add(*[pipeline.add_endpoint("WebRtcEndpoint") for _ in range(endpoints)])
+
+    latencies = [timed(sampler.sample) for _ in range(rounds)]
+    aggregate = timed(sampler.fleet_stats)
+    pipeline.dispose()
+
+    return summarise(latencies, sum(latencies), endpoints = endpoints, errors = sampler.errors, aggregate_ms = round(aggregate * 1000, 3))
+
+def footprint(build, count):
+    # Bytes held per object built, not counting what they point to
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = [build(i) for i in range(count)]
+    size = tracemalloc.get_traced_memory()[0] - before - sys.getsizeof(held)
+    tracemalloc.stop()
+
+    return size // count
+
+def bench_memory(client, sessions):
+    """ Client-side memory held per open session (a pipeline, a WebRtcEndpoint & an event listener), and per element, reply & event object. Allocations made by the fake server aren't counted
+    """
+
+    filters = [tracemalloc.Filter(True, "*pyforkurento*", all_frames = True), tracemalloc.Filter(False, "*fake_kms.py", all_frames = True)]
+
+    tracemalloc.start(25)
+    before = tracemalloc.take_snapshot().filter_traces(filters)
+
+    opened = []
+    for _ in range(sessions):
+        pipeline = client.create_media_pipeline()
+        rtc = pipeline.add_endpoint("WebRtcEndpoint")
+        rtc.add_event_listener("OnIceCandidate", lambda event: None)
+        opened.append((pipeline, rtc))
+
+    after = tracemalloc.take_snapshot().filter_traces(filters)
+    tracemalloc.stop()
+
+    held = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    for pipeline, _ in opened:
+        pipeline.dispose()
+
+    elem_id, result, data = "pipeline/rtc", {"value": None, "sessionId": "session"}, {"candidate": ICE_CANDIDATE}
+    return {
+        "sessions": sessions,
+        "bytes_per_session": held // sessions,
+        "bytes_per_element": footprint(lambda i: WebRTCEndpoint("session", elem_id, client), 10000),
+        "bytes_per_reply": footprint(lambda i: Response(i, True, result), 10000),
+        "bytes_per_event": footprint(lambda i: Event("onEvent", "OnIceCandidate", elem_id, 0.0, data), 10000)
+    }
+
+
+def run(url = None, latency = 0.0, requests = 2000, threads = 16, sessions = 100, events = 20000, codec = None):
+    """ Run every benchmark
+
+    Params:
+        url (str): KMS to measure against. None starts a FakeKurentoServer
+        latency (float): Reply delay of the fake server, in seconds
+        requests (int): Requests made by the RPC benchmarks
+        threads (int): Threads of the concurrent benchmark
+        sessions (int): Sessions set up by the session & memory benchmarks
+        events (int): Events sent by the event dispatch benchmark. Only run against the fake server
+        codec (str): JSON codec of the client. Defaults to the fastest installed
+
+    Returns:
+        - Dict of benchmark name -> results
+    """
+
+    kms = FakeKurentoServer(latency) if url is None else None
+    client = KurentoClient(url or kms.url, heartbeat_interval = None, codec = codec)
+
+    try:
+        results = {
+            "serialise": bench_serialise(client, requests),
+            "rpc": bench_rpc(client, requests),
+            "rpc_concurrent": bench_concurrent(client, requests, threads, kms),
+            "session_setup": bench_session_setup(client, sessions),
+            "stats_round": bench_stats(client, kms, sessions)
+        }
+        if kms is not None:
+            results["event_dispatch"] = bench_events(client, kms, events)
+            results["event_skip"] = bench_unheard_events(client, kms, events)
+        results["memory"] = bench_memory(client, sessions)
+    finally:
+        client.__del__()
+        if kms is not None:
+            kms.close()
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark pyforkurento's hot paths against a fake KMS, or a real one")
+    parser.add_argument("--url", help = "KMS websocket url. Defaults to an in-process fake server")
+    parser.add_argument("--latency", type = float, default = 0.0, help = "Reply delay of the fake server, in seconds")
+    parser.add_argument("--requests", type = int, default = 2000)
+    parser.add_argument("--threads", type = int, default = 16)
+    parser.add_argument("--sessions", type = int, default = 100)
+    parser.add_argument("--events", type = int, default = 20000)
+    parser.add_argument("--codec", choices = ("orjson", "ujson", "json"), help = "JSON codec of the client. Defaults to the fastest installed")
+    parser.add_argument("--json", action = "store_true", help = "Print the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.url, args.latency, args.requests, args.threads, args.sessions, args.events, args.codec)
+
+    if args.json:
+        print(json.dumps(results, indent = 2))
+    else:
+        for name, numbers in results.items():
+            print(f"{name:<16}" + "  ".join(f"{key}={value}" for key, value in numbers.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# Run event callbacks off the dispatcher thread, in order per media element
+import asyncio
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class BaseCallbackPool(object):
+    """ Callbacks submitted under the same key (a media object id) run one at a time, in order. Different keys run in parallel
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock) # Notified when a strand drains or a callback finishes
+        self.strands = {} # Key -> deque of callbacks waiting to run. A key is present while its strand is scheduled
+
+        self.queued = 0 # Submitted but not yet started
+        self.max_queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, key, callback, *args):
+        """ Run callback(*args) after every callback submitted earlier under the same key
+
+        Params:
+            key (str): Ordering key, e.g. the id of the media object that raised the event
+            callback (func): Function to call
+        """
+
+        with self.lock:
+            strand = self.strands.get(key)
+            start = strand is None
+            if start:
+                strand = self.strands[key] = deque()
+
+            strand.append((callback, args))
+            self.queued = self.queued + 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        if start:
+            self._schedule(key)
+
+    def _next(self, key):
+        # Take the next callback of a strand. None once it's drained
+        with self.lock:
+            strand = self.strands[key]
+            if not strand:
+                del self.strands[key]
+                self.idle.notify_all()
+                return None
+
+            self.queued = self.queued - 1
+            self.running = self.running + 1
+            return strand.popleft()
+
+    def _done(self, what, ok):
+        with self.lock:
+            self.running = self.running - 1
+            if ok:
+                self.completed = self.completed + 1
+            else:
+                self.failed = self.failed + 1
+            self.idle.notify_all()
+
+        if not ok:
+            logger.exception(f"Callback {what} failed")
+
+    def _schedule(self, key):
+        raise NotImplementedError
+
+    def wait_idle(self, timeout = None):
+        """ Block until every callback submitted so far, & any they submit, has run
+
+        Params:
+            timeout (float): Seconds to wait. None waits forever
+
+        Returns:
+            - Whether the pool went idle in time
+        """
+
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.strands and self.running == 0, timeout)
+
+    def queue_depth(self):
+        """ Number of callbacks waiting to run
+        """
+
+        return self.queued
+
+    def stats(self):
+        """ Queue depth metrics
+
+        Returns:
+            - Dict with the number of callbacks queued, running, completed & failed, the highest queue depth seen, and the number of keys with queued callbacks
+        """
+
+        with self.lock:
+            return {
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "keys": len(self.strands)
+            }
+
+    def shutdown(self):
+        pass
+
+
+class CallbackPool(BaseCallbackPool):
+    """ Runs callbacks on a pool of worker threads
+    """
+
+    def __init__(self, workers = 4):
+        """ Params:
+            workers (int): Number of threads. At most this many elements have callbacks running at once
+        """
+
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "pyforkurento-callback")
+
+    def _schedule(self, key):
+        try:
+            self.executor.submit(self._run, key)
+        except RuntimeError:
+            pass # Shut down
+
+    def _run(self, key):
+        # Run one callback, then go to the back of the line so that busy elements don't starve the rest
+        item = self._next(key)
+        if item is None:
+            return
+
+        callback, args = item
+        try:
+            callback(*args)
+            self._done(callback, True)
+        except Exception:
+            self._done(callback, False)
+
+        self._schedule(key)
+
+    def shutdown(self):
+        self.executor.shutdown(wait = False)
+
+
+class AsyncioCallbackPool(BaseCallbackPool):
+    """ Runs callbacks on an asyncio loop. Callbacks may be coroutine functions, which are awaited before the next callback of the same key runs
+    """
+
+    def __init__(self, loop):
+        """ Params:
+            loop (asyncio.AbstractEventLoop): Loop to run the callbacks on
+        """
+
+        super().__init__()
+        self.loop = loop
+
+    def _schedule(self, key):
+        try:
+            self.loop.call_soon_threadsafe(self._start, key)
+        except RuntimeError:
+            pass # Loop closed
+
+    def _start(self, key):
+        self.loop.create_task(self._run(key))
+
+    async def _run(self, key):
+        item = self._next(key)
+        while item is not None:
+            callback, args = item
+            try:
+                result = callback(*args)
+                if asyncio.iscoroutine(result):
+                    await result
+                self._done(callback, True)
+            except Exception:
+                self._done(callback, False)
+
+            item = self._next(key)
@@ -1,37 +1,50 @@
+import asyncio
+import functools
+
 from .base import BaseKurentoClient
+from .callbacks import AsyncioCallbackPool
 from .pipeline import MediaPipeline
 
 from .exceptions import KurentoOperationException
+from .exceptions import KurentoTimeoutException
 
 
 class KurentoClient(BaseKurentoClient):
     """ pyforkurento entry point
+
+    Thread safety:
+        One KurentoClient, and the pipelines & elements it creates, can be used from many threads at once. Request ids are allocated atomically, replies are matched to their callers by id, and every request is built from its own params. Calls made from different threads are in flight together rather than queued behind each other. Transactions are the exception: a MediaPipelineTransaction belongs to the thread that opened it
     """
 
-    def __init__(self, kurento_server_url):
-        super().__init__(kurento_server_url)
+    def __init__(self, kurento_server_url, callback_pool = None, request_timeout = 20, retry_policy = None, **connection_options):
+        """ Params:
+            kurento_server_url (str) - The Kurento server WebSockets url
+            callback_pool (BaseCallbackPool) - Where event callbacks run. Defaults to a CallbackPool of 4 threads
+            request_timeout (float) - Seconds to wait for a reply before raising KurentoTimeoutException. None waits forever
+            retry_policy (RetryPolicy) - Retries for idempotent requests. None never retries
+            connection_options - heartbeat_interval, reconnect_policy & in_flight_policy. See BaseKurentoClient
+        """
+
+        super().__init__(kurento_server_url, callback_pool, request_timeout, retry_policy, **connection_options)
 
     def __del__(self):
         super().__del__()
 
-    # A hacky decorator for dealing with failed operations due to badly designed multithreading in the base class
+    def _check_response(self, ret):
+        # Raise on error responses. SDP_ENDPOINT_ALREADY_NEGOTIATED is reported as an 'error' value instead
+        if(ret["resp_success"]):
+            return ret
+        else:
+            load = ret["payload"]
+            if(load["code"] == 40208): # SDP_ENDPOINT_ALREADY_NEGOTIATED ERROR
+                return {"payload": {"value": "error"}}
+            else:
+                err = f"Kurento Server responded with the error code-> {load['code']}, an error of type-> {load['data']['type']}, with the message-> {load['message']}"
+                raise KurentoOperationException(err)
+
     def _validate_response(func):
         def wrapper(self, params):
-                no_output = True # A hack to deal with failed operations
-                while no_output:
-                    ret = func(self, params)
-                    if("resp_success" in ret):
-                        no_output = False
-
-                        if(ret["resp_success"]):
-                            return ret
-                        else:
-                            load = ret["payload"]
-                            if(load["code"] == 40208): # SDP_ENDPOINT_ALREADY_NEGOTIATED ERROR
-                                return {"payload": {"value": "error"}}
-                            else:
-                                err = f"Kurento Server responded with the error code-> {load['code']}, an error of type-> {load['data']['type']}, with the message-> {load['message']}"
-                                raise KurentoOperationException(err)
+            return self._then(func(self, params), self._check_response)
         return wrapper
 
     @_validate_response    
@@ -42,8 +55,21 @@ class KurentoClient(BaseKurentoClient):
     def _invoke(self, params):
         return super().invoke(params)
 
-    def _on_event(self, what_event, callback):
-        return super().on_event(what_event, callback)
+    def _on_event(self, what_event, callback, subscriber = None, buffer = None):
+        return self.on_event(what_event, callback, subscriber, buffer)
+
+    def _off_event(self, what_event, callback, subscriber = None):
+        return self.off_event(what_event, callback, subscriber)
+
+    def _get(self, params, ttl = None):
+        # Getter invokes go through the registry, which answers from its cache or shares a read already in flight
+        def fetch():
+            fut = self.send_request("invoke", params)
+            return self._chain(fut, lambda resp: self._check_response(resp)["payload"]["value"]), fut.req_id
+
+        fut, req_id = self.registry.get(params["object"], params["operation"], params.get("operationParams", {}), fetch, ttl)
+        # A future of our own, so a caller that gives up can't cancel the read for the others sharing it
+        return self.wait_for_reply(self._chain(fut, lambda value: value), req_id, self.time_left())
 
     @_validate_response
     def _release(self, params):
@@ -57,6 +83,10 @@ class KurentoClient(BaseKurentoClient):
     def _unsubscribe(self, params):
         return super().unsubscribe(params)
 
+    def _request_nowait(self, method, params):
+        # Non-blocking counterpart of _create, _invoke etc. Returns a future of the validated response
+        return self._chain(self.send_request(method, params), self._check_response)
+
     def ping(self):
         """ Prints 'pong' if a connection to KMS is available. Otherwise, an expection is thrown
         """
@@ -76,15 +106,120 @@ class KurentoClient(BaseKurentoClient):
             "properties": {}
         }
 
-        sess = self._create(constructor_params)
+        return self._then(self._create(constructor_params), self._media_pipeline)
 
+    def _media_pipeline(self, sess):
+        # Turns a pipeline's create response into a MediaPipeline object
         sess_id = sess["payload"]["sessionId"]
         pipe_id = sess["payload"]["value"]
+        self.registry.register(pipe_id, "MediaPipeline", None, sess_id)
+        return MediaPipeline(sess_id, pipe_id, self)
+
+
+class AsyncKurentoClient(KurentoClient):
+    """ asyncio flavour of KurentoClient. Requests don't block the event loop and every pipeline and element method returns an awaitable
+
+    Example:
+        client = await AsyncKurentoClient.connect("ws://localhost:8888/kurento")
+        pipeline = await client.create_media_pipeline()
+        rtc = await pipeline.add_endpoint("WebRtcEndpoint")
+        await rtc.add_event_listener("OnIceCandidate", on_ice) # on_ice may be a coroutine function
+        sdp_answer = await rtc.process_offer(sdp_offer)
+    """
+
+    def __init__(self, kurento_server_url, loop = None, request_timeout = 20, retry_policy = None, **connection_options):
+        """ Prefer AsyncKurentoClient.connect(), which doesn't block the event loop while connecting
 
-        pipeline = MediaPipeline(sess_id, pipe_id, self)
-        return pipeline
+        Params:
+            kurento_server_url (str) - The Kurento server WebSockets url
+            loop (asyncio.AbstractEventLoop) - Loop that awaits requests & runs event callbacks, in order per media element. Defaults to the current loop
+            request_timeout (float) - Seconds to wait for a reply before raising KurentoTimeoutException. None waits forever
+            retry_policy (RetryPolicy) - Retries for idempotent requests. None never retries
+            connection_options - heartbeat_interval, reconnect_policy & in_flight_policy. See BaseKurentoClient
+        """
+
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        super().__init__(kurento_server_url, AsyncioCallbackPool(self.loop), request_timeout, retry_policy, **connection_options)
+
+    @classmethod
+    async def connect(cls, kurento_server_url, **kwargs):
+        """ Connect to KMS from a coroutine
+
+        Params:
+            kurento_server_url (str) - The Kurento server WebSockets url
+            kwargs - request_timeout, retry_policy & connection options, as for the constructor
+
+        Returns:
+            - AsyncKurentoClient object
+        """
 
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(cls, kurento_server_url, loop, **kwargs))
 
+    async def close(self):
+        """ Close the connection to KMS and stop the client's threads
+        """
+
+        await self.loop.run_in_executor(None, self.__del__)
+
+    async def wait_for_reply(self, fut, req_id, timeout):
+        # The listener thread completes the future; the loop is woken up to resume whoever awaits it
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut, loop = self.loop), timeout)
+        except asyncio.CancelledError:
+            self.request_cancelled(req_id) # The caller gave up, so a late reply is dropped
+            raise
+        except asyncio.TimeoutError:
+            self.request_timed_out(req_id)
+            raise KurentoTimeoutException(f"KMS did not reply to request {req_id} within {timeout:.3f}s")
+
+    async def gather(self, futures, timeout = None):
+        """ Await several requests sent with send_request() or the *_nowait() methods, without blocking the event loop
 
+        Params:
+            futures (list): Futures to wait for
+            timeout (float): Seconds to wait for all of them. Defaults to the client's request_timeout
+
+        Returns:
+            - List of results, in the same order. The first failed request raises its exception
+        """
 
-    
\ No newline at end of file
+        timeout = self.time_left(timeout)
+        try:
+            return await asyncio.wait_for(asyncio.gather(*[asyncio.wrap_future(fut, loop = self.loop) for fut in futures]), timeout)
+        except asyncio.CancelledError:
+            for fut in futures:
+                if(getattr(fut, "req_id", None) is not None):
+                    self.request_cancelled(fut.req_id) # The caller gave up, so late replies are dropped
+            raise
+        except asyncio.TimeoutError:
+            # Waiting was cancelled, but the requests behind chained futures are still pending. Replies that did arrive were popped already
+            for fut in futures:
+                if(getattr(fut, "req_id", None) is not None):
+                    self.request_timed_out(fut.req_id)
+            raise KurentoTimeoutException(f"KMS did not reply to every request within {timeout:.3f}s")
+
+    def _with_retries(self, attempt, idempotent):
+        if(self.retry_policy is None or not idempotent):
+            return attempt()
+
+        async def retrying():
+            retry = 0
+            while True:
+                try:
+                    return await attempt()
+                except KurentoOperationException as e:
+                    if not self.retry_policy.should_retry(retry, e):
+                        raise
+
+                    await asyncio.sleep(self.retry_policy.delay(retry))
+                    retry = retry + 1
+
+        return self.loop.create_task(retrying())
+
+    def _then(self, resp, func):
+        async def then():
+            return func(await resp)
+
+        # A task, so that the request completes (and errors surface) even if nobody awaits it
+        return self.loop.create_task(then())
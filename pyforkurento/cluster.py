@@ -0,0 +1,384 @@
+# Several KMS behind one client, with pipelines placed on the least loaded
+import threading
+import time
+
+from .client import KurentoClient
+from .metrics import prometheus_text
+from .stats import reply_value
+
+from .exceptions import KurentoOperationException
+from .exceptions import KurentoConnectionException
+
+SERVER_MANAGER = "manager_ServerManager" # Id KMS gives its ServerManager
+
+
+class KurentoServer(object):
+    # One KMS of a cluster: its connection, last known load & whether it takes new pipelines
+    def __init__(self, url):
+        self.url = url
+        self.client = None # KurentoClient, once connected
+        self.draining = False
+        self.error = None # Why the last connect or load refresh failed
+
+        self.cpu = None # Fraction of CPU used
+        self.memory = None # KiB used
+        self.pipelines = None # Pipelines on the server, from every client
+        self.rtt = None # Seconds
+        self.refreshed_at = None
+        self.placed = 0 # Pipelines placed here since the last refresh, not yet in pipelines
+
+    def usable(self):
+        return self.client is not None and self.client.connected and self.error is None
+
+    def dead(self):
+        # Never connected, or its connection gave up reconnecting
+        return self.client is None or not self.client.thread.is_alive()
+
+    def local_pipelines(self):
+        # Live pipelines created through this cluster
+        return len(self.client.registry.find(type = "MediaPipeline")) if self.client is not None else 0
+
+    def as_dict(self, score = None):
+        return {
+            "url": self.url,
+            "connected": self.usable(),
+            "draining": self.draining,
+            "error": None if self.error is None else str(self.error),
+            "cpu": self.cpu,
+            "memory_kib": self.memory,
+            "pipelines": self.pipelines,
+            "local_pipelines": self.local_pipelines(),
+            "rtt_ms": None if self.rtt is None else round(self.rtt * 1000, 3),
+            "score": score,
+            "refreshed_at": self.refreshed_at
+        }
+
+
+class KurentoCluster(object):
+    """ Connections to several KMS. Each new pipeline goes to the least loaded server, judged from its ServerManager's CPU & memory use, its pipeline count & the round trip time to it
+
+    Pipelines created with the same affinity key, e.g. a room id, land on the same server while any of them is alive, so they can be connected to each other. A server can be drained for maintenance: it takes no new pipelines, except for keys already placed on it, and is drained once the pipelines created on it through the cluster are released
+
+    Example:
+        cluster = KurentoCluster(["ws://kms1:8888/kurento", "ws://kms2:8888/kurento"])
+        pipeline = cluster.create_media_pipeline(affinity = room_id) # A MediaPipeline, as from KurentoClient
+        ...
+        cluster.drain("ws://kms1:8888/kurento")
+        cluster.wait_drained("ws://kms1:8888/kurento", timeout = 600)
+        cluster.remove("ws://kms1:8888/kurento")
+    """
+
+    # Share of each load figure in a server's score. Each figure is divided by its highest value across the servers
+    WEIGHTS = {"cpu": 0.5, "memory": 0.15, "pipelines": 0.25, "rtt": 0.1}
+
+    def __init__(self, kurento_server_urls, refresh_interval = 5.0, cpu_interval = 0.5, weights = None, **client_options):
+        """ Connects to every server & reads their load before returning. Servers that can't be reached are retried on every refresh
+
+        Params:
+            kurento_server_urls (list) - WebSockets urls of the servers
+            refresh_interval (float) - Seconds between load refreshes. None only refreshes on refresh()
+            cpu_interval (float) - Seconds KMS measures CPU use over, per refresh
+            weights (dict) - Overrides of WEIGHTS, e.g. {"rtt": 0} to ignore distance
+            client_options - Passed to each KurentoClient, e.g. request_timeout, tracers
+        """
+
+        if not kurento_server_urls:
+            raise KurentoOperationException("A cluster needs at least one server")
+
+        self.refresh_interval = refresh_interval
+        self.cpu_interval = cpu_interval
+        self.weights = dict(self.WEIGHTS, **(weights or {}))
+        self.client_options = client_options
+
+        self.lock = threading.Lock() # Guards servers, rooms & the servers' load figures
+        self.servers = {} # Url -> KurentoServer
+        self.rooms = {} # Affinity key -> (url, ids of the key's pipelines)
+        for url in kurento_server_urls:
+            self.servers[url] = KurentoServer(url)
+
+        self.refresh()
+
+        self.stopped = threading.Event()
+        self.thread = None
+        if refresh_interval is not None:
+            self.thread = threading.Thread(target = self.__refresh_periodically)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def __connect(self, server):
+        try:
+            server.client = KurentoClient(server.url, **self.client_options)
+            server.error = None
+        except Exception as e:
+            server.error = e
+
+    def __refresh_periodically(self):
+        while not self.stopped.wait(self.refresh_interval):
+            self.refresh()
+
+    def refresh(self):
+        """ Read every server's load now. Reconnects servers that couldn't be reached or whose connection was lost for good. The requests to all servers are sent before any reply is waited for
+        """
+
+        with self.lock:
+            servers = list(self.servers.values())
+
+        for server in servers:
+            if server.dead():
+                old = server.client
+                self.__connect(server)
+                if(old is not None and server.client is not old):
+                    old.__del__()
+
+        sent = []
+        for server in servers:
+            if server.dead():
+                continue
+
+            client = server.client
+            invoke = lambda operation, **operation_params: client.send_request("invoke", {"object": SERVER_MANAGER, "operation": operation, "operationParams": operation_params})
+            sent.append((server, time.monotonic(), invoke("getUsedMemory"), invoke("getPipelines"), invoke("getUsedCpu", interval = int(self.cpu_interval * 1000))))
+
+        for server, sent_at, memory, pipelines, cpu in sent:
+            timeout = server.client.request_timeout
+            try:
+                memory = reply_value(server.client, memory, timeout)
+                rtt = time.monotonic() - sent_at # Measured on the quickest of the three when there's no heartbeat
+                pipelines = reply_value(server.client, pipelines, timeout)
+                cpu = reply_value(server.client, cpu, None if timeout is None else timeout + self.cpu_interval)
+            except KurentoOperationException as e:
+                server.error = e
+                continue
+
+            with self.lock:
+                server.memory = memory
+                server.pipelines = len(pipelines or ())
+                server.cpu = None if cpu is None else cpu / 100
+                server.rtt = server.client.rtt_avg if server.client.rtt_avg is not None else rtt
+                server.refreshed_at = time.monotonic()
+                server.placed = 0
+                server.error = None
+
+        with self.lock:
+            for key in [key for key in self.rooms if not self.__room_alive(key)]:
+                del self.rooms[key]
+
+    def __room_alive(self, key):
+        # Whether any pipeline of an affinity key is still alive. Caller holds the lock
+        url, pipelines = self.rooms[key]
+        server = self.servers.get(url)
+        if(server is None or not server.usable()):
+            return False
+
+        return any(server.client.registry.info(pipeline) is not None for pipeline in pipelines)
+
+    def scores(self):
+        """ Load score of every usable server, lowest is least loaded. Each load figure is divided by the highest across the servers, then weighted. Servers yet to report a figure count as the most loaded for it
+
+        Returns:
+            - Dict of url -> score
+        """
+
+        with self.lock:
+            return self.__scores()
+
+    def __scores(self):
+        # Caller holds the lock
+        servers = [server for server in self.servers.values() if server.usable()]
+        figures = {
+            "cpu": {server.url: server.cpu for server in servers},
+            "memory": {server.url: server.memory for server in servers},
+            "pipelines": {server.url: None if server.pipelines is None else server.pipelines + server.placed for server in servers},
+            "rtt": {server.url: server.rtt for server in servers}
+        }
+
+        scores = {server.url: 0.0 for server in servers}
+        for name, values in figures.items():
+            weight = self.weights.get(name, 0)
+            if not weight:
+                continue
+
+            top = max([value for value in values.values() if value is not None], default = 0)
+            for url, value in values.items():
+                share = 1.0 if value is None else (value / top if top else 0.0)
+                scores[url] = scores[url] + weight * share
+
+        return scores
+
+    def __place(self, affinity, exclude):
+        # Pick the server for a new pipeline. Caller holds the lock
+        if(affinity is not None and affinity in self.rooms and self.__room_alive(affinity)):
+            url = self.rooms[affinity][0]
+            if url not in exclude:
+                return self.servers[url] # Even while draining, so the key's pipelines stay together
+
+        scores = self.__scores()
+        candidates = [url for url in scores if not self.servers[url].draining and url not in exclude]
+        if not candidates:
+            raise KurentoConnectionException("No KMS in the cluster can take a new pipeline")
+
+        return self.servers[min(candidates, key = lambda url: (scores[url], self.servers[url].placed))]
+
+    def create_media_pipeline(self, affinity = None):
+        """ Create a Media Pipeline on the least loaded server, or on the server of its affinity key. Tries the next server if the request couldn't be sent to the chosen one. Once sent, KMS may have created the pipeline, so a lost connection or a timeout is raised rather than leaving it orphaned
+
+        Params:
+            affinity (str) - Key of related pipelines, e.g. a room id, kept on one server while any of them is alive
+
+        Returns:
+            - MediaPipeline object, created through that server's KurentoClient
+        """
+
+        tried = set()
+        while True:
+            with self.lock:
+                server = self.__place(affinity, tried)
+                server.placed = server.placed + 1 # Spreads bursts made between refreshes
+
+            client = server.client
+            fut = client.send_request("create", {"type": "MediaPipeline", "constructorParams": {}, "properties": {}})
+            try:
+                pipeline = client._media_pipeline(client._check_response(client.wait_for_reply(fut, fut.req_id, client.time_left())))
+            except KurentoConnectionException as e:
+                if fut.generation is not None:
+                    raise # Written before the connection dropped
+                tried.add(server.url)
+                server.error = e
+                continue
+
+            if affinity is not None:
+                with self.lock:
+                    url, pipelines = self.rooms.get(affinity, (server.url, set()))
+                    if(url != server.url):
+                        pipelines = set() # The key's old server is gone
+                    self.rooms[affinity] = (server.url, pipelines | {pipeline.pipeline_id})
+
+            return pipeline
+
+    def server_of(self, pipeline):
+        """ Url of the server a pipeline was created on. None if it wasn't created through the cluster
+        """
+
+        with self.lock:
+            for server in self.servers.values():
+                if(server.client is not None and pipeline.upstream is server.client):
+                    return server.url
+
+        return None
+
+    def add(self, url):
+        """ Add a server. It takes pipelines once its load has been read
+        """
+
+        server = KurentoServer(url)
+        with self.lock:
+            if url in self.servers:
+                raise KurentoOperationException(f"{url} is already in the cluster")
+            self.servers[url] = server
+
+        self.refresh()
+
+    def drain(self, url):
+        """ Stop placing new pipelines on a server, except for affinity keys with pipelines alive on it. Pipelines already there are left alone
+        """
+
+        with self.lock:
+            self.__server(url).draining = True
+
+    def undrain(self, url):
+        """ Let a drained server take new pipelines again
+        """
+
+        with self.lock:
+            self.__server(url).draining = False
+
+    def drained(self, url):
+        """ Whether a draining server has no pipelines left that were created on it through the cluster
+        """
+
+        with self.lock:
+            server = self.__server(url)
+            return server.draining and server.local_pipelines() == 0
+
+    def wait_drained(self, url, timeout = None, poll = 1.0):
+        """ Block until a draining server is drained
+
+        Params:
+            timeout (float) - Seconds to wait. None waits forever
+            poll (float) - Seconds between checks
+
+        Returns:
+            - Whether it drained in time
+        """
+
+        give_up = None if timeout is None else time.monotonic() + timeout
+        while not self.drained(url):
+            if(give_up is not None and time.monotonic() >= give_up):
+                return False
+            time.sleep(poll if give_up is None else max(0, min(poll, give_up - time.monotonic())))
+
+        return True
+
+    def remove(self, url):
+        """ Take a server out of the cluster & close its connection. Drain it first to not cut off live sessions
+        """
+
+        with self.lock:
+            server = self.servers.pop(url, None)
+            if server is None:
+                raise KurentoOperationException(f"{url} isn't in the cluster")
+            for key in [key for key, (room_url, _) in self.rooms.items() if room_url == url]:
+                del self.rooms[key]
+
+        if server.client is not None:
+            server.client.__del__()
+
+    def __server(self, url):
+        # Caller holds the lock
+        if url not in self.servers:
+            raise KurentoOperationException(f"{url} isn't in the cluster")
+        return self.servers[url]
+
+    def stats(self):
+        """ The load, state & score of every server
+
+        Returns:
+            - List of dicts with each server's url, whether it's connected & draining, CPU use as a fraction, memory used in KiB, pipelines on the server & created through the cluster, round trip time, score & when the load was last read
+        """
+
+        with self.lock:
+            scores = self.__scores()
+            return [server.as_dict(scores.get(server.url)) for server in self.servers.values()]
+
+    def metrics_prometheus(self):
+        """ Metrics of every server's connection in the Prometheus text exposition format, labelled with the server's url
+
+        Returns:
+            - str
+        """
+
+        with self.lock:
+            clients = [(server.url, server.client) for server in self.servers.values() if server.client is not None]
+
+        samples = []
+        for url, client in clients:
+            samples.extend(client.metrics.samples(client.metrics_gauges(), {"server": url}))
+
+        return prometheus_text(samples)
+
+    def close(self):
+        """ Stop refreshing & close every connection
+        """
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+        with self.lock:
+            servers = list(self.servers.values())
+            self.servers = {}
+            self.rooms = {}
+
+        for server in servers:
+            if server.client is not None:
+                server.client.__del__()
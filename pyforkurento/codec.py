@@ -0,0 +1,115 @@
+# JSON encoding & decoding, with the fastest library installed
+import json
+
+try:
+    import orjson
+except ImportError: # Optional
+    orjson = None
+
+try:
+    import ujson
+except ImportError: # Optional
+    ujson = None
+
+from .exceptions import KurentoOperationException
+
+
+class JsonCodec(object):
+    """ Serialises payloads & parses frames. dumps() gives compact JSON, as str or UTF-8 bytes depending on the library; both can be sent as a text frame
+    """
+
+    name = None
+    templated = True # Whether hot invokes are worth serialising from a PayloadTemplate
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+    def loads(self, data):
+        raise NotImplementedError
+
+
+class StdlibCodec(JsonCodec):
+    name = "json"
+
+    def __init__(self):
+        self.encoder = json.JSONEncoder(separators = (",", ":"), ensure_ascii = False)
+        self.decoder = json.JSONDecoder()
+
+    def dumps(self, obj):
+        return self.encoder.encode(obj)
+
+    def loads(self, data):
+        return self.decoder.decode(data) if isinstance(data, str) else json.loads(data)
+
+
+class UjsonCodec(JsonCodec):
+    name = "ujson"
+
+    def dumps(self, obj):
+        return ujson.dumps(obj, ensure_ascii = False, escape_forward_slashes = False)
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+    templated = False # Serialises a whole request about as fast as a template renders
+
+    def dumps(self, obj):
+        return orjson.dumps(obj) # bytes
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+CODECS = {"json": StdlibCodec, "ujson": UjsonCodec, "orjson": OrjsonCodec}
+AVAILABLE = {"json": True, "ujson": ujson is not None, "orjson": orjson is not None}
+PREFERENCE = ("orjson", "ujson", "json") # Fastest first
+
+_default = None
+
+
+def get_codec(codec = None):
+    """ Get a codec by name
+
+    Params:
+        codec (str or JsonCodec): 'orjson', 'ujson' or 'json'. A JsonCodec is returned as is. None gives the default codec
+
+    Returns:
+        - JsonCodec object
+    """
+
+    if isinstance(codec, JsonCodec):
+        return codec
+
+    if codec is None:
+        return default_codec()
+
+    if codec not in CODECS:
+        raise KurentoOperationException(f"Unknown JSON codec {codec}. Pick one of {list(CODECS)}")
+
+    if not AVAILABLE[codec]:
+        raise KurentoOperationException(f"The {codec} package isn't installed")
+
+    return CODECS[codec]()
+
+def default_codec():
+    """ The fastest codec installed. orjson, then ujson, then the standard library
+    """
+
+    global _default
+    if _default is None:
+        _default = get_codec([name for name in PREFERENCE if AVAILABLE[name]][0])
+
+    return _default
+
+def set_default_codec(codec):
+    """ Change the codec used by clients not given one, e.g. to rule the JSON library out while debugging
+
+    Params:
+        codec (str or JsonCodec): 'orjson', 'ujson' or 'json'
+    """
+
+    global _default
+    _default = get_codec(codec)
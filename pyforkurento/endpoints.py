@@ -5,6 +5,8 @@ class Endpoint(MediaElement):
     """ All endpoints base class
     """
 
+    __slots__ = ()
+
     def __init__(self, sess_id, point_id, pipeline_class):
         super().__init__(sess_id, point_id, pipeline_class)
 
@@ -13,6 +15,8 @@ class PlayerEndpoint(Endpoint):
     """ An input endpoint that retrieves content from file system, HTTP URL or RTSP URL and injects it into the media pipeline.
     """
 
+    __slots__ = ()
+
     def __init__(self, session_id, elem_id, pipeline_class):
         super().__init__(session_id, elem_id, pipeline_class)
 
@@ -37,7 +41,7 @@ class PlayerEndpoint(Endpoint):
             "operation":"play",
             "sessionId": self.session_id
         }
-        self.pipeline._invoke(params)
+        return self.pipeline._invoke(params)
     
     def pause(self):
         """ Pause playing the media item
@@ -48,7 +52,7 @@ class PlayerEndpoint(Endpoint):
             "operation":"pause",
             "sessionId": self.session_id
         }
-        self.pipeline._invoke(params)
+        return self.pipeline._invoke(params)
 
     def stop(self):
         """ Stop playing the media item
@@ -59,12 +63,12 @@ class PlayerEndpoint(Endpoint):
             "operation":"stop",
             "sessionId": self.session_id
         }
-        self.pipeline._invoke(params)
+        return self.pipeline._invoke(params)
 
-    def add_event_listener(self, event, callback):
+    def add_event_listener(self, event, callback, buffer = None):
         """ Adds an event listener function for a specific PlayerEndpoint event or a general MediaElement event
         """
-        super()._add_event_listener(event, callback)
+        return super()._add_event_listener(event, callback, buffer)
 
   
 
@@ -72,6 +76,8 @@ class WebRTCEndpoint(Endpoint):
     """ An output and input endpoint that provides media streaming for Real Time Communications (RTC) through the web. It implements WebRTC technology to communicate with browsers.
     """
 
+    __slots__ = ()
+
     def __init__(self, session_id, elem_id, pipeline_class):
         super().__init__(session_id, elem_id, pipeline_class)
 
@@ -106,8 +112,7 @@ class WebRTCEndpoint(Endpoint):
             "sessionId": self.session_id
         }
         sdp_load = self.pipeline._invoke(params)
-        sdp_answer = sdp_load["payload"]["value"]
-        return sdp_answer
+        return self.pipeline._then(sdp_load, lambda load: load["payload"]["value"])
 
     def add_ice_candidate(self, candidate):
         """ Adds Ice Candidate recevied from the WebRTC client to KMS
@@ -125,7 +130,7 @@ class WebRTCEndpoint(Endpoint):
             },
             "sessionId": self.session_id
         }
-        self.pipeline._invoke(params)
+        return self.pipeline._invoke(params)
 
     def gather_ice_candidates(self):
         """ Triggers ICE candidate generation by KMS. Call this method AFTER adding an event listener for 'OnIceCandidate'
@@ -136,9 +141,9 @@ class WebRTCEndpoint(Endpoint):
             "operation":"gatherCandidates",
             "sessionId": self.session_id
         }
-        self.pipeline._invoke(params)
+        return self.pipeline._invoke(params)
 
-    def add_event_listener(self, event, callback):
+    def add_event_listener(self, event, callback, buffer = None):
         """ Adds an event listener function for a specific WebRTCEndpoint event or a general MediaElement event
 
         Params:
@@ -146,18 +151,19 @@ class WebRTCEndpoint(Endpoint):
                 * OnIceCandidate - Invoked when KMS starts generating ICE candidates
                 * OnIceGatheringDone - Invoked when KMS is done gathering ICE candidates
             - callback (func): Function to be called when event is registered
+            - buffer (EventBuffer): Optional bounded buffer for events waiting for the callback. See MediaElement._add_event_listener
         """
 
         expected = ["OnIceCandidate", "OnIceGatheringDone"]
 
         if(event not in expected):
-            super()._add_event_listener(event, callback)
+            return super()._add_event_listener(event, callback, buffer)
         else:   
             if not callable(callback):
                 raise RuntimeError("Callback has to be callable e.g. a function")
             else:
-                super()._subscribe(event)
-                super()._on_event(event, callback)
+                super()._on_event(event, callback, buffer)
+                return super()._subscribe(event)
 
 
 
@@ -165,6 +171,8 @@ class RecorderEndpoint(Endpoint):
     """ An output endpoint that provides function to store contents in reliable mode (doesn’t discard data).
     """
 
+    __slots__ = ()
+
     def __init__(self, session_id, elem_id, pipeline_class):
         super().__init__(session_id, elem_id, pipeline_class)
 
@@ -189,7 +197,7 @@ class RecorderEndpoint(Endpoint):
             "operation":"record",
             "sessionId": self.session_id
         }
-        self.pipeline._invoke(params)
+        return self.pipeline._invoke(params)
 
     def stop(self):
         """ Stops the recording
@@ -200,28 +208,29 @@ class RecorderEndpoint(Endpoint):
             "operation":"stopAndWait",
             "sessionId": self.session_id
         }
-        self.pipeline._invoke(params)
+        return self.pipeline._invoke(params)
 
-    def add_event_listener(self, event, callback):
+    def add_event_listener(self, event, callback, buffer = None):
         """ Adds an event listener function for a specific RecorderEndpoint event or a general MediaElement event
 
         Params:
             - event (str): The event to listen for. Accepted:
                 * Recording - Invoked when the media recording effectively starts
             - callback (func): Function to be called when event is registered
+            - buffer (EventBuffer): Optional bounded buffer for events waiting for the callback. See MediaElement._add_event_listener
 
         """
         
         expected = ["Recording"]
 
         if(event not in expected):
-            super()._add_event_listener(event, callback)
+            return super()._add_event_listener(event, callback, buffer)
         else:
             if not callable(callback):
                 raise RuntimeError("Callback has to be callable e.g. a function")
             else:
-                super()._subscribe(event)
-                super()._on_event(event, callback)
+                super()._on_event(event, callback, buffer)
+                return super()._subscribe(event)
 
 
 
@@ -229,6 +238,8 @@ class RTPEndpoint(Endpoint):
     """ An output and input endpoint. That is, provides bidirectional content delivery capabilities with remote networked peers through RTP protocol. 
     """
 
+    __slots__ = ()
+
     def __init__(self, session_id, elem_id, pipeline_class):
         super().__init__(session_id, elem_id, pipeline_class)
 
@@ -241,6 +252,8 @@ class HTTPPostEndpoint(Endpoint):
     """ An input endpoint that accepts media using http POST requests like HTTP file upload function.
     """
 
+    __slots__ = ()
+
     def __init__(self, session_id, elem_id, pipeline_class):
         super().__init__(session_id, elem_id, pipeline_class)
 
@@ -0,0 +1,217 @@
+# Events from KMS & per-subscription event buffers
+import threading
+
+from collections import deque
+
+from .exceptions import KurentoOperationException
+from .parse_payloads import Message
+
+UNDECODED = object() # Payload of an event not read yet
+
+
+class Event(Message):
+    """ An event from KMS, as handed to listeners. Reads like a dict with the keys method, subscription_type, subscriber, payload & received_at
+
+    The payload, the event's data, is only decoded the first time a listener reads it, so events nobody looks into cost no more than their envelope
+    """
+
+    __slots__ = ("method", "subscription_type", "subscriber", "received_at", "frame", "decode", "_payload")
+    KEYS = ("method", "subscription_type", "subscriber", "payload", "received_at")
+
+    def __init__(self, method, subscription_type, subscriber, received_at, payload = UNDECODED, frame = None, decode = None):
+        """ Params:
+            method (str): JSON-RPC method, onEvent
+            subscription_type (str): Event type e.g. OnIceCandidate
+            subscriber (str): Id of the media object that raised it
+            received_at (float): time.monotonic() when it arrived
+            payload (dict): The event's data, if already decoded
+            frame (str): Otherwise, the frame to decode it from
+            decode (func): Parses a frame e.g. JsonCodec.loads
+        """
+
+        self.method = method
+        self.subscription_type = subscription_type
+        self.subscriber = subscriber
+        self.received_at = received_at
+        self._payload = payload
+        self.frame = frame
+        self.decode = decode
+
+    @property
+    def payload(self):
+        if self._payload is UNDECODED:
+            # Several listeners may race here. They decode the same frame, so whichever wins is fine
+            self._payload = self.decode(self.frame)["params"]["value"]["data"]
+            self.frame = None
+
+        return self._payload
+
+    def __repr__(self):
+        payload = "<undecoded>" if self._payload is UNDECODED else repr(self._payload)
+        return f"Event({self.subscription_type} from {self.subscriber}, payload={payload})"
+
+
+class EventRecord(Message):
+    """ An event as handed to tracers. Reads like a dict with the keys type, object, received_at & payload. The payload is the event's, so it's only decoded if a tracer or listener reads it
+    """
+
+    __slots__ = ("event",)
+    KEYS = ("type", "object", "received_at", "payload")
+
+    def __init__(self, event):
+        self.event = event
+
+    @property
+    def type(self):
+        return self.event.subscription_type
+
+    @property
+    def object(self):
+        return self.event.subscriber
+
+    @property
+    def received_at(self):
+        return self.event.received_at
+
+    @property
+    def payload(self):
+        return self.event.payload
+
+
+class EventBuffer(object):
+    """ Holds the events waiting for one listener's callback. Bounded buffers keep memory flat when a callback can't keep up with an event storm
+
+    Policies for when the buffer is full:
+        * block - The dispatcher waits for room. Events for every other listener wait too, and once the client's event queue fills (MAX_QUEUED_EVENTS), reading from KMS pauses, replies included. Use it for events that must not be lost
+        * drop_oldest - The oldest waiting event is dropped
+        * coalesce - A new event replaces the waiting event with the same key (coalesce_key(event), by default the media object), so only the latest per key is delivered. Applies even when there's room. If full with no event to replace, the oldest is dropped
+
+    Example:
+        zbar.add_event_listener("CodeFoundEvent", on_code, buffer = EventBuffer(10, "coalesce", lambda e: e["payload"]["value"]))
+    """
+
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+
+    def __init__(self, max_pending = None, policy = "block", coalesce_key = None):
+        """ Params:
+            max_pending (int): Most events waiting at once. None for no limit
+            policy (str): What to do when full. One of 'block', 'drop_oldest', 'coalesce'
+            coalesce_key (func): Maps an event to the key events are coalesced by. Only used by 'coalesce'
+        """
+
+        if(policy not in (self.BLOCK, self.DROP_OLDEST, self.COALESCE)):
+            raise KurentoOperationException(f"Unknown event buffer policy {policy}")
+
+        if(max_pending is not None and max_pending < 1):
+            raise KurentoOperationException("max_pending has to be at least 1")
+
+        self.max_pending = max_pending
+        self.policy = policy
+        self.coalesce_key = coalesce_key if coalesce_key is not None else (lambda event: event["subscriber"])
+
+        self.callback = None
+        self.callback_pool = None
+        self.key = None
+
+        self.events = deque()
+        self.cond = threading.Condition()
+        self.scheduled = False # A delivery is queued in the callback pool
+        self.closed = False
+
+        self.delivered = 0
+        self.dropped = 0 # Includes events replaced by coalescing
+        self.coalesced = 0
+        self.blocked = 0 # Times the dispatcher had to wait for room
+
+    def __len__(self):
+        return len(self.events)
+
+    def attach(self, callback, callback_pool, key):
+        """ Bind the buffer to the listener it feeds. A buffer serves a single listener
+        """
+
+        if self.callback is not None:
+            raise KurentoOperationException("This EventBuffer is already used by another listener")
+
+        self.callback = callback
+        self.callback_pool = callback_pool
+        self.key = key
+
+    def offer(self, event):
+        """ Add an event, applying the buffer's policy. Called by the dispatcher thread
+        """
+
+        with self.cond:
+            if(self.policy == self.COALESCE):
+                key = self.coalesce_key(event)
+                for i, waiting in enumerate(self.events):
+                    if self.coalesce_key(waiting) == key:
+                        # Replaced where it was, so it keeps its place in line
+                        self.events[i] = event
+                        self.dropped = self.dropped + 1
+                        self.coalesced = self.coalesced + 1
+                        return
+
+            if(self.max_pending is not None and len(self.events) >= self.max_pending):
+                if(self.policy == self.BLOCK):
+                    self.blocked = self.blocked + 1
+                    while len(self.events) >= self.max_pending and not self.closed:
+                        self.cond.wait()
+                else:
+                    self.events.popleft()
+                    self.dropped = self.dropped + 1
+
+            if self.closed:
+                return
+
+            self.events.append(event)
+            schedule = not self.scheduled
+            self.scheduled = True
+
+        if schedule:
+            self.callback_pool.submit(self.key, self.deliver)
+
+    def deliver(self):
+        """ Pass the oldest waiting event to the callback. Runs in the callback pool
+        """
+
+        with self.cond:
+            if not self.events:
+                self.scheduled = False
+                return None
+
+            event = self.events.popleft()
+            self.delivered = self.delivered + 1
+            self.cond.notify()
+
+            self.scheduled = bool(self.events)
+            if self.scheduled:
+                # Back of the line, behind events queued meanwhile for other listeners of the same element
+                self.callback_pool.submit(self.key, self.deliver)
+
+        return self.callback(event)
+
+    def close(self):
+        """ Drop waiting events & release a blocked dispatcher
+        """
+
+        with self.cond:
+            self.closed = True
+            self.events.clear()
+            self.cond.notify_all()
+
+    def stats(self):
+        """ Returns:
+            - Dict with the number of events pending, delivered, dropped, coalesced, and how often the dispatcher blocked
+        """
+
+        with self.cond:
+            return {
+                "pending": len(self.events),
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "blocked": self.blocked
+            }
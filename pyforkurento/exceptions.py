@@ -4,3 +4,13 @@ class KurentoOperationException(Exception):
     
     def __init__(self, *args):
         self.args = args
+
+
+class KurentoTimeoutException(KurentoOperationException):
+    """ Raised when KMS doesn't reply to a request within its timeout or deadline
+    """
+
+
+class KurentoConnectionException(KurentoOperationException):
+    """ Raised when a request can't be sent, or its connection to KMS was lost before the reply arrived
+    """
@@ -0,0 +1,357 @@
+# An in-process stand-in for Kurento Media Server, for tests & benchmarks
+import base64
+import hashlib
+import itertools
+import json
+import socket
+import struct
+import threading
+import uuid
+
+from collections import deque
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+def read_exactly(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("Client closed the connection")
+        data = data + chunk
+
+    return data
+
+def read_frame(sock):
+    # Client frames are always masked & never fragmented by websocket-client
+    head = read_exactly(sock, 2)
+    opcode = head[0] & 0x0F
+    length = head[1] & 0x7F
+    if(length == 126):
+        length = struct.unpack(">H", read_exactly(sock, 2))[0]
+    elif(length == 127):
+        length = struct.unpack(">Q", read_exactly(sock, 8))[0]
+
+    mask = read_exactly(sock, 4) if head[1] & 0x80 else None
+    data = read_exactly(sock, length)
+    if mask:
+        data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+    return opcode, data
+
+def make_frame(data, opcode = OPCODE_TEXT):
+    n = len(data)
+    if(n < 126):
+        head = struct.pack(">BB", 0x80 | opcode, n)
+    elif(n < 65536):
+        head = struct.pack(">BBH", 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack(">BBQ", 0x80 | opcode, 127, n)
+
+    return head + data
+
+
+class FakeConnection(object):
+    # One client websocket
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def send(self, data):
+        with self.lock:
+            self.sock.sendall(data)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class FakeKurentoServer(object):
+    """ Speaks enough of the KMS JSON-RPC protocol to drive KurentoClient without a media server: create, invoke, subscribe, unsubscribe, release, ping, connect & transaction
+
+    Media objects only exist as ids. Invokes reply with the value set in results (None by default) or worked out by a function set there, and events are sent by emit() or scripted to follow an invoke
+
+    Example:
+        kms = FakeKurentoServer(latency = 0.005)
+        kms.script("gatherCandidates", ("OnIceGatheringDone", {}))
+        client = KurentoClient(kms.url)
+        ...
+        kms.close()
+    """
+
+    def __init__(self, latency = 0.0, host = "127.0.0.1", port = 0):
+        """ Starts listening straight away
+
+        Params:
+            latency (float): Seconds each reply is held back for, as a stand-in for the network round trip & KMS' own work
+            host (str): Interface to listen on
+            port (int): Port to listen on. 0 picks a free one
+        """
+
+        self.latency = latency
+        self.results = { # Operation -> value invokes of it reply with, or a function of the invoke's params giving it
+            "processOffer": "v=0 fake-sdp-answer",
+            "generateOffer": "v=0 fake-sdp-offer",
+            "getUsedCpu": 0.0, # ServerManager
+            "getUsedMemory": 0,
+            "getPipelines": lambda params: [obj for obj in list(self.objects) if obj.endswith("_kurento.MediaPipeline")]
+        }
+        self.scripts = {} # Operation -> (events, delay) to emit on the object after an invoke of it
+        self.silent = set() # Methods & operations left unanswered, e.g. to test timeouts
+
+        self.lock = threading.Lock()
+        self.connections = []
+        self.objects = {"manager_ServerManager": None} # Media object id -> session id
+        self.subscriptions = {} # (object id, event type) -> subscription id
+        self.session_connections = {} # Session id -> connection the session's events go to. Moved by 'connect'
+        self.requests = deque(maxlen = 10000) # Latest requests received, in order
+        self.subscription_ids = itertools.count(1)
+
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(128)
+        self.url = f"ws://{host}:{self.sock.getsockname()[1]}/kurento"
+
+        self.thread = threading.Thread(target = self.accept_connections)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def accept_connections(self):
+        while True:
+            try:
+                sock, _ = self.sock.accept()
+            except OSError:
+                return # Closed
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            thread = threading.Thread(target = self.serve, args = (sock,))
+            thread.daemon = True
+            thread.start()
+
+    def handshake(self, sock):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("Client closed the connection")
+            request = request + chunk
+
+        key = [line.split(b":", 1)[1].strip() for line in request.split(b"\r\n") if line.lower().startswith(b"sec-websocket-key")][0]
+        accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID.encode()).digest())
+        sock.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+
+    def serve(self, sock):
+        try:
+            self.handshake(sock)
+        except (OSError, IndexError):
+            sock.close()
+            return
+
+        conn = FakeConnection(sock)
+        with self.lock:
+            self.connections.append(conn)
+
+        try:
+            while True:
+                opcode, data = read_frame(sock)
+                if(opcode == OPCODE_CLOSE):
+                    conn.send(make_frame(data[:2], OPCODE_CLOSE))
+                    break
+                elif(opcode == OPCODE_PING):
+                    conn.send(make_frame(data, OPCODE_PONG))
+                elif(opcode == OPCODE_TEXT):
+                    self.receive(conn, json.loads(data))
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            with self.lock:
+                if conn in self.connections:
+                    self.connections.remove(conn)
+            conn.close()
+
+    def receive(self, conn, request):
+        self.requests.append(request)
+
+        params = request.get("params", {})
+        if(request["method"] in self.silent or params.get("operation") in self.silent):
+            return
+
+        response = self.handle(conn, request)
+        out = make_frame(json.dumps(response).encode())
+        if self.latency:
+            timer = threading.Timer(self.latency, self.reply, (conn, out, request))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.reply(conn, out, request)
+
+    def reply(self, conn, out, request):
+        try:
+            conn.send(out)
+        except OSError:
+            return
+
+        if(request["method"] == "invoke" and request["params"].get("operation") in self.scripts):
+            events, delay = self.scripts[request["params"]["operation"]]
+            for event_type, data in events:
+                self.emit(request["params"]["object"], event_type, data, delay)
+
+    def handle(self, conn, request):
+        # Reply to one request. Transactions are handled operation by operation
+        method = request["method"]
+        params = request.get("params", {})
+        session_id = params.get("sessionId")
+        if(session_id is None and method in ("create", "transaction")):
+            session_id = str(uuid.uuid4()) # New session
+
+        if session_id is not None:
+            with self.lock:
+                self.session_connections[session_id] = conn
+
+        def result(value):
+            if session_id is None:
+                return {"jsonrpc": "2.0", "id": request["id"], "result": {"value": value}}
+            return {"jsonrpc": "2.0", "id": request["id"], "result": {"value": value, "sessionId": session_id}}
+
+        def error(code, message, kind):
+            return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": code, "message": message, "data": {"type": kind}}}
+
+        if(method == "ping"):
+            return result("pong")
+
+        elif(method == "connect"):
+            return result(None)
+
+        elif(method == "create"):
+            pipeline = params.get("constructorParams", {}).get("mediaPipeline")
+            obj = f"{uuid.uuid4()}_kurento.{params['type']}"
+            obj = obj if pipeline is None else f"{pipeline}/{obj}"
+            self.objects[obj] = session_id
+            return result(obj)
+
+        elif(method == "transaction"):
+            refs = {} # 'newref:<id>' -> real id
+            responses = []
+            for op in params["operations"]:
+                op = json.loads(self.resolve_refs(json.dumps(op), refs))
+                op.setdefault("params", {}).setdefault("sessionId", session_id)
+                resp = self.handle(conn, op)
+                if(op["method"] == "create" and "result" in resp):
+                    refs[f"newref:{op['id']}"] = resp["result"]["value"]
+                responses.append(resp)
+
+            return result(responses)
+
+        obj = params.get("object")
+        if obj not in self.objects:
+            return error(40101, f"Object '{obj}' not found", "MEDIA_OBJECT_NOT_FOUND")
+
+        if(method == "invoke"):
+            value = self.results.get(params["operation"])
+            return result(value(params) if callable(value) else value)
+
+        elif(method == "subscribe"):
+            sub_id = str(next(self.subscription_ids))
+            self.subscriptions[(obj, params["type"])] = sub_id
+            return result(sub_id)
+
+        elif(method == "unsubscribe"):
+            for key in [key for key, sub_id in self.subscriptions.items() if sub_id == params.get("subscription")]:
+                del self.subscriptions[key]
+            return result(None)
+
+        elif(method == "release"):
+            for child in [o for o in self.objects if o == obj or o.startswith(obj + "/")]:
+                del self.objects[child]
+            return result(None)
+
+        return error(40120, f"Method '{method}' not supported", "NOT_IMPLEMENTED")
+
+    @staticmethod
+    def resolve_refs(text, refs):
+        for ref, real in refs.items():
+            text = text.replace(json.dumps(ref), json.dumps(real))
+        return text
+
+    def script(self, operation, *events, delay = 0.0):
+        """ Emit events on the object an operation is invoked on, after replying to the invoke
+
+        Params:
+            operation (str): e.g. gatherCandidates
+            events (tuple): (event type, data) pairs, emitted in order
+            delay (float): Seconds between the reply & the events
+        """
+
+        self.scripts[operation] = (events, delay)
+
+    def emit(self, obj, event_type, data = None, delay = 0.0, count = 1):
+        """ Send an event raised by a media object, the way KMS does. Only sent if a client subscribed to it
+
+        Params:
+            obj (str): Media object id
+            event_type (str): e.g. OnIceCandidate
+            data (dict): Event data. 'source', 'type' & 'timestampMillis' are filled in
+            delay (float): Seconds to wait before sending it
+            count (int): Times to send it. All copies go in one socket write
+
+        Returns:
+            - True if a client is subscribed
+        """
+
+        with self.lock:
+            subscribed = (obj, event_type) in self.subscriptions
+            conn = self.session_connections.get(self.objects.get(obj))
+
+        if(not subscribed or conn is None):
+            return False
+
+        value = dict(data or {}, source = obj, type = event_type, timestampMillis = "0")
+        event = {"jsonrpc": "2.0", "method": "onEvent", "params": {"value": {"data": value, "object": obj, "type": event_type}}}
+        out = make_frame(json.dumps(event).encode()) * count
+
+        if delay:
+            timer = threading.Timer(delay, self.send_quietly, (conn, out))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.send_quietly(conn, out)
+
+        return True
+
+    @staticmethod
+    def send_quietly(conn, out):
+        try:
+            conn.send(out)
+        except OSError:
+            pass
+
+    def drop_connections(self):
+        """ Cut every client connection without a close handshake, as a network failure would. Sessions survive, so clients can resume them
+        """
+
+        with self.lock:
+            conns, self.connections = self.connections, []
+
+        for conn in conns:
+            conn.close()
+
+    def close(self):
+        """ Stop listening & drop every connection
+        """
+
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.drop_connections()
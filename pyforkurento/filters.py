@@ -5,6 +5,8 @@ class Filter(MediaElement):
     """ All filters base class
     """
 
+    __slots__ = ()
+
     def __init__(self, sess_id, filter_id, pipeline_class):
         super().__init__(sess_id, filter_id, pipeline_class)
 
@@ -13,6 +15,8 @@ class Filter(MediaElement):
 class FaceOverlayFilter(Filter):
     """ Detects faces in a video stream and overlays them with a configurable image.  
     """
+
+    __slots__ = ()
     
     def __init__(self, session_id, elem_id, pipeline_class):
         super().__init__(session_id, elem_id, pipeline_class)
@@ -27,7 +31,7 @@ class FaceOverlayFilter(Filter):
             sink_elem (obj): Media Element to connect to. If left blank, the element connects to itself
         """
 
-        super()._connect(sink_elem)
+        return super()._connect(sink_elem)
 
     def set_face_overlay_image(self, image_uri, offset_x = 0.0, offset_y = 0.0, width = 1.0, height = 1.0):
         """ Sets the image to overlay on a detected face
@@ -55,7 +59,7 @@ class FaceOverlayFilter(Filter):
             },
             "sessionId": self.session_id
         }
-        self.pipeline._invoke(params)
+        return self.pipeline._invoke(params)
 
     def unset_face_overlay_image(self):
         """ Removes the image overlayed on faces
@@ -66,13 +70,13 @@ class FaceOverlayFilter(Filter):
             "operation": "unsetOverlayedImage",
             "sessionId": self.session_id
         }
-        self.pipeline._invoke(params)
+        return self.pipeline._invoke(params)
 
-    def add_event_listener(self, event, callback):
+    def add_event_listener(self, event, callback, buffer = None):
         """ Adds an event listener function for a specific FaceOverlayFilter event or a general MediaElement event
         """
 
-        super()._add_event_listener(event, callback)
+        return super()._add_event_listener(event, callback, buffer)
 
 
 
@@ -80,6 +84,8 @@ class ImageOverlayFilter(Filter):
     """ Overlays a configurable image on the video stream
     """
 
+    __slots__ = ("image_id",)
+
     def __init__(self, session_id, elem_id, pipeline_class):
         super().__init__(session_id, elem_id, pipeline_class)
         self.image_id = ""
@@ -94,7 +100,7 @@ class ImageOverlayFilter(Filter):
             sink_elem (obj): Media Element to connect to. If left blank, the element connects to itself
         """
 
-        super()._connect(sink_elem)
+        return super()._connect(sink_elem)
 
     def overlay_image(self, image_uri, image_id, offset_x = 0.0, offset_y = 0.0, relative_width = 1.0, relative_height = 1.0, keep_aspect_ratio = True, to_centre = True):
         """ Draws an image on the video feed at the specified location
@@ -129,7 +135,7 @@ class ImageOverlayFilter(Filter):
             },
             "sessionId": self.session_id
         }
-        self.pipeline._invoke(params) 
+        return self.pipeline._invoke(params)
 
     def remove_image(self):
         """ Remove the overlayed image from the stream
@@ -143,19 +149,21 @@ class ImageOverlayFilter(Filter):
             },
             "sessionId": self.session_id
         }
-        self.pipeline._invoke(params)
+        return self.pipeline._invoke(params)
 
-    def add_event_listener(self, event, callback):
+    def add_event_listener(self, event, callback, buffer = None):
         """ Adds an event listener function for a specific ImageOverlayFilter event or a general MediaElement event
         """
 
-        super()._add_event_listener(event, callback)
+        return super()._add_event_listener(event, callback, buffer)
 
 
 class ZBarFilter(Filter):
     """ Detects QR and bar codes in a video stream. When a code is found, the filter raises a CodeFoundEvent
     """
 
+    __slots__ = ()
+
     def __init__(self, session_id, elem_id, pipeline_class):
         super().__init__(session_id, elem_id, pipeline_class)
 
@@ -169,33 +177,36 @@ class ZBarFilter(Filter):
             sink_elem (obj): Media Element to connect to. If left blank, the element connects to itself
         """
 
-        super()._connect(sink_elem)
+        return super()._connect(sink_elem)
 
-    def add_event_listener(self, event, callback):
+    def add_event_listener(self, event, callback, buffer = None):
         """ Adds an event listener function for a specific ZBarFilter event or a general MediaElement event
 
         Params:
             - event (str): The event to listen for. Accepted:
                 * CodeFoundEvent - Triggered when a BarCode or QR code is found in the video stream
             - callback (func): Function to be called when event is registered
+            - buffer (EventBuffer): Optional bounded buffer for events waiting for the callback. See MediaElement._add_event_listener
         """
 
         expected = ["CodeFoundEvent"]
 
         if(event not in expected):
-            super()._add_event_listener(event, callback)
+            return super()._add_event_listener(event, callback, buffer)
         else:        
             if not callable(callback):
                 raise RuntimeError("Callback has to be callable e.g. a function")
             else:
-                super()._subscribe(event)
-                super()._on_event(event, callback)
+                super()._on_event(event, callback, buffer)
+                return super()._subscribe(event)
 
 
 class GStreamerFilter(Filter):
     """ A generic filter interface that allows usage of GStreamer filters in Kurento Media Pipelines.
     """
 
+    __slots__ = ()
+
     def __init__(self, session_id, elem_id, pipeline_class):
         super().__init__(session_id, elem_id, pipeline_class)
 
@@ -212,11 +223,11 @@ class GStreamerFilter(Filter):
             sink_elem (obj): Media Element to connect to. If left blank, the element connects to itself
         """
         
-        super()._connect(sink_elem)
+        return super()._connect(sink_elem)
 
 
-    def add_event_listener(self, event, callback):
+    def add_event_listener(self, event, callback, buffer = None):
         """ Adds an event listener function for a specific GStreamerFilter event or a general MediaElement event
         """
 
-        super()._add_event_listener(event, callback)
\ No newline at end of file
+        return super()._add_event_listener(event, callback, buffer)
\ No newline at end of file
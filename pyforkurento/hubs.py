@@ -4,6 +4,8 @@ class Hub(MediaElement):
     """ All hubs base class
     """
 
+    __slots__ = ()
+
     def __init__(self, sess_id, hub_id, pipeline_class):
         super().__init__(sess_id, hub_id, pipeline_class)
 
@@ -14,21 +16,27 @@ class Composite(Hub):
     """ A hub that mixes the audio stream of its connected inputs and constructs a grid with the video streams of them.
     """
 
-    def __init__(self):
-        pass
+    __slots__ = ()
+
+    def __init__(self, session_id, elem_id, pipeline_class):
+        super().__init__(session_id, elem_id, pipeline_class)
 
 
 class Dispatcher(Hub):
     """ A hub that allows routing between arbitrary input-output HubPort pairs.
     """
 
-    def __init__(self):
-        pass
+    __slots__ = ()
+
+    def __init__(self, session_id, elem_id, pipeline_class):
+        super().__init__(session_id, elem_id, pipeline_class)
 
 
 class DispatcherOneToMany(Hub):
     """ A hub that sends a given input to all the connected output HubPorts.
     """
 
-    def __init__(self):
-        pass
\ No newline at end of file
+    __slots__ = ()
+
+    def __init__(self, session_id, elem_id, pipeline_class):
+        super().__init__(session_id, elem_id, pipeline_class)
\ No newline at end of file
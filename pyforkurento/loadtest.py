@@ -0,0 +1,167 @@
+# Load test: many virtual callers setting up WebRTC calls. Run with: python -m pyforkurento.loadtest
+import argparse
+import json
+import os
+import threading
+import time
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .benchmark import ICE_CANDIDATE
+from .benchmark import percentile
+from .fake_kms import FakeKurentoServer
+from .pool import KurentoConnectionPool
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+def rss_bytes():
+    """ Resident memory of this process. Peak resident memory where the current figure isn't available
+    """
+
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return None
+
+
+def call(pool, hold):
+    """ One virtual caller, following the loopback recipe
+
+    Returns:
+        - Seconds from the first request until ICE gathering was started
+    """
+
+    cli = pool.client()
+    try:
+        start = time.perf_counter()
+        pipeline = cli.create_media_pipeline()
+        try:
+            rtc = pipeline.add_endpoint("WebRtcEndpoint")
+            rtc.connect()
+            rtc.process_offer("v=0")
+            rtc.add_event_listener("OnIceCandidate", lambda event: None)
+            rtc.gather_ice_candidates()
+            setup = time.perf_counter() - start
+
+            rtc.add_ice_candidate(ICE_CANDIDATE)
+            if hold:
+                time.sleep(hold)
+        finally:
+            pipeline.dispose()
+    finally:
+        cli.close_connection()
+
+    return setup
+
+
+def run_stage(pool, concurrency, callers, hold):
+    """ Run callers virtual callers, concurrency of them at a time
+
+    Returns:
+        - Dict with setup time percentiles in ms, call & error counts, error types, calls per second, client CPU use & resident memory, and the event listeners left on the pool's connections, which should be none once every call is disposed of
+    """
+
+    setups = []
+    errors = Counter()
+    lock = threading.Lock()
+
+    def caller():
+        try:
+            setup = call(pool, hold)
+        except Exception as e:
+            with lock:
+                errors[type(e).__name__] = errors[type(e).__name__] + 1
+            return
+
+        with lock:
+            setups.append(setup)
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency, thread_name_prefix = "pyforkurento-caller") as executor:
+        for _ in range(callers):
+            executor.submit(caller)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    ms = lambda s: None if s is None else round(s * 1000, 2)
+    failed = sum(errors.values())
+    rss = rss_bytes()
+    with pool.lock:
+        listeners = sum(len(conn.listeners) for conn in pool.connections)
+    return {
+        "concurrency": concurrency,
+        "calls": callers,
+        "errors": failed,
+        "error_rate": round(failed / callers, 4) if callers else 0,
+        "error_types": dict(errors),
+        "calls_per_s": round(callers / elapsed, 1),
+        "setup_p50_ms": ms(percentile(setups, 50)),
+        "setup_p90_ms": ms(percentile(setups, 90)),
+        "setup_p99_ms": ms(percentile(setups, 99)),
+        "setup_max_ms": ms(max(setups) if setups else None),
+        "cpu_percent": round(100 * cpu / elapsed, 1),
+        "rss_mb": None if rss is None else round(rss / 2 ** 20, 1),
+        "listeners_left": listeners
+    }
+
+
+def run(url = None, ramp = (10, 50, 100), callers = 1000, hold = 0.0, connections = 4, latency = 0.0):
+    """ Run the load test at each concurrency of the ramp in turn
+
+    Params:
+        url (str): KMS to load. None starts a FakeKurentoServer, whose CPU use is counted as the client's
+        ramp (tuple): Concurrent callers at each stage
+        callers (int): Calls made at each stage
+        hold (float): Seconds each call stays up before being disposed of
+        connections (int): Websockets the callers share, as an app server's KurentoConnectionPool would
+        latency (float): Reply delay of the fake server, in seconds
+
+    Returns:
+        - List with the results of each stage
+    """
+
+    kms = FakeKurentoServer(latency) if url is None else None
+    pool = KurentoConnectionPool(url or kms.url, size = connections)
+
+    try:
+        return [run_stage(pool, concurrency, callers, hold) for concurrency in ramp]
+    finally:
+        pool.close()
+        if kms is not None:
+            kms.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Simulate virtual callers setting up WebRTC calls, as in the loopback recipe, at increasing concurrency")
+    parser.add_argument("--url", help = "KMS websocket url. Defaults to an in-process fake server")
+    parser.add_argument("--ramp", default = "10,50,100", help = "Comma separated concurrency of each stage")
+    parser.add_argument("--callers", type = int, default = 1000, help = "Calls made at each stage")
+    parser.add_argument("--hold", type = float, default = 0.0, help = "Seconds each call stays up")
+    parser.add_argument("--connections", type = int, default = 4, help = "Websockets shared by the callers")
+    parser.add_argument("--latency", type = float, default = 0.0, help = "Reply delay of the fake server, in seconds")
+    parser.add_argument("--json", action = "store_true", help = "Print the results as JSON")
+    args = parser.parse_args()
+
+    ramp = [int(stage) for stage in args.ramp.split(",")]
+    stages = run(args.url, ramp, args.callers, args.hold, args.connections, args.latency)
+
+    if args.json:
+        print(json.dumps(stages, indent = 2))
+    else:
+        for stage in stages:
+            print("  ".join(f"{key}={value}" for key, value in stage.items()))
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,12 @@ from .exceptions import KurentoOperationException
 
 class MediaElement(object):
     """ Base class for ALL media elements i.e. Endpoints, Filters, and Hubs
+
+    Elements are slotted to keep them small, as a server may hold tens of thousands. Subclasses declare __slots__ too, listing any attributes they add
     """
 
+    __slots__ = ("pipeline", "session_id", "elem_id", "__weakref__")
+
     def __init__(self, session_id, elem_id, pipeline_class):
         self.pipeline = pipeline_class
         self.session_id = session_id
@@ -25,7 +29,102 @@ class MediaElement(object):
             "sessionId":self.session_id
         }
     
-        self.pipeline._invoke(params)
+        resp = self.pipeline._invoke(params)
+        registry = self.pipeline.registry
+        if registry is None:
+            return resp
+
+        def connected(resp):
+            registry.connected(self.elem_id, sink_id)
+            return resp
+
+        return self.pipeline._then(resp, connected)
+
+    def _get(self, operation, ttl = None, **operation_params):
+        # Read a property through the client's registry. See MediaObjectRegistry
+        params = {
+            "object":self.elem_id,
+            "operation":operation,
+            "sessionId":self.session_id
+        }
+        if operation_params:
+            params["operationParams"] = operation_params
+
+        return self.pipeline._get(params, ttl)
+
+    def is_media_flowing_in(self, media_type = "VIDEO", ttl = None):
+        """ Whether media of a type is flowing into the element. Cached by the client's registry
+
+        Params:
+            - media_type (str): AUDIO, VIDEO or DATA
+            - ttl (float): Seconds the answer may be cached for. Defaults to the client's property_ttl
+
+        Returns:
+            - bool. An awaitable when the element was created through AsyncKurentoClient
+        """
+
+        return self._get("isMediaFlowingIn", ttl, mediaType = media_type)
+
+    def is_media_flowing_out(self, media_type = "VIDEO", ttl = None):
+        """ Whether the element is sending media of a type out. Cached by the client's registry
+
+        Params:
+            - media_type (str): AUDIO, VIDEO or DATA
+            - ttl (float): Seconds the answer may be cached for. Defaults to the client's property_ttl
+
+        Returns:
+            - bool. An awaitable when the element was created through AsyncKurentoClient
+        """
+
+        return self._get("isMediaFlowingOut", ttl, mediaType = media_type)
+
+    def get_sink_connections(self, ttl = None):
+        """ The element's connections to the elements it sends media to. Cached by the client's registry
+
+        Returns:
+            - List of dicts with source, sink & mediaType. An awaitable when the element was created through AsyncKurentoClient
+        """
+
+        return self._get("getSinkConnections", ttl)
+
+    def get_source_connections(self, ttl = None):
+        """ The element's connections to the elements it receives media from. Cached by the client's registry
+
+        Returns:
+            - List of dicts with source, sink & mediaType. An awaitable when the element was created through AsyncKurentoClient
+        """
+
+        return self._get("getSourceConnections", ttl)
+
+    def get_stats(self, media_type = None):
+        """ The element's RTC statistics. Not cached. To poll many endpoints, see StatsSampler
+
+        Params:
+            - media_type (str): AUDIO or VIDEO for those streams only. All by default
+
+        Returns:
+            - Dict of stats id -> stats dict, each with a type e.g. inboundrtp. An awaitable when the element was created through AsyncKurentoClient
+        """
+
+        params = {
+            "object":self.elem_id,
+            "operation":"getStats",
+            "sessionId":self.session_id
+        }
+        if media_type is not None:
+            params["operationParams"] = {"mediaType":media_type}
+
+        resp = self.pipeline._invoke(params)
+        return self.pipeline._then(resp, lambda load: load["payload"]["value"])
+
+    def watch(self):
+        """ Subscribe to the events that change the element's cached properties, so the registry drops them as soon as they're stale instead of when their TTL runs out. No callback is needed
+
+        Returns:
+            - List of the subscription responses. Awaitables when the element was created through AsyncKurentoClient
+        """
+
+        return [self._subscribe(event) for event in ("MediaFlowIn", "MediaFlowOut", "ElementConnected", "ElementDisconnected")]
 
     def _subscribe(self, what):
         # Subscribe to server events
@@ -35,13 +134,35 @@ class MediaElement(object):
             "sessionId":self.session_id
         }
 
-        self.pipeline._subscribe(params)
+        return self.pipeline._subscribe(params)
 
-    def _on_event(self, what, callback):
+    def _on_event(self, what, callback, buffer = None):
         # Listen to server POSTs triggered by first subscribing, then invoking the operation
-        self.pipeline._on_event(what, callback)
+        return self.pipeline._on_event(what, callback, self.elem_id, buffer)
+
+    def remove_event_listener(self, event, callback, subscription):
+        """ Stop calling a callback added with add_event_listener() & end its subscription, so KMS stops sending the event. Events still waiting for the callback are dropped
+
+        Params:
+            - event (str): The event the callback listens for
+            - callback (func): The function passed to add_event_listener()
+            - subscription (str): Subscription id, the value of the response add_event_listener() returned i.e. resp["payload"]["value"]
+
+        Returns:
+            - The unsubscribe response. An awaitable when the element was created through AsyncKurentoClient
+        """
+
+        self.pipeline._off_event(event, callback, self.elem_id)
 
-    def _add_event_listener(self, event, callback):
+        params = {
+            "object":self.elem_id,
+            "subscription":subscription,
+            "sessionId":self.session_id
+        }
+
+        return self.pipeline._unsubscribe(params)
+
+    def _add_event_listener(self, event, callback, buffer = None):
         """ [DO NOT OVERRIDE!!] Adds event listeners for events that all Media Elements can implement
 
         Params:
@@ -53,6 +174,10 @@ class MediaElement(object):
                 * ElementDisconnected - Indicates that an element has been disconnected.
                 * Error: An error related to the MediaObject has occurred.
             - callback: Function to be called when event is registered
+            - buffer (EventBuffer): Optional bounded buffer for events waiting for the callback, with a policy for when it's full. Unbounded by default
+
+        Returns:
+            - The subscription response. An awaitable when the element was created through AsyncKurentoClient
         """
         
         expected = ["MediaFlowIn", "MediaFlowOut", "EndOfStream", "ElementConnected", "ElementDisconnected", "Error"]
@@ -64,5 +189,5 @@ class MediaElement(object):
                 raise RuntimeError("Callback has to be callable e.g. a function")
 
             else:
-                self._subscribe(event)
-                self._on_event(event, callback)
\ No newline at end of file
+                self._on_event(event, callback, buffer)
+                return self._subscribe(event)
\ No newline at end of file
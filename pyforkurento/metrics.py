@@ -0,0 +1,207 @@
+# Client instrumentation: request latency histograms, gauges & event rates
+import bisect
+import threading
+import time
+
+from collections import Counter
+
+# Upper bounds, in seconds, of the latency histogram buckets. Above the last one counts in +Inf only
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class LatencyHistogram(object):
+    """ Request latencies counted into fixed buckets, as a Prometheus histogram does
+    """
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1) # Last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self):
+        """ Returns:
+            - List of (upper bound, observations at or below it) pairs, ending with +Inf
+        """
+
+        total = 0
+        buckets = []
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.counts):
+            total = total + count
+            buckets.append((bound, total))
+
+        return buckets
+
+    def quantile(self, q):
+        """ Estimate a quantile by interpolating within its bucket. None before any observation
+        """
+
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        lower = 0.0
+        below = 0
+        for bound, total in self.cumulative():
+            if(total >= rank):
+                if(bound == float("inf")):
+                    return lower # Can't tell how far beyond the last bucket
+                in_bucket = total - below
+                return lower + (bound - lower) * ((rank - below) / in_bucket if in_bucket else 0)
+
+            lower, below = bound, total
+
+        return lower
+
+
+class ClientMetrics(object):
+    """ Counters kept by a BaseKurentoClient. Latencies are observed & events counted by the listener thread, so the hot paths take no locks
+    """
+
+    def __init__(self):
+        self.latency = {} # (method, operation) -> LatencyHistogram
+        self.failures = Counter() # (method, operation, reason) -> count
+        self.failures_lock = threading.Lock()
+        self.events = Counter() # Event type -> count
+
+        self.rate_lock = threading.Lock()
+        self.rate_at = time.monotonic()
+        self.rate_events = Counter() # Event counts when rates were last worked out
+
+    def observe(self, method, operation, seconds):
+        """ Record the latency of a request that got a reply. Listener thread only
+        """
+
+        key = (method, operation)
+        histogram = self.latency.get(key)
+        if histogram is None:
+            histogram = self.latency[key] = LatencyHistogram()
+
+        histogram.observe(seconds)
+
+    def failed(self, method, operation, reason):
+        """ Count a request that failed. reason is one of 'error' (KMS replied with an error), 'timeout', 'connection' or 'cancelled'
+        """
+
+        with self.failures_lock:
+            self.failures[(method, operation, reason)] += 1
+
+    def event(self, what_event):
+        """ Count an event received. Listener thread only
+        """
+
+        self.events[what_event] += 1
+
+    def event_rates(self):
+        """ Events per second by type, since the previous call
+        """
+
+        with self.rate_lock:
+            now = time.monotonic()
+            counts = Counter(self.events)
+            elapsed = now - self.rate_at
+            rates = {what: round((count - self.rate_events[what]) / elapsed, 2) if elapsed > 0 else 0.0 for what, count in counts.items()}
+            self.rate_at, self.rate_events = now, counts
+
+        return rates
+
+    def snapshot(self, gauges):
+        """ Params:
+            gauges (dict): Point-in-time values from the client, e.g. queue depths
+
+        Returns:
+            - Dict of the request latencies & failures by method & operation, event counts & rates by type, and the gauges
+        """
+
+        with self.failures_lock:
+            failures = dict(self.failures)
+
+        requests = {}
+        for (method, operation), histogram in list(self.latency.items()):
+            requests[f"{method}:{operation}" if operation else method] = {
+                "count": histogram.count,
+                "mean_ms": round(1000 * histogram.sum / histogram.count, 3) if histogram.count else None,
+                "p50_ms": self.__ms(histogram.quantile(0.5)),
+                "p90_ms": self.__ms(histogram.quantile(0.9)),
+                "p99_ms": self.__ms(histogram.quantile(0.99))
+            }
+
+        for (method, operation, reason), count in failures.items():
+            stats = requests.setdefault(f"{method}:{operation}" if operation else method, {"count": 0})
+            stats[reason] = count
+
+        rates = self.event_rates()
+        events = {what: {"total": count, "per_s": rates.get(what, 0.0)} for what, count in list(self.events.items())}
+
+        return dict(gauges, requests = requests, events = events)
+
+    @staticmethod
+    def __ms(seconds):
+        return None if seconds is None else round(seconds * 1000, 3)
+
+    def samples(self, gauges, labels = None):
+        """ The metrics as Prometheus samples
+
+        Params:
+            gauges (dict): Point-in-time values from the client. Numbers only
+            labels (dict): Labels added to every sample, e.g. to tell connections apart
+
+        Returns:
+            - List of (metric name, type, help, labels, value) tuples
+        """
+
+        labels = labels or {}
+        out = []
+
+        for (method, operation), histogram in list(self.latency.items()):
+            base = dict(labels, method = method, operation = operation or "")
+            name = "pyforkurento_request_duration_seconds"
+            help_text = "Time from sending a request to its reply"
+            for bound, total in histogram.cumulative():
+                out.append((name, "histogram", help_text, dict(base, le = "+Inf" if bound == float("inf") else repr(bound)), total))
+            out.append((name, "histogram", help_text, dict(base, suffix = "_sum"), histogram.sum))
+            out.append((name, "histogram", help_text, dict(base, suffix = "_count"), histogram.count))
+
+        with self.failures_lock:
+            failures = dict(self.failures)
+        for (method, operation, reason), count in failures.items():
+            out.append(("pyforkurento_request_failures_total", "counter", "Requests that got an error, timed out, lost their connection or were cancelled", dict(labels, method = method, operation = operation or "", reason = reason), count))
+
+        for what, count in list(self.events.items()):
+            out.append(("pyforkurento_events_total", "counter", "Events received from KMS", dict(labels, type = what), count))
+
+        for name, (kind, help_text, value) in gauges.items():
+            if value is not None:
+                out.append((f"pyforkurento_{name}", kind, help_text, dict(labels), value))
+
+        return out
+
+
+def prometheus_text(samples):
+    """ Render samples from ClientMetrics.samples() in the Prometheus text exposition format. Samples of the same metric are grouped under one HELP & TYPE header
+    """
+
+    families = {}
+    for name, kind, help_text, labels, value in samples:
+        families.setdefault(name, (kind, help_text, []))[2].append((labels, value))
+
+    lines = []
+    for name, (kind, help_text, series) in families.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in series:
+            labels = dict(labels)
+            suffix = labels.pop("suffix", "_bucket" if "le" in labels else "")
+            text = ",".join(f'{key}="{escape(val)}"' for key, val in labels.items())
+            lines.append(f"{name}{suffix}{{{text}}} {value}" if text else f"{name}{suffix} {value}")
+
+    return "\n".join(lines) + "\n"
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -1,8 +1,75 @@
-# Construct the JSONRPC requests
-import json
+# Construct the JSONRPC requests & pick apart events
+from .codec import default_codec
 
-def rpc_payload(method, id, args):
+# How an event frame starts, & how its object & type are laid out at the end. Compact, as KMS writes them, & with the spaces Python's json adds
+EVENT_LAYOUTS = (
+    ('{"jsonrpc":"2.0","method":"onEvent",', '"object":"', '","type":"', '"}}}'),
+    ('{"jsonrpc": "2.0", "method": "onEvent", ', '"object": "', '", "type": "', '"}}}')
+)
+
+class Message(object):
+    """ Base of the slotted objects replies & events are handed out as. They read like the dicts they replace: msg["payload"], msg.get(), keys(), dict(msg)
+    """
+
+    __slots__ = ()
+    KEYS = () # Readable keys, in order
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def get(self, key, default = None):
+        return getattr(self, key) if key in self.KEYS else default
+
+    def keys(self):
+        return list(self.KEYS)
+
+    def values(self):
+        return [getattr(self, key) for key in self.KEYS]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.KEYS]
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __eq__(self, other):
+        if isinstance(other, (Message, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None # Mutable, like the dicts
+
+
+class Response(Message):
+    """ A reply from KMS: resp_id, resp_success & payload, the result or the error
+    """
+
+    __slots__ = ("resp_id", "resp_success", "payload")
+    KEYS = __slots__
+
+    def __init__(self, resp_id, resp_success, payload):
+        self.resp_id = resp_id
+        self.resp_success = resp_success
+        self.payload = payload
+
+    def __repr__(self):
+        return f"Response(resp_id={self.resp_id!r}, resp_success={self.resp_success!r}, payload={self.payload!r})"
+
+
+def rpc_payload(method, id, args, codec = None):
     """ Takes parameters, then constructs a JSONRPC payload for sending
+
+    Params:
+        codec (JsonCodec): Serialiser. Defaults to the fastest installed
     """
 
     payload = {
@@ -11,9 +78,75 @@ def rpc_payload(method, id, args):
         "params": args,
         "jsonrpc": "2.0"
         }
-    
-    return json.dumps(payload)
 
+    return (codec or default_codec()).dumps(payload)
+
+
+class PayloadTemplate(object):
+    """ A request serialised once, but for its id & one operation param. Rendering it only serialises those two
+
+    Example:
+        template = PayloadTemplate(codec, params, "candidate") # params of an addIceCandidate invoke
+        load = template.render(req_id, candidate)
+    """
+
+    SLOT = "\u0000slot\u0000" # Can't be in a real payload
+
+    def __init__(self, codec, params, field, method = "invoke"):
+        """ Params:
+            codec (JsonCodec): Serialiser
+            params (dict): The request's params. params['operationParams'][field] varies per call
+            field (str): The operation param filled in by render()
+            method (str): JSON-RPC method
+        """
+
+        self.codec = codec
+        fixed = dict(params, operationParams = dict(params["operationParams"], **{field: self.SLOT}))
+        text = codec.dumps({"jsonrpc": "2.0", "method": method, "params": fixed, "id": self.SLOT})
+
+        slot = codec.dumps(self.SLOT)
+        self.head, self.middle, self.tail = text.split(slot)
+        self.format_id = (b"%d" if isinstance(text, bytes) else "%d").__mod__ # Cheaper than a dumps() call
+
+    def render(self, id, value):
+        """ The serialised request
+
+        Params:
+            id (int): JSON-RPC id
+            value: The operation param's value for this call
+        """
+
+        return self.head + self.codec.dumps(value) + self.middle + self.format_id(id) + self.tail
+
+
+def event_envelope(frame):
+    """ Read the type & object of an event without parsing the frame. KMS writes an event's data first & its object & type last, so they're found at the end whatever the size of the data
+
+    Params:
+        frame (str): Frame received from KMS
+
+    Returns:
+        - (event type, object id) tuple. None if the frame isn't an event laid out as KMS does, in which case it has to be parsed in full
+    """
+
+    if not isinstance(frame, str):
+        return None
+
+    for head, obj, sep, end in EVENT_LAYOUTS:
+        if not frame.startswith(head):
+            continue
+
+        frame = frame.rstrip()
+        at_obj = frame.rfind(obj)
+        at_sep = frame.rfind(sep)
+        if(at_obj < 0 or at_sep < at_obj or not frame.endswith(end)):
+            return None
 
+        subscriber = frame[at_obj + len(obj):at_sep]
+        what_event = frame[at_sep + len(sep):-len(end)]
+        if('"' in subscriber or '"' in what_event or "\\" in subscriber or "\\" in what_event):
+            return None # Escaped characters, or not laid out as expected. Let the codec deal with it
 
+        return what_event, subscriber
 
+    return None
@@ -14,43 +14,134 @@ from .hubs import Composite
 from .hubs import Dispatcher
 from .hubs import DispatcherOneToMany
 
+from .transaction import TransactionClient
+
+from .stats import measure_latency
+
 from .exceptions import KurentoOperationException
 
 class MediaPipeline(object):
     """ Base class for adding Media Elements to a Media Pipeline
+
+    Elements can be added from many threads at once. See KurentoClient for the thread safety guarantee
     """
 
+    __slots__ = ("session_id", "pipeline_id", "upstream", "__weakref__")
+
     def __init__(self, session_id, pipeline_id, client_class):
         self.session_id = session_id
         self.pipeline_id = pipeline_id
 
         self.upstream = client_class # Passed from the Client class so that we can access functionality of the base class
-        self.elem_params = {
-            "type": "",
-            "constructorParams": {
-                "mediaPipeline": self.pipeline_id
-            },
-            "sessionId": self.session_id
-        }
 
     def __str__(self):
         return f"MediaPipeline ID: {self.pipeline_id} Session ID: {self.session_id}\n"
 
+    def __elem_params(self, elem_type, **constructor_params):
+        # Fresh create params for each element, so concurrent calls never see each other's constructor params
+        return {
+            "type": elem_type,
+            "constructorParams": dict(constructor_params, mediaPipeline = self.pipeline_id),
+            "sessionId": self.session_id
+        }
+
     
+    def transaction(self):
+        """ Batch element creation, connect calls & other operations into a single request to KMS, instead of one round trip each
+
+        Elements created in the transaction can be used straight away, e.g. connected to each other. They get their real ids once the transaction is committed. Other calls return futures completed on commit
+
+        Example:
+            with pipeline.transaction() as tx:
+                player = tx.add_endpoint("PlayerEndpoint", uri = rtsp_url)
+                rtc = tx.add_endpoint("WebRtcEndpoint")
+                player.connect(rtc)
+                player.play()
+
+            With AsyncKurentoClient use 'async with'
+
+        Returns:
+            - MediaPipelineTransaction object
+        """
+
+        return MediaPipelineTransaction(self)
+
+    def set_latency_stats(self, enabled = True):
+        """ Turn KMS' latency stats on or off for the pipeline. While on, getStats of its elements reports the latency media has picked up at each one. They cost some CPU, so they're off by default
+
+        Params:
+            - enabled (bool): On or off
+        """
+
+        params = {
+            "object": self.pipeline_id,
+            "operation": "setLatencyStats",
+            "operationParams": {
+                "latencyStats": enabled
+            },
+            "sessionId": self.session_id
+        }
+        return self.upstream._invoke(params)
+
+    def get_latency_stats(self):
+        """ Whether latency stats are on for the pipeline
+
+        Returns:
+            - bool. An awaitable when the pipeline was created through AsyncKurentoClient
+        """
+
+        params = {
+            "object": self.pipeline_id,
+            "operation": "getLatencyStats",
+            "sessionId": self.session_id
+        }
+        return self.upstream._then(self.upstream._invoke(params), lambda load: load["payload"]["value"])
+
+    def measure_latency(self, *elements, samples = 5, interval = 0.5, media_type = "VIDEO"):
+        """ Find which element in a chain adds delay. Samples the latency KMS measures at each element, with latency stats turned on while sampling if they're off
+
+        Blocks for about (samples + 1) * interval seconds. With AsyncKurentoClient, run it in an executor
+
+        Example:
+            for row in pipeline.measure_latency(player, gst_filter, rtc):
+                print(row["type"], row["processing_ms"])
+
+        Params:
+            - elements (obj): Elements of the pipeline, in the order media flows through them
+            - samples (int): getStats rounds to average
+            - interval (float): Seconds between rounds
+            - media_type (str): AUDIO or VIDEO
+
+        Returns:
+            - List with a dict per element, in order. See pyforkurento.stats.measure_latency()
+        """
+
+        return measure_latency(self.upstream, self, elements, samples, interval, media_type, self.upstream.request_timeout)
+
     def dispose(self):
         params = {
             "object": self.pipeline_id,
             "sessionId": self.session_id
         }
-        self.upstream._release(params)
+        return self.upstream._release(params)
 
     
+    def __element(self, endpoint_obj, elem_type):
+        # Turns a create response into an element object
+        def element(elem):
+            elem_sess_id = elem["payload"]["sessionId"]
+            elem_elem_id = elem["payload"]["value"]
+            if self.upstream.registry is not None:
+                self.upstream.registry.register(elem_elem_id, elem_type, self.pipeline_id, elem_sess_id)
+            return endpoint_obj(elem_sess_id, elem_elem_id, self.upstream)
+
+        return element
+
     def __create_element(self, endpoint_obj, params):
-        elem = self.upstream._create(params)
-        elem_sess_id = elem["payload"]["sessionId"]
-        elem_elem_id = elem["payload"]["value"]
+        return self.upstream._then(self.upstream._create(params), self.__element(endpoint_obj, params["type"]))
 
-        return endpoint_obj(elem_sess_id, elem_elem_id, self.upstream)
+    def __create_element_nowait(self, endpoint_obj, params):
+        return self.upstream._chain(self.upstream._request_nowait("create", params), self.__element(endpoint_obj, params["type"]))
 
     
     def add_endpoint(self, endpoint, **kwargs):
@@ -83,8 +174,19 @@ class MediaPipeline(object):
             - Object of the requested endpoint
         """
 
-        params = self.elem_params
-        
+        return self.__create_element(*self.__endpoint_params(endpoint, **kwargs))
+
+    def add_endpoint_nowait(self, endpoint, **kwargs):
+        """ Same as add_endpoint() but doesn't wait for KMS. Send several, then wait for all of them with KurentoClient.gather(), or await AsyncKurentoClient.gather()
+
+        Returns:
+            - Future of the requested endpoint object
+        """
+
+        return self.__create_element_nowait(*self.__endpoint_params(endpoint, **kwargs))
+
+    def __endpoint_params(self, endpoint, **kwargs):
+        # Validates add_endpoint() arguments. Returns the element class & create params
 
         excepted_kwargs = ["uri", "webrtc_recv_only", "webrtc_send_only", "buffer_size"]
         uknowns = set(kwargs.keys() - excepted_kwargs)
@@ -119,29 +221,19 @@ class MediaPipeline(object):
             raise KurentoOperationException("Please specify a URI for the endpoint to record to")
 
         if(endpoint == "WebRtcEndpoint"):
-            params["type"] = "WebRtcEndpoint"
-            params["constructorParams"]["recvonly"] = webrtc_recv_only
-            params["constructorParams"]["sendonly"] = webrtc_send_only
-            return self.__create_element(WebRTCEndpoint, params)
+            return WebRTCEndpoint, self.__elem_params("WebRtcEndpoint", recvonly = webrtc_recv_only, sendonly = webrtc_send_only)
 
         elif(endpoint == "RtpEndpoint"):
-            params["type"] = "RtpEndpoint"
-            return self.__create_element(RTPEndpoint, params)
+            return RTPEndpoint, self.__elem_params("RtpEndpoint")
 
         elif(endpoint == "HttpPostEndpoint"):
-            params["type"] = "HttpPostEndpoint"
-            return self.__create_element(HTTPPostEndpoint, params)
+            return HTTPPostEndpoint, self.__elem_params("HttpPostEndpoint")
 
         elif(endpoint == "PlayerEndpoint"):
-            params["type"] = "PlayerEndpoint"
-            params["constructorParams"]["uri"] = uri
-            params["constructorParams"]["networkCache"] = buffer_size
-            return self.__create_element(PlayerEndpoint, params)
+            return PlayerEndpoint, self.__elem_params("PlayerEndpoint", uri = uri, networkCache = buffer_size)
 
         elif(endpoint == "RecorderEndpoint"):
-            params["type"] = "RecorderEndpoint"
-            params["constructorParams"]["uri"] = uri
-            return self.__create_element(RecorderEndpoint, params)
+            return RecorderEndpoint, self.__elem_params("RecorderEndpoint", uri = uri)
 
         else:
             raise KurentoOperationException(f"Unknown endpoint {endpoint} requested")
@@ -170,8 +262,19 @@ class MediaPipeline(object):
             - Object of the requested filter
         """
 
-        params = self.elem_params
+        return self.__create_element(*self.__filter_params(filter, **kwargs))
 
+    def apply_filter_nowait(self, filter, **kwargs):
+        """ Same as apply_filter() but doesn't wait for KMS. Send several, then wait for all of them with KurentoClient.gather(), or await AsyncKurentoClient.gather()
+
+        Returns:
+            - Future of the requested filter object
+        """
+
+        return self.__create_element_nowait(*self.__filter_params(filter, **kwargs))
+
+    def __filter_params(self, filter, **kwargs):
+        # Validates apply_filter() arguments. Returns the element class & create params
         excepted_kwargs = ["command", "filter_type"]
         uknowns = set(kwargs.keys() - excepted_kwargs)
         if(len(uknowns) > 0):
@@ -193,22 +296,16 @@ class MediaPipeline(object):
 
 
         if(filter == "FaceOverlayFilter"):
-            params["type"] = "FaceOverlayFilter"
-            return self.__create_element(FaceOverlayFilter, params)
+            return FaceOverlayFilter, self.__elem_params("FaceOverlayFilter")
 
         elif(filter == "ZBarFilter"):
-            params["type"] = "ZBarFilter"
-            return self.__create_element(ZBarFilter, params)
+            return ZBarFilter, self.__elem_params("ZBarFilter")
 
         elif(filter == "GStreamerFilter"):
-            params["type"] = "GStreamerFilter"
-            params["constructorParams"]["command"] = command
-            params["constructorParams"]["filterType"] = filter_type
-            return self.__create_element(GStreamerFilter, params)
+            return GStreamerFilter, self.__elem_params("GStreamerFilter", command = command, filterType = filter_type)
 
         elif(filter == "ImageOverlayFilter"):
-            params["type"] = "ImageOverlayFilter"
-            return self.__create_element(ImageOverlayFilter, params)
+            return ImageOverlayFilter, self.__elem_params("ImageOverlayFilter")
 
         else:
             raise KurentoOperationException(f"Unknown filter {filter} requested")
@@ -227,25 +324,81 @@ class MediaPipeline(object):
         Returns:
             - Object of the requested hub
         """
-        
-        params = self.elem_params        
 
+        return self.__create_element(*self.__hub_params(hub, **kwargs))
+
+    def add_hub_nowait(self, hub, **kwargs):
+        """ Same as add_hub() but doesn't wait for KMS. Send several, then wait for all of them with KurentoClient.gather(), or await AsyncKurentoClient.gather()
+
+        Returns:
+            - Future of the requested hub object
+        """
+
+        return self.__create_element_nowait(*self.__hub_params(hub, **kwargs))
+
+    def __hub_params(self, hub, **kwargs):
+        # Returns the hub class & create params
         if(hub == "Composite"):
-            params["type"] = "Composite"
-            return self.__create_element(Composite, params)
+            return Composite, self.__elem_params("Composite")
 
         elif(hub == "Dispatcher"):
-            params["type"] = "Dispatcher"
-            return self.__create_element(Dispatcher, params)
+            return Dispatcher, self.__elem_params("Dispatcher")
 
         elif(hub == "DispatcherOneToMany"):
-            params["type"] = "DispatcherOneToMany"
-            return self.__create_element(DispatcherOneToMany, params)
+            return DispatcherOneToMany, self.__elem_params("DispatcherOneToMany")
 
         else:
             raise KurentoOperationException(f"Unknown hub {hub} requested")
 
-        
 
 
+class MediaPipelineTransaction(MediaPipeline):
+    """ A MediaPipeline whose operations are recorded, then sent to KMS as one transaction. Get one from MediaPipeline.transaction()
+
+    Not thread safe. Use it from the thread that opened it
+    """
+
+    __slots__ = ("results",)
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline.session_id, pipeline.pipeline_id, TransactionClient(pipeline.upstream, pipeline.session_id))
+        self.results = None # Results of the operations once committed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.upstream.discard()
+        else:
+            self.results = self.commit()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.upstream.discard()
+        else:
+            self.results = await self.commit()
+
+    def enlist(self, *elements):
+        """ Record calls made on elements created outside the transaction until it's committed, e.g. to connect them to new elements
+
+        Params:
+            - elements (obj): Media Elements to enlist
+        """
+
+        self.upstream.enlist(*elements)
+
+    def measure_latency(self, *elements, **kwargs):
+        raise KurentoOperationException("Latency can't be measured inside a transaction. Use the pipeline itself")
+
+    def commit(self):
+        """ Send the recorded operations to KMS. Called on leaving the 'with' block
+
+        Returns:
+            - List of the operations' results, in order
+        """
 
+        return self.upstream.commit()
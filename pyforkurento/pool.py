@@ -0,0 +1,217 @@
+# Many sessions multiplexed over a few KMS connections
+import threading
+
+from .client import KurentoClient
+from .metrics import prometheus_text
+
+from .exceptions import KurentoOperationException
+
+
+class PooledKurentoClient(KurentoClient):
+    """ A session's handle on a pooled connection. Behaves like a KurentoClient, but shares its websocket with other sessions
+
+    Requests use the request id space of the connection the session is pinned to. Event listeners are keyed by media object, so events are routed back to the session that added them. State the session doesn't hold itself, e.g. listeners, tracers & metrics, is read from the connection
+    """
+
+    def __init__(self, pool, connection):
+        # No super().__init__(). The socket & threads belong to the pooled connection
+        self.pool = pool
+        self.connection = connection
+        self.kurento_url = connection.kurento_url
+        self.pending = connection.pending
+        self.request_timeout = connection.request_timeout
+        self.retry_policy = connection.retry_policy
+        self.codec = connection.codec
+        self.templates = connection.templates
+        self.registry = connection.registry
+        self.added_listeners = [] # (event type, callback, subscriber) of the listeners this session added to the connection
+
+    def __getattr__(self, name):
+        # Only called for attributes the session lacks. Everything else KurentoClient reads lives on the shared connection
+        if(name == "connection"):
+            raise AttributeError(name) # Not yet set in __init__
+        return getattr(self.connection, name)
+
+    def __del__(self):
+        self.close_connection()
+
+    def close_connection(self):
+        """ Hand the session back to the pool. The shared connection stays open, without the session's event listeners
+        """
+
+        while self.added_listeners:
+            self.connection.off_event(*self.added_listeners.pop())
+
+        self.pool.release(self)
+
+    def next_request_id(self):
+        return self.connection.next_request_id()
+
+    def request_nowait(self, load, req_id, method = None, params = None):
+        return self.connection.request_nowait(load, req_id, method, params)
+
+    def request_timed_out(self, req_id):
+        return self.connection.request_timed_out(req_id)
+
+    def request_cancelled(self, req_id):
+        return self.connection.request_cancelled(req_id)
+
+    def on_event(self, what_event, callback, subscriber = None, buffer = None):
+        self.added_listeners.append((what_event, callback, subscriber))
+        return self.connection.on_event(what_event, callback, subscriber, buffer)
+
+    def off_event(self, what_event, callback, subscriber = None):
+        self.added_listeners = [added for added in self.added_listeners if added[0] != what_event or added[1] is not callback or added[2] != subscriber]
+        return self.connection.off_event(what_event, callback, subscriber)
+
+    def connection_stats(self):
+        return self.connection.connection_stats()
+
+    def add_tracer(self, tracer):
+        # Traces every session on the same connection
+        return self.connection.add_tracer(tracer)
+
+    def remove_tracer(self, tracer):
+        return self.connection.remove_tracer(tracer)
+
+    def metrics_snapshot(self):
+        return self.connection.metrics_snapshot()
+
+    def metrics_prometheus(self, labels = None):
+        return self.connection.metrics_prometheus(labels)
+
+
+class KurentoConnectionPool(object):
+    """ A pool of KMS connections shared by many sessions e.g. one per browser connection
+
+    Example:
+        pool = KurentoConnectionPool.shared("ws://localhost:8888/kurento")
+        cli = pool.client() # Use like a KurentoClient
+        ...
+        cli.close_connection() # Returns the session to the pool
+    """
+
+    _shared = {} # Process-wide pools keyed by server url
+    _shared_lock = threading.Lock()
+
+    def __init__(self, kurento_server_url, size = 4, **client_options):
+        """ Connections are opened lazily, up to size
+
+        Params:
+            kurento_server_url (str) - The Kurento server WebSockets url
+            size (int) - Maximum number of websockets to open to the server
+            client_options - Passed to each KurentoClient, e.g. request_timeout, retry_policy
+        """
+
+        if(size < 1):
+            raise KurentoOperationException("A connection pool needs at least one connection")
+
+        self.kurento_url = kurento_server_url
+        self.size = size
+        self.client_options = client_options
+
+        self.lock = threading.Lock()
+        self.connections = {} # KurentoClient -> number of sessions pinned to it
+        self.sessions = set() # Sessions currently checked out
+
+    @classmethod
+    def shared(cls, kurento_server_url, size = 4, **client_options):
+        """ Get the process-wide pool for a server, creating it on first use
+
+        Params:
+            kurento_server_url (str) - The Kurento server WebSockets url
+            size (int) - Maximum number of websockets. Only used when the pool is created
+            client_options - Passed to each KurentoClient. Only used when the pool is created
+
+        Returns:
+            - KurentoConnectionPool object
+        """
+
+        with cls._shared_lock:
+            if kurento_server_url not in cls._shared:
+                cls._shared[kurento_server_url] = cls(kurento_server_url, size, **client_options)
+
+            return cls._shared[kurento_server_url]
+
+    def client(self):
+        """ Check out a session pinned to the least busy connection. A new connection is opened if none is idle and the pool isn't full
+
+        Returns:
+            - PooledKurentoClient object
+        """
+
+        with self.lock:
+            # Forget connections that died
+            for conn in [conn for conn in self.connections if not conn.thread.is_alive()]: # Connections that are reconnecting are kept
+                del self.connections[conn]
+
+            idle = [conn for conn, in_use in self.connections.items() if in_use == 0]
+            if(idle):
+                conn = idle[0]
+            elif(len(self.connections) < self.size):
+                conn = KurentoClient(self.kurento_url, **self.client_options)
+                self.connections[conn] = 0
+            else:
+                conn = min(self.connections, key = lambda c: (self.connections[c], len(c.pending)))
+
+            self.connections[conn] = self.connections[conn] + 1
+            session = PooledKurentoClient(self, conn)
+            self.sessions.add(session)
+
+        return session
+
+    def release(self, session):
+        """ Return a session to the pool. Releasing a session twice is harmless
+        """
+
+        with self.lock:
+            if session not in self.sessions:
+                return
+
+            self.sessions.discard(session)
+            if session.connection in self.connections:
+                self.connections[session.connection] = self.connections[session.connection] - 1
+
+    def stats(self):
+        """ Sessions per open connection
+
+        Returns:
+            - List of dicts with the number of sessions & in-flight requests of each connection
+        """
+
+        with self.lock:
+            return [{"sessions": in_use, "pending": len(conn.pending)} for conn, in_use in self.connections.items()]
+
+    def metrics_prometheus(self):
+        """ Metrics of every connection in the Prometheus text exposition format, labelled with the connection's index
+
+        Returns:
+            - str
+        """
+
+        with self.lock:
+            conns = list(self.connections)
+
+        samples = []
+        for index, conn in enumerate(conns):
+            samples.extend(conn.metrics.samples(conn.metrics_gauges(), {"connection": str(index)}))
+
+        return prometheus_text(samples)
+
+    def close(self):
+        """ Close every connection in the pool
+        """
+
+        with self.lock:
+            conns = list(self.connections)
+            sessions = self.sessions # Dropped outside the lock, as a session's __del__ takes it
+            self.connections = {}
+            self.sessions = set()
+
+        del sessions
+        for conn in conns:
+            conn.__del__()
+
+        with KurentoConnectionPool._shared_lock:
+            if KurentoConnectionPool._shared.get(self.kurento_url) is self:
+                del KurentoConnectionPool._shared[self.kurento_url]
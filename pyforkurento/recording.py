@@ -0,0 +1,102 @@
+# Record the frames of a KMS connection to a file
+import gzip
+import threading
+import time
+
+HEADER = "#pyforkurento-wire 1"
+SENT = ">"
+RECEIVED = "<"
+
+
+def open_recording(path, mode):
+    # .gz recordings are compressed
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding = "utf-8")
+
+    return open(path, mode, encoding = "utf-8")
+
+def read_recording(path):
+    """ Read a recording made by WireRecorder
+
+    Params:
+        path (str): Recording file
+
+    Returns:
+        - Generator of (direction, seconds since the recording started, frame) tuples. direction is '>' for frames sent to KMS & '<' for frames received. Recordings appended to the same file follow on from each other
+    """
+
+    offset = 0.0 # Each appended recording counts from 0 again
+    last = 0.0
+    with open_recording(path, "r") as f:
+        for line in f:
+            if line.startswith("#"):
+                offset = last
+                continue
+
+            direction, at, frame = line.rstrip("\n").split(" ", 2)
+            last = offset + float(at)
+            yield direction, last, frame
+
+
+class WireRecorder(object):
+    """ Appends every JSON-RPC frame a client sends & receives to a file, one line each: the direction ('>' sent, '<' received), seconds since the recording started, then the frame
+
+    Example:
+        client = KurentoClient(url, recorder = "kms-frames.log.gz")
+    """
+
+    def __init__(self, path, flush_interval = 1.0):
+        """ Params:
+            path (str): File to append to. Compressed with gzip if it ends with .gz
+            flush_interval (float): Most seconds a frame stays buffered before being written out
+        """
+
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.file = open_recording(path, "a")
+        self.start = time.monotonic()
+        self.flushed_at = self.start
+        self.frames = 0
+
+        self.file.write(f"{HEADER} started={time.time():.6f}\n")
+
+    def sent(self, frames):
+        """ Record frames about to be written to the socket. Writer thread
+        """
+
+        self.__write(SENT, frames)
+
+    def received(self, frame):
+        """ Record a frame read from the socket. Listener thread
+        """
+
+        self.__write(RECEIVED, (frame,))
+
+    def __write(self, direction, frames):
+        now = time.monotonic()
+        at = f"{now - self.start:.6f}"
+        with self.lock:
+            if self.file is None:
+                return
+
+            for frame in frames:
+                if isinstance(frame, bytes): # Sent by a codec that serialises to UTF-8
+                    frame = frame.decode()
+                # Frames are JSON, so a newline can only be whitespace between tokens
+                frame = frame.replace("\n", " ")
+                self.file.write(f"{direction} {at} {frame}\n")
+
+            self.frames = self.frames + len(frames)
+            if(now - self.flushed_at >= self.flush_interval):
+                self.file.flush()
+                self.flushed_at = now
+
+    def close(self):
+        """ Write out buffered frames & close the file
+        """
+
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
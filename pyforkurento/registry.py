@@ -0,0 +1,230 @@
+# What a client knows about the media objects it created
+import threading
+import time
+
+from concurrent.futures import Future
+
+EMPTY = frozenset()
+
+
+class MediaObjectInfo(object):
+    # One live media object: its type, pipeline, connections & cached property values
+    __slots__ = ("object_id", "type", "pipeline", "session_id", "sinks", "sources", "properties", "version")
+
+    def __init__(self, object_id, type = None, pipeline = None, session_id = None):
+        self.object_id = object_id
+        self.type = type
+        self.pipeline = pipeline
+        self.session_id = session_id
+        self.sinks = EMPTY # Replaced on change. Most elements have one or two connections, if any
+        self.sources = EMPTY
+        self.properties = {} # (operation, operation params) -> (value, expires at)
+        self.version = 0 # Bumped when an event invalidates properties, so replies to reads sent before it aren't cached
+
+
+class MediaObjectRegistry(object):
+    """ Per-client registry of live media objects. Holds each object's type, pipeline & connections, and caches the values its getters return
+
+    Cached values expire after a TTL, and are dropped early by the events that change them, e.g. MediaFlowIn or ElementConnected, once the element is subscribed to those. Identical reads made while one is in flight share its request
+
+    Example:
+        client = KurentoClient(url, property_ttl = 2.0)
+        rtc.watch() # Subscribe to the events that invalidate its cached state
+        rtc.is_media_flowing_in() # Asks KMS
+        rtc.is_media_flowing_in() # Answered from the cache, until a MediaFlowIn event or 2 seconds pass
+        client.registry.info(rtc.elem_id)
+    """
+
+    # Event type -> getter operations whose values it changes
+    INVALIDATED_BY = {
+        "MediaFlowIn": ("isMediaFlowingIn",),
+        "MediaFlowInStateChange": ("isMediaFlowingIn",),
+        "MediaFlowOut": ("isMediaFlowingOut",),
+        "MediaFlowOutStateChange": ("isMediaFlowingOut",),
+        "ElementConnected": ("getSinkConnections", "getSourceConnections", "isMediaFlowingIn", "isMediaFlowingOut"),
+        "ElementDisconnected": ("getSinkConnections", "getSourceConnections", "isMediaFlowingIn", "isMediaFlowingOut"),
+        "MediaStateChanged": ("getMediaState",),
+        "ConnectionStateChanged": ("getConnectionState",),
+        "IceComponentStateChange": ("getIceConnectionState",)
+    }
+
+    def __init__(self, ttl = 5.0):
+        """ Params:
+            ttl (float): Seconds a property value is cached for. 0 turns caching off, but identical reads in flight are still coalesced
+        """
+
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.objects = {} # Object id -> MediaObjectInfo
+        self.in_flight = {} # (object id, operation, operation params) -> (future of the value, JSON-RPC id)
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def __info(self, object_id):
+        # Caller holds the lock
+        info = self.objects.get(object_id)
+        if info is None:
+            info = self.objects[object_id] = MediaObjectInfo(object_id)
+
+        return info
+
+    def register(self, object_id, type = None, pipeline = None, session_id = None):
+        """ Record a media object the client created
+
+        Params:
+            object_id (str): Media object id
+            type (str): KMS type e.g. WebRtcEndpoint
+            pipeline (str): Id of its pipeline. None for pipelines
+            session_id (str): KMS session it was created in
+        """
+
+        with self.lock:
+            info = self.__info(object_id)
+            info.type, info.pipeline, info.session_id = type, pipeline, session_id
+
+    def forget(self, object_id):
+        """ Drop a released media object. Releasing a pipeline drops its elements too
+        """
+
+        with self.lock:
+            gone = {oid for oid, info in self.objects.items() if oid == object_id or info.pipeline == object_id}
+            for oid in gone:
+                info = self.objects.pop(oid)
+                for other in info.sinks | info.sources:
+                    if other in self.objects:
+                        self.objects[other].sinks = self.objects[other].sinks - {oid}
+                        self.objects[other].sources = self.objects[other].sources - {oid}
+
+    def connected(self, source, sink):
+        """ Record a connection made by the client
+        """
+
+        with self.lock:
+            self.__info(source).sinks = self.__info(source).sinks | {sink}
+            self.__info(sink).sources = self.__info(sink).sources | {source}
+
+    def on_event(self, what_event, object_id):
+        """ Drop the cached properties an event changes. Listener thread
+        """
+
+        operations = self.INVALIDATED_BY.get(what_event)
+        if operations is None:
+            return
+
+        with self.lock:
+            info = self.objects.get(object_id)
+            if info is None:
+                return
+
+            info.version = info.version + 1
+            for key in [key for key in info.properties if key[0] in operations]:
+                del info.properties[key]
+                self.invalidations = self.invalidations + 1
+
+    def invalidate(self, object_id, operation = None):
+        """ Drop cached properties of an object. All of them if no operation is given
+        """
+
+        with self.lock:
+            info = self.objects.get(object_id)
+            if info is not None:
+                info.version = info.version + 1
+                for key in [key for key in info.properties if operation is None or key[0] == operation]:
+                    del info.properties[key]
+
+    def get(self, object_id, operation, operation_params, fetch, ttl = None):
+        """ A property value, from the cache while fresh. Otherwise fetched, unless an identical read is already in flight
+
+        Params:
+            object_id (str): Media object id
+            operation (str): Getter e.g. isMediaFlowingIn
+            operation_params (dict): The getter's params. Values have to be hashable
+            fetch (func): Sends the read. Returns (future of the value, JSON-RPC id)
+            ttl (float): Seconds to cache the value for. Defaults to the registry's TTL
+
+        Returns:
+            - (future of the value, JSON-RPC id of the request it waits for) tuple. The id is None for cached values
+        """
+
+        key = (operation, tuple(sorted(operation_params.items())))
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+
+        with self.lock:
+            info = self.__info(object_id)
+            cached = info.properties.get(key)
+            if(cached is not None and cached[1] > now):
+                self.hits = self.hits + 1
+                fut = Future()
+                fut.set_result(cached[0])
+                return fut, None
+
+            waiting = self.in_flight.get((object_id,) + key)
+            if waiting is not None:
+                self.coalesced = self.coalesced + 1
+                return waiting
+
+            self.misses = self.misses + 1
+            version = info.version
+
+            # Sent under the lock, so a concurrent identical read can't slip in before it's marked in flight. fetch() only queues the request
+            fut, req_id = fetch()
+            self.in_flight[(object_id,) + key] = (fut, req_id)
+
+        def done(f):
+            with self.lock:
+                self.in_flight.pop((object_id,) + key, None)
+                info = self.objects.get(object_id)
+                if(ttl > 0 and info is not None and info.version == version and not f.cancelled() and f.exception() is None):
+                    info.properties[key] = (f.result(), time.monotonic() + ttl)
+
+        fut.add_done_callback(done) # Straight away if it's already done
+        return fut, req_id
+
+    def info(self, object_id):
+        """ What the registry knows about a media object
+
+        Returns:
+            - Dict with the object's type, pipeline, session, sinks, sources & fresh cached properties. None for unknown objects
+        """
+
+        now = time.monotonic()
+        with self.lock:
+            info = self.objects.get(object_id)
+            if info is None:
+                return None
+
+            return {
+                "type": info.type,
+                "pipeline": info.pipeline,
+                "session_id": info.session_id,
+                "sinks": sorted(info.sinks),
+                "sources": sorted(info.sources),
+                "properties": {f"{op}{dict(params) if params else ''}": value for (op, params), (value, expires) in info.properties.items() if expires > now}
+            }
+
+    def find(self, type = None, pipeline = None):
+        """ Ids of the live media objects of a type and/or in a pipeline
+        """
+
+        with self.lock:
+            return [oid for oid, info in self.objects.items() if (type is None or info.type == type) and (pipeline is None or info.pipeline == pipeline)]
+
+    def stats(self):
+        """ Returns:
+            - Dict with the number of objects & cached values, and the cache's hits, misses, coalesced reads & invalidations
+        """
+
+        with self.lock:
+            return {
+                "objects": len(self.objects),
+                "cached": sum(len(info.properties) for info in self.objects.values()),
+                "in_flight": len(self.in_flight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "invalidations": self.invalidations
+            }
@@ -0,0 +1,116 @@
+# Replay recorded KMS frames through a client, without KMS
+import json
+import threading
+import time
+
+from .client import KurentoClient
+from .recording import SENT
+from .recording import read_recording
+
+from .exceptions import KurentoOperationException
+
+
+class ReplayConnection(object):
+    """ Stands in for the websocket of a ReplayKurentoClient. recv() hands out the recorded frames received from KMS, paced like the recording
+    """
+
+    def __init__(self, client, path, speed):
+        self.client = client
+        self.frames = read_recording(path)
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.connected = True
+        self.started = threading.Event()
+        self.start = None
+        self.replayed = 0
+
+    def recv(self):
+        self.started.wait()
+
+        for direction, at, frame in self.frames:
+            if not self.connected:
+                break
+
+            if self.speed is not None:
+                delay = self.start + at / self.speed - time.monotonic()
+                if(delay > 0):
+                    time.sleep(delay)
+
+            if(direction == SENT):
+                # The request is registered as if just sent, so that reply latencies show in metrics & tracers
+                request = json.loads(frame)
+                if "id" in request:
+                    self.client.register_request(request["id"], None, request.get("method"), request.get("params"))
+                continue
+
+            self.replayed = self.replayed + 1
+            return frame
+
+        self.connected = False
+        raise KurentoOperationException("End of the recording")
+
+    def send_close(self):
+        self.connected = False
+
+    def abort(self):
+        self.connected = False
+        self.started.set()
+
+    def shutdown(self):
+        self.connected = False
+
+    def _send(self, data):
+        raise KurentoOperationException("A replay can't send requests")
+
+
+class ReplayKurentoClient(KurentoClient):
+    """ Feeds a recording made with WireRecorder back through the client's reply parsing & event dispatch, without KMS. Reproduces event storms & slow replies offline, e.g. to profile them
+
+    Example:
+        replay = ReplayKurentoClient("kms-frames.log.gz", speed = None)
+        replay.on_event("OnIceCandidate", on_candidate) # Every element's events
+        replay.replay()
+        print(replay.metrics_snapshot())
+    """
+
+    def __init__(self, path, speed = 1.0, **client_options):
+        """ Params:
+            path (str): Recording file
+            speed (float): 1.0 replays at the recorded pace, 2.0 twice as fast. None replays as fast as possible
+            client_options: Passed to KurentoClient, e.g. callback_pool or tracers. Heartbeats & reconnects are off
+        """
+
+        if(speed is not None and speed <= 0):
+            raise KurentoOperationException("Replay speed has to be positive")
+
+        self.recording = path
+        self.speed = speed
+        client_options.update(heartbeat_interval = None, reconnect_policy = None)
+        super().__init__(f"replay://{path}", **client_options)
+
+    def open_connection(self, kurento_server_url):
+        return ReplayConnection(self, self.recording, self.speed)
+
+    def recover_connection(self, reason):
+        return False # End of the recording. Nothing to reconnect to
+
+    def replay(self, wait = True):
+        """ Start feeding the recorded frames. Add event listeners first
+
+        Params:
+            wait (bool): Block until the whole recording has been replayed & the callbacks of its events have run
+
+        Returns:
+            - Number of frames received from KMS that were replayed
+        """
+
+        conn = self.kurento_conn
+        conn.start = time.monotonic()
+        conn.started.set()
+
+        if wait:
+            self.thread.join()
+            self.subscriptions_queue.join() # Every event handed to its listeners' buffers
+            self.callback_pool.wait_idle() # & the buffers drained into the callbacks
+
+        return conn.replayed
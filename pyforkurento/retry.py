@@ -0,0 +1,55 @@
+# Retries with backoff for requests that are safe to re-send
+import random
+
+from .exceptions import KurentoConnectionException
+from .exceptions import KurentoTimeoutException
+
+
+class RetryPolicy(object):
+    """ When & how often to re-send a request that timed out or lost its connection
+
+    Only idempotent requests are ever retried: pings, and invokes of getters (operations starting with 'get'). Requests that change server state, e.g. create or connect, are never re-sent, as the first attempt may have gone through
+
+    Example:
+        client = KurentoClient(url, retry_policy = RetryPolicy(retries = 3, backoff = 0.2))
+    """
+
+    def __init__(self, retries = 3, backoff = 0.1, multiplier = 2.0, max_backoff = 5.0, jitter = 0.1, retry_on = (KurentoTimeoutException, KurentoConnectionException)):
+        """ Params:
+            retries (int): Attempts after the first one
+            backoff (float): Seconds to wait before the first retry
+            multiplier (float): Factor the wait grows by after each retry
+            max_backoff (float): Longest wait between attempts, in seconds
+            jitter (float): Random spread applied to each wait, as a fraction of it
+            retry_on (tuple): Exception classes worth retrying
+        """
+
+        self.retries = retries
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on = retry_on
+
+    def should_retry(self, retry, exc):
+        """ Whether to make retry number 'retry' (0 based) after the exception given
+        """
+
+        return retry < self.retries and isinstance(exc, self.retry_on)
+
+    def delay(self, retry):
+        """ Seconds to wait before retry number 'retry' (0 based)
+        """
+
+        delay = min(self.max_backoff, self.backoff * (self.multiplier ** retry))
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    @staticmethod
+    def is_idempotent(method, params):
+        """ Whether a request can safely be sent more than once
+        """
+
+        if(method == "ping"):
+            return True
+
+        return method == "invoke" and params.get("operation", "").startswith("get")
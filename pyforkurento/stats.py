@@ -0,0 +1,564 @@
+# Periodic getStats sampling of many WebRTC endpoints, kept in columnar ring buffers, & latency through a pipeline
+import array
+import concurrent.futures
+import math
+import threading
+import time
+
+try:
+    import numpy
+except ImportError: # Optional. Pure Python fallback
+    numpy = None
+
+from .exceptions import KurentoOperationException
+from .exceptions import KurentoTimeoutException
+
+COLUMNS = ("bytes_received", "bytes_sent", "packets_received", "packets_lost", "jitter", "rtt")
+NAN = float("nan")
+OBJECT_NOT_FOUND = 40101
+
+# Where older KMS reports the latencies now in inputLatency & E2ELatency. (where, media type) -> key
+LEGACY_LATENCIES = {
+    ("input", "AUDIO"): "inputAudioLatency",
+    ("input", "VIDEO"): "inputVideoLatency",
+    ("e2e", "AUDIO"): "audioE2ELatency",
+    ("e2e", "VIDEO"): "videoE2ELatency"
+}
+
+
+def stats_row(stats):
+    """ Boil a getStats result down to one value per column. Counters are summed over the RTP streams, jitter & RTT are the worst stream's
+
+    Params:
+        stats (dict): getStats result, stats id -> RTC stats dict
+
+    Returns:
+        - Tuple of values in COLUMNS order, in the units KMS reports them. NaN where KMS gave nothing
+    """
+
+    received = sent = packets = lost = 0
+    jitter = rtt = NAN
+    inbound = outbound = False
+    for stat in stats.values():
+        kind = stat.get("type", "").replace("-", "")
+        if(kind == "inboundrtp"):
+            inbound = True
+            received = received + stat.get("bytesReceived", 0)
+            packets = packets + stat.get("packetsReceived", 0)
+            lost = lost + stat.get("packetsLost", 0)
+            if "jitter" in stat:
+                jitter = stat["jitter"] if math.isnan(jitter) else max(jitter, stat["jitter"])
+        elif(kind == "outboundrtp"):
+            outbound = True
+            sent = sent + stat.get("bytesSent", 0)
+            if "roundTripTime" in stat:
+                rtt = stat["roundTripTime"] if math.isnan(rtt) else max(rtt, stat["roundTripTime"])
+
+    if not inbound:
+        received = packets = lost = NAN
+    if not outbound:
+        sent = NAN
+
+    return (received, sent, packets, lost, jitter, rtt)
+
+
+class StatsRing(object):
+    """ The last capacity sampling rounds of many endpoints. Each column is one (endpoints x rounds) block, a NumPy array when NumPy is installed, written a round at a time. Gaps are NaN
+    """
+
+    def __init__(self, capacity = 300, columns = COLUMNS, rows = 64):
+        """ Params:
+            capacity (int): Rounds kept. The oldest is overwritten
+            columns (tuple): Names of the values in each sample
+            rows (int): Endpoints room is made for up front. Grows as needed
+        """
+
+        self.capacity = capacity
+        self.columns = columns
+        self.rows = rows
+        self.slots = {} # Endpoint id -> row
+        self.free = [] # Rows of removed endpoints
+        self.rounds = 0 # Rounds written so far
+        self.times = numpy.full(capacity, NAN) if numpy is not None else array.array("d", [NAN]) * capacity # time.monotonic() of each round
+        self.data = {name: self.__block(rows) for name in columns}
+
+    def __block(self, rows):
+        if numpy is not None:
+            return numpy.full((rows, self.capacity), NAN)
+        return array.array("d", [NAN]) * (rows * self.capacity)
+
+    def __clear_row(self, block, row):
+        if numpy is not None:
+            block[row, :] = NAN
+        else:
+            block[row * self.capacity:(row + 1) * self.capacity] = array.array("d", [NAN]) * self.capacity
+
+    def slot(self, endpoint_id):
+        """ Row of an endpoint, allocated on first use
+        """
+
+        row = self.slots.get(endpoint_id)
+        if row is not None:
+            return row
+
+        if self.free:
+            row = self.free.pop()
+        else:
+            row = len(self.slots)
+            if(row >= self.rows):
+                grown = self.rows * 2
+                for name, block in self.data.items():
+                    if numpy is not None:
+                        self.data[name] = numpy.vstack((block, numpy.full((grown - self.rows, self.capacity), NAN)))
+                    else:
+                        block.extend(array.array("d", [NAN]) * ((grown - self.rows) * self.capacity))
+                self.rows = grown
+
+        self.slots[endpoint_id] = row
+        return row
+
+    def release(self, endpoint_id):
+        """ Forget an endpoint's samples & free its row
+        """
+
+        row = self.slots.pop(endpoint_id, None)
+        if row is not None:
+            for block in self.data.values():
+                self.__clear_row(block, row)
+            self.free.append(row)
+
+    def write(self, at, samples):
+        """ Store a sampling round
+
+        Params:
+            at (float): time.monotonic() of the round
+            samples (dict): Endpoint id -> tuple of values in column order. Endpoints missing from it get NaN for the round
+        """
+
+        col = self.rounds % self.capacity
+        rows = [self.slot(endpoint_id) for endpoint_id in samples]
+        values = list(zip(*samples.values())) # One tuple per column
+
+        for i, name in enumerate(self.columns):
+            block = self.data[name]
+            if numpy is not None:
+                block[:, col] = NAN
+                if rows:
+                    block[rows, col] = values[i]
+            else:
+                for row in range(self.rows):
+                    block[row * self.capacity + col] = NAN
+                for row, value in zip(rows, values[i] if rows else ()):
+                    block[row * self.capacity + col] = value
+
+        self.times[col] = at
+        self.rounds = self.rounds + 1
+
+    def window(self, seconds = None, now = None):
+        """ Positions of the rounds within the last seconds, oldest first. All rounds kept if seconds is None
+        """
+
+        kept = min(self.rounds, self.capacity)
+        positions = [(self.rounds - kept + i) % self.capacity for i in range(kept)]
+        if seconds is not None:
+            since = (time.monotonic() if now is None else now) - seconds
+            positions = [pos for pos in positions if self.times[pos] >= since]
+
+        return positions
+
+
+class StatsSampler(object):
+    """ Polls getStats on many WebRTC endpoints on a schedule. A round's requests are all sent before any reply is waited for, so the writer thread batches them into a few socket writes & a round costs about one round trip, not one per endpoint
+
+    Samples go into a StatsRing. Aggregates are worked out over whole columns at once, vectorised with NumPy when it's installed
+
+    Example:
+        sampler = StatsSampler(client, interval = 1.0)
+        sampler.add(rtc_a, rtc_b)
+        sampler.start()
+        ...
+        sampler.endpoint_stats(rtc_a, window = 10) # Bitrates, loss, jitter & RTT over the last 10s
+        sampler.fleet_stats(window = 10) # Percentiles of those across every endpoint
+    """
+
+    def __init__(self, client, interval = 1.0, capacity = 300, media_type = None, timeout = None):
+        """ Params:
+            client (KurentoClient): Client the endpoints were created through
+            interval (float): Seconds between rounds
+            capacity (int): Rounds kept per endpoint
+            media_type (str): AUDIO or VIDEO to sample only those streams. Both by default
+            timeout (float): Seconds to wait for a round's replies. Defaults to the interval
+        """
+
+        self.client = client
+        self.interval = interval
+        self.media_type = media_type
+        self.timeout = timeout if timeout is not None else interval
+        self.ring = StatsRing(capacity)
+
+        self.lock = threading.Lock() # Guards endpoints & ring
+        self.endpoints = {} # Endpoint id -> element
+        self.stopped = threading.Event()
+        self.thread = None
+
+        self.rounds = 0
+        self.errors = 0
+        self.round_duration = None # Seconds the last round took
+
+    def add(self, *endpoints):
+        """ Start sampling endpoints
+        """
+
+        with self.lock:
+            for elem in endpoints:
+                self.endpoints[elem.elem_id] = elem
+
+    def remove(self, *endpoints):
+        """ Stop sampling endpoints & drop their samples
+        """
+
+        with self.lock:
+            for elem in endpoints:
+                self.endpoints.pop(elem.elem_id, None)
+                self.ring.release(elem.elem_id)
+
+    def sample(self):
+        """ Run one round now
+
+        Returns:
+            - Number of endpoints sampled
+        """
+
+        with self.lock:
+            endpoints = list(self.endpoints.values())
+
+        start = time.monotonic()
+        sent = []
+        for elem in endpoints:
+            params = {"object": elem.elem_id, "operation": "getStats", "sessionId": elem.session_id}
+            if self.media_type is not None:
+                params["operationParams"] = {"mediaType": self.media_type}
+            sent.append((elem, self.client.send_request("invoke", params)))
+
+        rows = {}
+        gone = []
+        end = start + self.timeout
+        for elem, fut in sent:
+            try:
+                resp = fut.result(max(0, end - time.monotonic()))
+            except Exception: # Timed out or the connection dropped. A gap in the samples
+                self.client.request_timed_out(fut.req_id)
+                self.errors = self.errors + 1
+                continue
+
+            if not resp["resp_success"]:
+                self.errors = self.errors + 1
+                if(resp["payload"].get("code") == OBJECT_NOT_FOUND):
+                    gone.append(elem) # Released elsewhere
+                continue
+
+            rows[elem.elem_id] = stats_row(resp["payload"]["value"] or {})
+
+        with self.lock:
+            self.ring.write(start, rows)
+        if gone:
+            self.remove(*gone)
+
+        self.rounds = self.rounds + 1
+        self.round_duration = time.monotonic() - start
+        return len(rows)
+
+    def start(self):
+        """ Sample every interval on a background thread
+        """
+
+        if(self.thread is not None and self.thread.is_alive()):
+            raise KurentoOperationException("The sampler is already running")
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target = self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop sampling. Samples taken are kept
+        """
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __run(self):
+        next_at = time.monotonic()
+        while not self.stopped.is_set():
+            self.sample()
+            next_at = next_at + self.interval
+            now = time.monotonic()
+            if(next_at < now):
+                next_at = now # Fell behind. Skip the rounds missed rather than bunching them up
+
+            self.stopped.wait(next_at - now)
+
+    def aggregates(self, window = None):
+        """ Per-endpoint figures over a window
+
+        Params:
+            window (float): Seconds to look back. Every round kept by default
+
+        Returns:
+            - Dict of column or figure name -> sequence with one value per endpoint, plus 'endpoints' with their ids in the same order. Figures are bitrate_in_bps & bitrate_out_bps from the change in byte counters, packet_loss as the fraction of packets lost, and jitter & rtt averaged. NaN where there's too little data
+        """
+
+        with self.lock:
+            ids = list(self.ring.slots)
+            rows = [self.ring.slots[endpoint_id] for endpoint_id in ids]
+            positions = self.ring.window(window)
+            if numpy is not None:
+                # The window is a run of columns, wrapping at most once. Copying it as slices is far cheaper than gathering cells
+                capacity = self.ring.capacity
+                start, count = (positions[0], len(positions)) if positions else (0, 0)
+                spans = [slice(start, min(start + count, capacity))]
+                if(start + count > capacity):
+                    spans.append(slice(0, start + count - capacity))
+
+                top = max(rows) + 1 if rows else 0 # Rows above were never used. Free rows below are all NaN
+                times = numpy.concatenate([self.ring.times[span] for span in spans])
+                data = {name: numpy.concatenate([block[:top, span] for span in spans], axis = 1) for name, block in self.ring.data.items()}
+            else:
+                capacity = self.ring.capacity
+                times = [self.ring.times[pos] for pos in positions]
+                data = {name: [[block[row * capacity + pos] for pos in positions] for row in rows] for name, block in self.ring.data.items()}
+
+        if numpy is not None:
+            figures = vectorised_figures(times, data)
+            picked = numpy.array(rows, dtype = numpy.intp)
+            figures = {name: values[picked] for name, values in figures.items()}
+        else:
+            figures = python_figures(times, data)
+        figures["endpoints"] = ids
+        return figures
+
+    def endpoint_stats(self, endpoint, window = None):
+        """ Bitrates, packet loss, jitter & RTT of one endpoint over a window. See aggregates()
+
+        Returns:
+            - Dict of figure -> value. None if the endpoint isn't sampled
+        """
+
+        figures = self.aggregates(window)
+        if endpoint.elem_id not in figures["endpoints"]:
+            return None
+
+        i = figures["endpoints"].index(endpoint.elem_id)
+        return {name: none_if_nan(float(values[i])) for name, values in figures.items() if name != "endpoints"}
+
+    def fleet_stats(self, window = None, percentiles = (50, 90, 99)):
+        """ The spread of every figure across all sampled endpoints
+
+        Returns:
+            - Dict of figure -> dict with the count of endpoints that have it, mean, max & percentiles e.g. p90
+        """
+
+        figures = self.aggregates(window)
+        out = {}
+        for name, values in figures.items():
+            if(name == "endpoints"):
+                continue
+
+            if numpy is not None:
+                values = values[~numpy.isnan(values)]
+                count = int(values.size)
+                spread = {f"p{p}": float(v) for p, v in zip(percentiles, numpy.percentile(values, percentiles))} if count else {}
+                mean, top = (float(values.mean()), float(values.max())) if count else (None, None)
+            else:
+                values = sorted(v for v in values if not math.isnan(v))
+                count = len(values)
+                spread = {f"p{p}": percentile(values, p) for p in percentiles} if count else {}
+                mean, top = (sum(values) / count, values[-1]) if count else (None, None)
+
+            out[name] = dict({"count": count, "mean": mean, "max": top}, **{f"p{p}": spread.get(f"p{p}") for p in percentiles})
+
+        out["endpoints"] = len(figures["endpoints"])
+        out["rounds"] = self.rounds
+        out["errors"] = self.errors
+        out["round_duration_s"] = self.round_duration
+        return out
+
+
+def vectorised_figures(times, data):
+    # Figures for every endpoint at once. Rows are endpoints, columns rounds
+    rows = data["bytes_received"].shape[0]
+    if(rows == 0 or times.size == 0):
+        return {name: numpy.full(rows, NAN) for name in ("bitrate_in_bps", "bitrate_out_bps", "packet_loss", "jitter", "rtt")}
+
+    def delta(name):
+        # Change between each endpoint's first & last sample of the column, & the seconds between them
+        block = data[name]
+        valid = ~numpy.isnan(block)
+        first = valid.argmax(axis = 1)
+        last = block.shape[1] - 1 - valid[:, ::-1].argmax(axis = 1)
+        picked = numpy.arange(block.shape[0])
+        change = block[picked, last] - block[picked, first]
+        seconds = times[last] - times[first]
+        change[(~valid.any(axis = 1)) | (last == first) | (change < 0)] = NAN # No pair of samples, or the counters reset
+        return change, seconds
+
+    with numpy.errstate(invalid = "ignore", divide = "ignore"):
+        received, seconds_in = delta("bytes_received")
+        sent, seconds_out = delta("bytes_sent")
+        packets, _ = delta("packets_received")
+        lost, _ = delta("packets_lost")
+
+        return {
+            "bitrate_in_bps": 8 * received / seconds_in,
+            "bitrate_out_bps": 8 * sent / seconds_out,
+            "packet_loss": lost / (packets + lost),
+            "jitter": nanmean(data["jitter"]),
+            "rtt": nanmean(data["rtt"])
+        }
+
+def nanmean(block):
+    # Row means ignoring NaN, without numpy's warning for rows that are all NaN
+    valid = ~numpy.isnan(block)
+    counts = valid.sum(axis = 1)
+    sums = numpy.where(valid, block, 0.0).sum(axis = 1)
+    with numpy.errstate(invalid = "ignore", divide = "ignore"):
+        return numpy.where(counts > 0, sums / counts, NAN)
+
+def python_figures(times, data):
+    # Same as vectorised_figures(), a row at a time
+    def delta(values):
+        samples = [(t, v) for t, v in zip(times, values) if not math.isnan(v)]
+        if(len(samples) < 2 or samples[-1][1] < samples[0][1]):
+            return NAN, NAN
+        return samples[-1][1] - samples[0][1], samples[-1][0] - samples[0][0]
+
+    def ratio(a, b):
+        return a / b if b and not math.isnan(a) and not math.isnan(b) else NAN
+
+    def mean(values):
+        values = [v for v in values if not math.isnan(v)]
+        return sum(values) / len(values) if values else NAN
+
+    figures = {"bitrate_in_bps": [], "bitrate_out_bps": [], "packet_loss": [], "jitter": [], "rtt": []}
+    for i in range(len(data["bytes_received"])):
+        received, seconds_in = delta(data["bytes_received"][i])
+        sent, seconds_out = delta(data["bytes_sent"][i])
+        packets, _ = delta(data["packets_received"][i])
+        lost, _ = delta(data["packets_lost"][i])
+
+        figures["bitrate_in_bps"].append(ratio(8 * received, seconds_in))
+        figures["bitrate_out_bps"].append(ratio(8 * sent, seconds_out))
+        figures["packet_loss"].append(ratio(lost, packets + lost))
+        figures["jitter"].append(mean(data["jitter"][i]))
+        figures["rtt"].append(mean(data["rtt"][i]))
+
+    return figures
+
+def percentile(ordered, pct):
+    # Linear interpolation between closest ranks, as numpy.percentile does
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def none_if_nan(value):
+    return None if math.isnan(value) else value
+
+
+def latency_row(stats):
+    """ The latencies an element reports in its getStats result once its pipeline has latency stats on. KMS measures them from when media entered the pipeline
+
+    Params:
+        stats (dict): getStats result, stats id -> RTC stats dict
+
+    Returns:
+        - Dict with 'input', the latency at the element's input, & 'e2e', at an endpoint's output. Each maps media type e.g. VIDEO -> ms
+    """
+
+    row = {"input": {}, "e2e": {}}
+    for stat in stats.values():
+        if stat.get("type") not in ("element", "endpoint"):
+            continue
+
+        for where, key in (("input", "inputLatency"), ("e2e", "E2ELatency")):
+            for latency in stat.get(key) or (): # One per pad. The slowest counts
+                ms = latency["avg"] / 1e6 # ns
+                row[where][latency["type"]] = max(ms, row[where].get(latency["type"], ms))
+
+        for (where, media_type), key in LEGACY_LATENCIES.items():
+            if(key in stat and media_type not in row[where]):
+                row[where][media_type] = stat[key] / 1e6
+
+    return row
+
+def invoke_value(client, params, timeout):
+    # Invoke & wait, from any thread, whatever the client. Returns the value
+    return reply_value(client, client.send_request("invoke", params), timeout)
+
+def reply_value(client, fut, timeout):
+    try:
+        resp = fut.result(timeout)
+    except concurrent.futures.TimeoutError:
+        client.request_timed_out(fut.req_id)
+        raise KurentoTimeoutException(f"KMS did not reply to request {fut.req_id} within {timeout:.3f}s")
+
+    if not resp["resp_success"]:
+        raise KurentoOperationException(resp["payload"].get("message", resp["payload"]))
+    return resp["payload"]["value"]
+
+def measure_latency(client, pipeline, elements, samples = 5, interval = 0.5, media_type = "VIDEO", timeout = 20):
+    """ Sample the latency media picks up through a chain of elements, to find the one adding delay. Turns latency stats on for the pipeline while sampling, if they were off. Blocks, so call it from a thread with AsyncKurentoClient
+
+    Params:
+        client (KurentoClient): Client the pipeline was created through
+        pipeline (MediaPipeline): The elements' pipeline
+        elements (list): Elements in the order media flows through them e.g. [player, gst_filter, rtc]
+        samples (int): getStats rounds to average
+        interval (float): Seconds between rounds. KMS' figures are themselves moving averages
+        media_type (str): Media whose latency is attributed to elements. AUDIO or VIDEO
+        timeout (float): Seconds to wait for each reply
+
+    Returns:
+        - List with a dict per element, in chain order: element id, type, input_ms & e2e_ms (media type -> mean ms), and processing_ms, the latency of media_type added between the element's input & the next element's input, or its own output for the last. None where KMS reported nothing
+    """
+
+    session = {"sessionId": pipeline.session_id}
+    toggle = lambda on: invoke_value(client, dict(session, object = pipeline.pipeline_id, operation = "setLatencyStats", operationParams = {"latencyStats": on}), timeout)
+    was_on = invoke_value(client, dict(session, object = pipeline.pipeline_id, operation = "getLatencyStats"), timeout)
+    if not was_on:
+        toggle(True)
+        time.sleep(interval) # Let KMS collect some
+
+    totals = [{"input": {}, "e2e": {}} for _ in elements] # -> media type -> (sum, count)
+    try:
+        for i in range(samples):
+            if(i > 0):
+                time.sleep(interval)
+
+            sent = [client.send_request("invoke", {"object": elem.elem_id, "operation": "getStats", "sessionId": elem.session_id}) for elem in elements]
+            for fut, total in zip(sent, totals):
+                value = reply_value(client, fut, timeout)
+                for where, latencies in latency_row(value or {}).items():
+                    for kind, ms in latencies.items():
+                        added, count = total[where].get(kind, (0.0, 0))
+                        total[where][kind] = (added + ms, count + 1)
+    finally:
+        if not was_on:
+            toggle(False)
+
+    report = []
+    for elem, total in zip(elements, totals):
+        report.append({
+            "element": elem.elem_id,
+            "type": type(elem).__name__,
+            "input_ms": {kind: added / count for kind, (added, count) in total["input"].items()},
+            "e2e_ms": {kind: added / count for kind, (added, count) in total["e2e"].items()}
+        })
+
+    for i, row in enumerate(report):
+        here = row["input_ms"].get(media_type)
+        after = report[i + 1]["input_ms"].get(media_type) if i + 1 < len(report) else row["e2e_ms"].get(media_type)
+        row["processing_ms"] = after - here if(here is not None and after is not None) else None
+
+    return report
@@ -0,0 +1,435 @@
+# Hooks on requests, replies & events, for building traces of call setups
+import contextlib
+import contextvars
+import threading
+import time
+
+from collections import deque
+
+try:
+    from opentelemetry import context as otel_context
+    from opentelemetry import trace as otel_trace
+except ImportError: # Optional
+    otel_trace = None
+
+from .exceptions import KurentoOperationException
+from .metrics import LatencyHistogram
+
+current_span = contextvars.ContextVar("current_span", default = None) # Innermost SpanRecorder.span() of the caller
+
+
+class Tracer(object):
+    """ Receives a record of every request, reply & event of the clients it's added to. Override the hooks needed
+
+    Request records are dicts with:
+        * id - JSON-RPC id
+        * method, operation - e.g. invoke & processOffer. operation is None except for invokes
+        * object - Id of the media object the request is about. For creates, the type created until the reply gives the id
+        * session - KMS session id, when the request carries one
+        * params - The request's params, as sent. Don't change them
+        * created_at - time.monotonic() when the request was made
+        * sent_at - When it was handed to the socket, just before the write
+        * received_at - When the reply arrived, or the request failed without one. Only in on_response_received
+        * success - Whether KMS replied without an error. Only in on_response_received
+        * error - None, 'error' for an error reply, 'timeout', 'connection' or 'cancelled'. Only in on_response_received
+        * context - contextvars.Context of the caller, e.g. to find its current span
+
+    Event records have type, object, received_at & payload. The payload is decoded when first read, so tracers that don't need it should leave it alone
+
+    Hooks run on the client's writer, listener & dispatcher threads, so they have to be quick & must not block
+    """
+
+    def on_request_sent(self, request):
+        pass
+
+    def on_response_received(self, request):
+        pass
+
+    def on_event_received(self, event):
+        pass
+
+
+class Span(object):
+    # A named stretch of work, e.g. one call setup, & the requests made during it
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.start = time.monotonic()
+        self.end = None
+        self.requests = []
+        self.children = []
+
+    def as_dict(self):
+        ms = lambda seconds: round(seconds * 1000, 3)
+        return {
+            "name": self.name,
+            "duration_ms": ms(self.end - self.start),
+            "requests": [{
+                "method": r["method"],
+                "operation": r["operation"],
+                "object": r["object"],
+                "start_ms": ms(r["created_at"] - self.start),
+                "queued_ms": ms(r["sent_at"] - r["created_at"]),
+                "duration_ms": ms(r["received_at"] - r["created_at"]),
+                "error": r["error"]
+            } for r in self.requests],
+            "children": [child.as_dict() for child in self.children]
+        }
+
+
+class SpanRecorder(Tracer):
+    """ Groups requests into spans, to see which KMS operations a call setup spends its time on
+
+    Example:
+        recorder = SpanRecorder()
+        client = KurentoClient(url, tracers = [recorder])
+
+        with recorder.span("call_setup"):
+            pipeline = client.create_media_pipeline()
+            rtc = pipeline.add_endpoint("WebRtcEndpoint")
+            sdp_answer = rtc.process_offer(sdp_offer)
+
+        recorder.breakdown() # Time per operation, slowest first
+    """
+
+    def __init__(self, max_spans = 1000):
+        """ Params:
+            max_spans (int): Finished top level spans kept. The oldest are dropped
+        """
+
+        self.lock = threading.Lock()
+        self.finished = deque(maxlen = max_spans)
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """ Attribute the requests made inside a with block, including from coroutines it starts, to a span. Spans nest
+        """
+
+        parent = current_span.get()
+        span = Span(name, parent)
+        token = current_span.set(span)
+        try:
+            yield span
+        finally:
+            current_span.reset(token)
+            span.end = time.monotonic()
+            with self.lock:
+                if parent is None:
+                    self.finished.append(span)
+                else:
+                    parent.children.append(span)
+
+    def on_response_received(self, request):
+        context = request["context"]
+        span = context.get(current_span) if context is not None else None
+        if span is not None:
+            with self.lock:
+                span.requests.append(request)
+
+    def spans(self, name = None):
+        """ Finished top level spans, oldest first
+
+        Params:
+            name (str): Only spans with this name
+
+        Returns:
+            - List of dicts with each span's name, duration, requests & child spans. Request times are in ms from the start of the span
+        """
+
+        with self.lock:
+            return [span.as_dict() for span in self.finished if name is None or span.name == name]
+
+    def breakdown(self, name = None):
+        """ Where the time of finished spans went, by request method & operation
+
+        Params:
+            name (str): Only spans with this name
+
+        Returns:
+            - List of dicts with each method & operation's count, total, mean & max ms, and share of the spans' total duration. Slowest first
+        """
+
+        with self.lock:
+            spans = [span for span in self.finished if name is None or span.name == name]
+
+        totals = {}
+        span_time = 0.0
+        stack = list(spans)
+        for span in spans:
+            span_time = span_time + (span.end - span.start)
+
+        while stack:
+            span = stack.pop()
+            stack.extend(span.children)
+            for r in span.requests:
+                key = f"{r['method']}:{r['operation']}" if r["operation"] else r["method"]
+                duration = r["received_at"] - r["created_at"]
+                count, total, longest = totals.get(key, (0, 0.0, 0.0))
+                totals[key] = (count + 1, total + duration, max(longest, duration))
+
+        rows = [{
+            "request": key,
+            "count": count,
+            "total_ms": round(total * 1000, 3),
+            "mean_ms": round(total * 1000 / count, 3),
+            "max_ms": round(longest * 1000, 3),
+            "share": round(total / span_time, 4) if span_time else None
+        } for key, (count, total, longest) in totals.items()]
+
+        return sorted(rows, key = lambda row: row["total_ms"], reverse = True)
+
+
+class CallSetup(object):
+    # Phase timings of one WebRtcEndpoint's session, from its pipeline's creation to its first media
+    def __init__(self, endpoint, pipeline, started_at):
+        self.endpoint = endpoint
+        self.pipeline = pipeline
+        self.started_at = started_at
+        self.phases = {} # Phase -> seconds
+        self.ice_from = None # When ICE gathering was asked for
+        self.offer_done_at = None # When the SDP answer came back
+        self.complete = False
+
+    def as_dict(self):
+        return {
+            "endpoint": self.endpoint,
+            "pipeline": self.pipeline,
+            "started_at": self.started_at,
+            "complete": self.complete,
+            "phases": {phase: round(seconds * 1000, 3) for phase, seconds in self.phases.items()}
+        }
+
+
+class CallSetupTimer(Tracer):
+    """ Times the phases of every WebRTC session set up through the clients it's added to, to tell whether slow joins come from signalling, ICE or media. A session is a WebRtcEndpoint, from its pipeline's creation until its first media comes in
+
+    Phases, in seconds:
+        * pipeline_create, endpoint_create, process_offer - How long those requests took. pipeline_create is missing when the pipeline was created by someone else
+        * connect - Total time of the connect calls to & from the endpoint
+        * first_ice_candidate, ice_gathering_done - From gather_candidates() to the first OnIceCandidate & to OnIceGatheringDone
+        * first_media_flow_in - From the SDP answer to the first MediaFlowIn with media flowing
+        * total - From the start of the session to its first media
+
+    Event phases are only timed for events the client is subscribed to, e.g. rtc.add_event_listener("MediaFlowIn", ...) or rtc.watch(). Sessions set up inside a transaction aren't timed
+
+    Example:
+        timer = CallSetupTimer()
+        client = KurentoClient(url, tracers = [timer])
+        ...
+        timer.sessions() # Per-session records
+        timer.histograms() # Percentiles per phase
+        prometheus_text(timer.samples())
+    """
+
+    PHASES = ("pipeline_create", "endpoint_create", "connect", "process_offer", "first_ice_candidate", "ice_gathering_done", "first_media_flow_in", "total")
+
+    # Event type -> phase it ends. KMS 6.15 renamed some events; both names are accepted
+    EVENT_PHASES = {
+        "OnIceCandidate": "first_ice_candidate",
+        "IceCandidateFound": "first_ice_candidate",
+        "OnIceGatheringDone": "ice_gathering_done",
+        "IceGatheringDone": "ice_gathering_done",
+        "MediaFlowIn": "first_media_flow_in",
+        "MediaFlowInStateChange": "first_media_flow_in",
+        "MediaFlowInStateChanged": "first_media_flow_in"
+    }
+
+    def __init__(self, max_sessions = 1000, max_setup = 60.0):
+        """ Params:
+            max_sessions (int): Finished sessions kept. The oldest are dropped
+            max_setup (float): Seconds after which a session still without media is finished incomplete
+        """
+
+        self.max_setup = max_setup
+        self.lock = threading.Lock()
+        self.pipelines = {} # Pipeline id -> (created at, replied at), while it may still get endpoints
+        self.open = {} # Endpoint id -> CallSetup
+        self.finished = deque(maxlen = max_sessions)
+        self.histograms_by_phase = {phase: LatencyHistogram() for phase in self.PHASES}
+
+    def __finish(self, setup, complete):
+        # Caller holds the lock
+        self.open.pop(setup.endpoint, None)
+        setup.complete = complete
+        for phase, seconds in setup.phases.items():
+            self.histograms_by_phase[phase].observe(seconds)
+        self.finished.append(setup)
+
+    def __sweep(self, now):
+        # Finish sessions that never got media & forget pipelines too old to start one. Caller holds the lock
+        for setup in [setup for setup in self.open.values() if now - setup.started_at > self.max_setup]:
+            self.__finish(setup, False)
+        for pipeline in [pipeline for pipeline, (created_at, _) in self.pipelines.items() if now - created_at > self.max_setup]:
+            del self.pipelines[pipeline]
+
+    def on_response_received(self, request):
+        if not request["success"]:
+            return
+
+        method, operation, obj, params = request["method"], request["operation"], request["object"], request["params"]
+        took = request["received_at"] - request["created_at"]
+
+        with self.lock:
+            if(method == "create"):
+                if(params.get("type") == "MediaPipeline"):
+                    self.__sweep(request["received_at"])
+                    self.pipelines[obj] = (request["created_at"], request["received_at"])
+                elif(params.get("type") == "WebRtcEndpoint"):
+                    pipeline = params.get("constructorParams", {}).get("mediaPipeline")
+                    created = self.pipelines.get(pipeline)
+                    setup = CallSetup(obj, pipeline, created[0] if created else request["created_at"])
+                    if created:
+                        setup.phases["pipeline_create"] = created[1] - created[0]
+                    setup.phases["endpoint_create"] = took
+                    self.open[obj] = setup
+
+            elif(method == "invoke"):
+                if(operation == "connect"):
+                    for elem in {obj, params.get("operationParams", {}).get("sink")}: # Once if it connects to itself
+                        setup = self.open.get(elem)
+                        if setup is not None:
+                            setup.phases["connect"] = setup.phases.get("connect", 0.0) + took
+                    return
+
+                setup = self.open.get(obj)
+                if setup is None:
+                    return
+                if(operation == "processOffer"):
+                    setup.phases["process_offer"] = took
+                    setup.offer_done_at = request["received_at"]
+                elif(operation == "gatherCandidates"):
+                    setup.ice_from = request["created_at"]
+
+            elif(method == "release"):
+                self.pipelines.pop(obj, None)
+                for setup in [setup for setup in self.open.values() if obj in (setup.endpoint, setup.pipeline)]:
+                    self.__finish(setup, False)
+
+    def on_event_received(self, event):
+        phase = self.EVENT_PHASES.get(event["type"])
+        if phase is None:
+            return
+
+        with self.lock:
+            setup = self.open.get(event["object"])
+            if(setup is None or phase in setup.phases):
+                return
+
+            at = event["received_at"]
+            if(phase == "first_media_flow_in"):
+                if(event["payload"].get("state", "FLOWING") != "FLOWING"):
+                    return
+                setup.phases[phase] = at - (setup.offer_done_at or setup.started_at)
+                setup.phases["total"] = at - setup.started_at
+                self.__finish(setup, True)
+            else:
+                since = setup.ice_from or setup.offer_done_at
+                if since is not None:
+                    setup.phases[phase] = at - since
+
+    def sessions(self, include_open = False):
+        """ Per-session records, oldest first
+
+        Params:
+            include_open (bool): Include sessions still waiting for media
+
+        Returns:
+            - List of dicts with each session's endpoint, pipeline, started_at (time.monotonic()), whether it got as far as media, and its phases in ms
+        """
+
+        with self.lock:
+            setups = list(self.finished) + (list(self.open.values()) if include_open else [])
+            return [setup.as_dict() for setup in setups]
+
+    def histograms(self):
+        """ The distribution of each phase over finished sessions
+
+        Returns:
+            - Dict of phase -> dict with count, mean_ms & p50_ms, p90_ms, p99_ms estimated from its histogram
+        """
+
+        ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+        with self.lock:
+            return {phase: {
+                "count": histogram.count,
+                "mean_ms": ms(histogram.sum / histogram.count) if histogram.count else None,
+                "p50_ms": ms(histogram.quantile(0.5)),
+                "p90_ms": ms(histogram.quantile(0.9)),
+                "p99_ms": ms(histogram.quantile(0.99))
+            } for phase, histogram in self.histograms_by_phase.items()}
+
+    def samples(self, labels = None):
+        """ The phase histograms as Prometheus samples, for metrics.prometheus_text()
+
+        Params:
+            labels (dict): Labels added to every sample
+
+        Returns:
+            - List of (metric name, type, help, labels, value) tuples
+        """
+
+        name = "pyforkurento_call_setup_phase_seconds"
+        help_text = "Time taken by each phase of WebRTC session setup"
+        out = []
+        with self.lock:
+            for phase, histogram in self.histograms_by_phase.items():
+                base = dict(labels or {}, phase = phase)
+                for bound, total in histogram.cumulative():
+                    out.append((name, "histogram", help_text, dict(base, le = "+Inf" if bound == float("inf") else repr(bound)), total))
+                out.append((name, "histogram", help_text, dict(base, suffix = "_sum"), histogram.sum))
+                out.append((name, "histogram", help_text, dict(base, suffix = "_count"), histogram.count))
+
+        return out
+
+
+class OpenTelemetryTracer(Tracer):
+    """ Turns requests into OpenTelemetry client spans, children of whatever span was current where the request was made. Events become zero length consumer spans
+
+    Needs the opentelemetry-api package
+    """
+
+    def __init__(self, tracer_provider = None):
+        """ Params:
+            tracer_provider (TracerProvider): Defaults to the global one
+        """
+
+        if otel_trace is None:
+            raise KurentoOperationException("OpenTelemetryTracer needs the opentelemetry-api package. Try: pip install opentelemetry-api")
+
+        self.tracer = otel_trace.get_tracer("pyforkurento", tracer_provider = tracer_provider)
+        self.epoch_offset = time.time_ns() - time.monotonic_ns() # Records carry monotonic times. OpenTelemetry wants epoch ns
+        self.spans = {} # JSON-RPC id -> span waiting for its reply
+
+    def __ns(self, monotonic):
+        return int(monotonic * 1e9) + self.epoch_offset
+
+    def on_request_sent(self, request):
+        context = request["context"]
+        parent = context.run(otel_context.get_current) if context is not None else None
+
+        name = f"kms.{request['method']}" + (f" {request['operation']}" if request["operation"] else "")
+        span = self.tracer.start_span(name, context = parent, kind = otel_trace.SpanKind.CLIENT, start_time = self.__ns(request["created_at"]))
+        span.set_attribute("rpc.system", "jsonrpc")
+        span.set_attribute("rpc.method", request["method"])
+        span.set_attribute("rpc.jsonrpc.request_id", str(request["id"]))
+        for key in ("operation", "object", "session"):
+            if request[key] is not None:
+                span.set_attribute(f"kurento.{key}", str(request[key]))
+
+        self.spans[request["id"]] = span
+
+    def on_response_received(self, request):
+        span = self.spans.pop(request["id"], None)
+        if span is None:
+            return
+
+        if not request["success"]:
+            span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, request["error"]))
+
+        span.end(end_time = self.__ns(request["received_at"]))
+
+    def on_event_received(self, event):
+        at = self.__ns(event["received_at"])
+        span = self.tracer.start_span(f"kms.event {event['type']}", kind = otel_trace.SpanKind.CONSUMER, start_time = at)
+        span.set_attribute("kurento.object", str(event["object"]))
+        span.end(end_time = at)
@@ -0,0 +1,171 @@
+# Batch KMS operations into a single "transaction" request
+import copy
+
+from concurrent.futures import Future
+
+from .media_element import MediaElement
+from .parse_payloads import rpc_payload
+from .parse_payloads import Response
+
+from .exceptions import KurentoOperationException
+
+
+class TransactionClient(object):
+    """ Stands in for the client while a transaction is open. Operations are recorded instead of sent, then committed in one request
+
+    Elements created in the transaction get placeholder ids ('newref:<operation id>') that KMS resolves when the transaction executes
+    """
+
+    registry = None # Elements are registered with the client's once committed
+
+    def __init__(self, client, session_id):
+        self.client = client
+        self.session_id = session_id
+
+        self.operations = [] # JSON-RPC requests, in order
+        self.futures = [] # One per operation. Completed on commit
+        self.created = {} # Placeholder id -> element object created in the transaction
+        self.enlisted = [] # Existing elements whose calls are recorded, with their client
+        self.listeners = [] # Event listeners to add once real ids are known
+
+    def __record(self, method, params):
+        op_id = len(self.operations)
+
+        # Copied, as callers may reuse & mutate the params dict
+        self.operations.append({"jsonrpc": "2.0", "id": op_id, "method": method, "params": copy.deepcopy(params)})
+        self.futures.append(Future())
+
+        return op_id
+
+    def _create(self, params):
+        op_id = self.__record("create", params)
+        return {"payload": {"value": f"newref:{op_id}", "sessionId": self.session_id}}
+
+    def _invoke(self, params):
+        return self.futures[self.__record("invoke", params)]
+
+    def _subscribe(self, params):
+        return self.futures[self.__record("subscribe", params)]
+
+    def _unsubscribe(self, params):
+        return self.futures[self.__record("unsubscribe", params)]
+
+    def _release(self, params):
+        return self.futures[self.__record("release", params)]
+
+    def _request_nowait(self, method, params):
+        # Backs the *_nowait() methods. Creates are done straight away with their placeholder, the rest on commit
+        if(method == "create"):
+            fut = Future()
+            fut.set_result(self._create(params))
+            return fut
+
+        return self.futures[self.__record(method, params)]
+
+    def _chain(self, fut, func):
+        return self.client._chain(fut, lambda resp: self.__track(func(resp)))
+
+    def __track(self, result):
+        # Elements created in the transaction get their real ids on commit
+        if isinstance(result, MediaElement):
+            self.created[result.elem_id] = result
+
+        return result
+
+    def _on_event(self, what_event, callback, subscriber = None, buffer = None):
+        self.listeners.append((what_event, callback, subscriber, buffer))
+
+    def _off_event(self, what_event, callback, subscriber = None):
+        self.listeners = [listener for listener in self.listeners if listener[:3] != (what_event, callback, subscriber)]
+
+    def _get(self, params, ttl = None):
+        raise KurentoOperationException("Reading media object properties can't be part of a transaction")
+
+    def _then(self, resp, func):
+        # Results of recorded operations are futures. Create results are placeholders, usable straight away
+        if isinstance(resp, Future):
+            return self.client._chain(resp, func)
+
+        return self.__track(func(resp))
+
+    def enlist(self, *elements):
+        """ Record calls made on elements created outside the transaction, e.g. to connect them to new ones
+        """
+
+        for elem in elements:
+            self.enlisted.append((elem, elem.pipeline))
+            elem.pipeline = self
+
+    def discard(self):
+        """ Drop the recorded operations without sending them
+        """
+
+        for elem, client in self.enlisted:
+            elem.pipeline = client
+
+        self.enlisted = []
+        self.operations = []
+        self.futures = []
+
+    def commit(self):
+        """ Send the recorded operations to KMS in one request
+
+        Returns:
+            - Results of the operations, in order. An awaitable when using AsyncKurentoClient
+        """
+
+        for elem, client in self.enlisted:
+            elem.pipeline = client
+
+        req_id = self.client.next_request_id()
+        params = {"operations": self.operations, "sessionId": self.session_id}
+        load = rpc_payload("transaction", req_id, params, self.client.codec)
+
+        return self.client._then(self.client.request(load, req_id, method = "transaction", params = params), self.__resolve)
+
+    def __resolve(self, resp):
+        resp = self.client._check_response(resp)
+        responses = resp["payload"]["value"]
+
+        refs = {} # Placeholder id -> real id
+        results = []
+        first_error = None
+        for op, fut, op_resp in zip(self.operations, self.futures, responses):
+            # Like the replies parse_reply() builds
+            if("error" in op_resp):
+                transaction = Response(op["id"], False, op_resp["error"])
+            else:
+                transaction = Response(op["id"], True, op_resp.get("result", op_resp))
+
+            try:
+                result = self.client._check_response(transaction)
+            except KurentoOperationException as e:
+                fut.set_exception(e)
+                first_error = first_error or e
+                results.append(None)
+                continue
+
+            op_params = op["params"]
+            if(op["method"] == "create"):
+                refs[f"newref:{op['id']}"] = result["payload"]["value"]
+                pipeline = op_params.get("constructorParams", {}).get("mediaPipeline")
+                self.client.registry.register(result["payload"]["value"], op_params["type"], refs.get(pipeline, pipeline), self.session_id)
+            elif(op_params.get("operation") == "connect"):
+                source, sink = op_params["object"], op_params["operationParams"]["sink"]
+                self.client.registry.connected(refs.get(source, source), refs.get(sink, sink))
+
+            fut.set_result(result)
+            results.append(result)
+
+        # Hand the elements over to the real client
+        for ref, elem in self.created.items():
+            elem.elem_id = refs.get(ref, elem.elem_id)
+            elem.pipeline = self.client
+
+        for what_event, callback, subscriber, buffer in self.listeners:
+            self.client._on_event(what_event, callback, refs.get(subscriber, subscriber), buffer)
+
+        if first_error is not None:
+            raise first_error
+
+        return results
@@ -1,11 +1,11 @@
 import json
 from channels.generic.websocket import WebsocketConsumer
-from pyforkurento import client
+from pyforkurento.pool import KurentoConnectionPool
 
 class LoopbackConsumer(WebsocketConsumer):
 	def connect(self):
 		self.accept()
-		self.cli = client.KurentoClient("ws://localhost:8888/kurento")
+		self.cli = KurentoConnectionPool.shared("ws://localhost:8888/kurento").client() # Shares a few websockets with every other consumer
 		try:
 			print(self.cli.ping()) # Test connection with KMS
 			self.send(text_data=json.dumps({
@@ -57,6 +57,8 @@ class LoopbackConsumer(WebsocketConsumer):
 	def disconnect(self, close_code):
 		""" Runs when the JS client disconnects
 		"""
-		self.cli.__del__()
+		if hasattr(self, "pipeline"):
+			self.pipeline.dispose()
+		self.cli.close_connection() # Back to the pool. The websocket stays open for other consumers
 		self.close()
 	
\ No newline at end of file
@@ -0,0 +1,26 @@
+# Fixtures driving clients against an in-process FakeKurentoServer
+import pytest
+
+from pyforkurento import KurentoClient
+from pyforkurento.fake_kms import FakeKurentoServer
+
+
+@pytest.fixture
+def kms():
+    server = FakeKurentoServer()
+    yield server
+    server.close()
+
+@pytest.fixture
+def client(kms):
+    cli = KurentoClient(kms.url, heartbeat_interval = None, request_timeout = 5)
+    yield cli
+    cli.__del__()
+
+@pytest.fixture
+def pipeline(client):
+    return client.create_media_pipeline()
+
+def invoked(kms, operation):
+    # Invokes of an operation the fake server received
+    return [r for r in list(kms.requests) if r["method"] == "invoke" and r["params"].get("operation") == operation]
@@ -0,0 +1,80 @@
+# AsyncKurentoClient: requests awaited from coroutines
+import asyncio
+
+import pytest
+
+from pyforkurento import AsyncKurentoClient
+from pyforkurento import KurentoTimeoutException
+
+
+def test_requests_are_awaitable(kms):
+    async def session():
+        cli = await AsyncKurentoClient.connect(kms.url, heartbeat_interval = None)
+        try:
+            rtc = await (await cli.create_media_pipeline()).add_endpoint("WebRtcEndpoint")
+            answers = await asyncio.gather(*[rtc.process_offer("v=0") for _ in range(20)])
+            assert answers == ["v=0 fake-sdp-answer"] * 20
+        finally:
+            await cli.close()
+
+    asyncio.run(session())
+
+def test_cancelled_callers_dont_break_the_listener(kms, caplog):
+    async def session():
+        cli = await AsyncKurentoClient.connect(kms.url, heartbeat_interval = None)
+        try:
+            rtc = await (await cli.create_media_pipeline()).add_endpoint("WebRtcEndpoint")
+            kms.latency = 0.2
+            calls = [asyncio.ensure_future(rtc.process_offer("v=0")) for _ in range(5)]
+            await asyncio.sleep(0.05)
+            for call in calls:
+                call.cancel()
+            await asyncio.gather(*calls, return_exceptions = True)
+            assert cli.pending == {}
+            assert cli.metrics_snapshot()["requests"]["invoke:processOffer"]["cancelled"] == 5
+
+            await asyncio.sleep(0.3) # The replies arrive after their callers gave up
+            kms.latency = 0.0
+            assert caplog.records == []
+            assert await rtc.process_offer("v=0") == "v=0 fake-sdp-answer"
+        finally:
+            await cli.close()
+
+    asyncio.run(session())
+
+def test_gather_awaits_nowait_requests(kms):
+    async def session():
+        cli = await AsyncKurentoClient.connect(kms.url, heartbeat_interval = None)
+        try:
+            pipeline = await cli.create_media_pipeline()
+            endpoints = await cli.gather([pipeline.add_endpoint_nowait("WebRtcEndpoint") for _ in range(5)])
+            assert len({rtc.elem_id for rtc in endpoints}) == 5
+        finally:
+            await cli.close()
+
+    asyncio.run(session())
+
+def test_gather_times_out_without_blocking_the_loop(kms):
+    async def session():
+        cli = await AsyncKurentoClient.connect(kms.url, heartbeat_interval = None)
+        try:
+            pipeline = await cli.create_media_pipeline()
+            kms.silent.add("create")
+            ticks = []
+
+            async def tick():
+                while True:
+                    ticks.append(None)
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.ensure_future(tick())
+            with pytest.raises(KurentoTimeoutException):
+                await cli.gather([pipeline.add_endpoint_nowait("WebRtcEndpoint") for _ in range(3)], timeout = 0.2)
+            ticker.cancel()
+
+            assert len(ticks) > 5
+            assert cli.pending == {}
+        finally:
+            await cli.close()
+
+    asyncio.run(session())
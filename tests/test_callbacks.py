@@ -0,0 +1,136 @@
+# Callback pools: in order per key, concurrent across keys
+import asyncio
+import random
+import threading
+import time
+
+from pyforkurento.callbacks import AsyncioCallbackPool
+from pyforkurento.callbacks import CallbackPool
+
+KEYS = ("a", "b", "c")
+PER_KEY = 30
+
+
+class Tracker(object):
+    # Records the order callbacks ran in per key, & whether two of one key ever overlapped
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ran = {key: [] for key in KEYS}
+        self.running = set()
+        self.overlaps = 0
+
+    def enter(self, key):
+        with self.lock:
+            if key in self.running:
+                self.overlaps = self.overlaps + 1
+            self.running.add(key)
+
+    def leave(self, key, n):
+        with self.lock:
+            self.running.discard(key)
+            self.ran[key].append(n)
+
+
+def test_thread_pool_keeps_order_per_key():
+    pool = CallbackPool(workers = 4)
+    tracker = Tracker()
+
+    def callback(key, n):
+        tracker.enter(key)
+        time.sleep(random.uniform(0, 0.003))
+        tracker.leave(key, n)
+
+    try:
+        for n in range(PER_KEY):
+            for key in KEYS:
+                pool.submit(key, callback, key, n)
+
+        assert pool.wait_idle(10)
+        assert tracker.ran == {key: list(range(PER_KEY)) for key in KEYS}
+        assert tracker.overlaps == 0
+        assert pool.stats()["completed"] == PER_KEY * len(KEYS)
+    finally:
+        pool.shutdown()
+
+def test_thread_pool_runs_other_keys_meanwhile():
+    pool = CallbackPool(workers = 2)
+    other_ran = threading.Event()
+    waited = []
+
+    try:
+        # Only returns once a callback of another key ran, which it can't if keys run one at a time
+        pool.submit("slow", lambda: waited.append(other_ran.wait(5)))
+        pool.submit("slow", lambda: waited.append("after"))
+        pool.submit("fast", other_ran.set)
+
+        assert pool.wait_idle(10)
+        assert waited == [True, "after"]
+    finally:
+        pool.shutdown()
+
+def test_thread_pool_carries_on_after_a_failure():
+    pool = CallbackPool(workers = 2)
+    ran = []
+
+    def fail():
+        raise ValueError("callback bug")
+
+    try:
+        pool.submit("a", fail)
+        pool.submit("a", ran.append, 1)
+        assert pool.wait_idle(10)
+        assert ran == [1]
+        assert pool.stats()["failed"] == 1
+    finally:
+        pool.shutdown()
+
+def test_asyncio_pool_keeps_order_per_key_and_runs_keys_concurrently():
+    async def session():
+        pool = AsyncioCallbackPool(asyncio.get_running_loop())
+        tracker = Tracker()
+        other_ran = asyncio.Event()
+
+        async def callback(key, n):
+            tracker.enter(key)
+            if(key == "a" and n == 0):
+                await asyncio.wait_for(other_ran.wait(), 5) # Needs a callback of another key to run meanwhile
+            await asyncio.sleep(random.uniform(0, 0.003))
+            if(key != "a"):
+                other_ran.set()
+            tracker.leave(key, n)
+
+        # Submitted from another thread, as the dispatcher does
+        submitter = threading.Thread(target = lambda: [pool.submit(key, callback, key, n) for n in range(PER_KEY) for key in KEYS])
+        submitter.start()
+        submitter.join()
+
+        deadline = time.monotonic() + 10
+        while(pool.stats()["completed"] < PER_KEY * len(KEYS) and time.monotonic() < deadline):
+            await asyncio.sleep(0.01)
+
+        assert tracker.ran == {key: list(range(PER_KEY)) for key in KEYS}
+        assert tracker.overlaps == 0
+
+    asyncio.run(session())
+
+def test_events_of_an_element_reach_listeners_in_order(kms, client, pipeline):
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    other = pipeline.add_endpoint("WebRtcEndpoint")
+    got = {rtc.elem_id: [], other.elem_id: []}
+
+    def on_candidate(event):
+        time.sleep(random.uniform(0, 0.002))
+        got[event["subscriber"]].append(event["payload"]["candidate"])
+
+    rtc.add_event_listener("OnIceCandidate", on_candidate)
+    other.add_event_listener("OnIceCandidate", on_candidate)
+    for n in range(PER_KEY):
+        kms.emit(rtc.elem_id, "OnIceCandidate", {"candidate": n})
+        kms.emit(other.elem_id, "OnIceCandidate", {"candidate": n})
+
+    deadline = time.monotonic() + 10
+    while(sum(len(ns) for ns in got.values()) < 2 * PER_KEY and time.monotonic() < deadline):
+        time.sleep(0.01)
+    assert client.callback_pool.wait_idle(5)
+
+    assert got == {rtc.elem_id: list(range(PER_KEY)), other.elem_id: list(range(PER_KEY))}
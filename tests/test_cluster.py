@@ -0,0 +1,73 @@
+# KurentoCluster: placing pipelines across several KMS
+import pytest
+
+from pyforkurento import KurentoCluster
+from pyforkurento import KurentoTimeoutException
+from pyforkurento.fake_kms import FakeKurentoServer
+
+
+@pytest.fixture
+def servers():
+    servers = [FakeKurentoServer(), FakeKurentoServer()]
+    yield servers
+    for kms in servers:
+        kms.close()
+
+def invoked_creates(kms):
+    return [r for r in list(kms.requests) if r["method"] == "create"]
+
+def cluster_of(servers, **client_options):
+    return KurentoCluster([kms.url for kms in servers], refresh_interval = None, cpu_interval = 0, heartbeat_interval = None, **client_options)
+
+
+def test_pipelines_go_to_the_least_loaded(servers):
+    busy, idle = servers
+    busy.results["getUsedCpu"] = 90.0
+    cluster = cluster_of(servers)
+    try:
+        assert cluster.server_of(cluster.create_media_pipeline()) == idle.url
+    finally:
+        cluster.close()
+
+def test_fails_over_when_a_create_cant_be_sent(servers):
+    broken, other = servers
+    other.results["getUsedCpu"] = 90.0
+    cluster = cluster_of(servers)
+    try:
+        def send_frames(payloads, conn = None):
+            raise ConnectionResetError("Connection reset by peer")
+
+        cluster.servers[broken.url].client.send_frames = send_frames
+        assert cluster.server_of(cluster.create_media_pipeline()) == other.url
+    finally:
+        cluster.close()
+
+def test_doesnt_fail_over_once_a_create_was_sent(servers):
+    slow, other = servers
+    other.results["getUsedCpu"] = 90.0
+    cluster = cluster_of(servers, request_timeout = 0.3)
+    try:
+        slow.silent.add("create") # Runs it but never replies
+        with pytest.raises(KurentoTimeoutException):
+            cluster.create_media_pipeline()
+
+        assert len(invoked_creates(slow)) == 1
+        assert invoked_creates(other) == []
+    finally:
+        cluster.close()
+
+def test_refresh_replaces_connections_that_gave_up(servers):
+    lost, other = servers
+    cluster = cluster_of(servers, reconnect_policy = None)
+    try:
+        old = cluster.servers[lost.url].client
+        lost.drop_connections()
+        old.thread.join(2)
+        assert not old.thread.is_alive()
+
+        cluster.refresh()
+        server = cluster.servers[lost.url]
+        assert server.client is not old
+        assert server.usable()
+    finally:
+        cluster.close()
@@ -0,0 +1,22 @@
+# Serialising requests: codecs & payload templates
+import pytest
+
+from pyforkurento.codec import get_codec
+from pyforkurento.codec import AVAILABLE
+from pyforkurento.parse_payloads import PayloadTemplate
+from pyforkurento.parse_payloads import rpc_payload
+
+CODECS = [name for name, installed in AVAILABLE.items() if installed]
+
+
+@pytest.mark.parametrize("codec", CODECS)
+@pytest.mark.parametrize("value", [{"candidate": "candidate:1 1 UDP 2122252543 10.0.0.1 5000 typ host", "sdpMid": "0", "sdpMLineIndex": 0}, "sink-id", "ünïcode \"quoted\" \\ slash", None, 12.5])
+def test_template_renders_what_rpc_payload_would(codec, value):
+    codec = get_codec(codec)
+    params = {"object": "pipe/rtc", "operation": "addIceCandidate", "operationParams": {"candidate": None}, "sessionId": "s-1"}
+    template = PayloadTemplate(codec, params, "candidate")
+
+    for req_id in (1, 42, 9876543210):
+        rendered = template.render(req_id, value)
+        expected = rpc_payload("invoke", req_id, dict(params, operationParams = {"candidate": value}), codec)
+        assert codec.loads(rendered) == codec.loads(expected)
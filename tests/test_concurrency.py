@@ -0,0 +1,109 @@
+# One client & one pipeline shared by many threads
+import threading
+
+from pyforkurento import KurentoConnectionException
+
+from conftest import invoked
+
+THREADS = 16
+PER_THREAD = 40
+
+
+def test_replies_reach_their_callers(kms, client, pipeline):
+    errors = []
+
+    def work(worker):
+        for i in range(PER_THREAD):
+            try:
+                if((worker + i) % 2):
+                    elem = pipeline.add_endpoint("PlayerEndpoint", uri = f"rtsp://camera/{worker}/{i}")
+                    expected = "PlayerEndpoint"
+                else:
+                    elem = pipeline.add_endpoint("WebRtcEndpoint")
+                    expected = "WebRtcEndpoint"
+
+                if not elem.elem_id.endswith(expected):
+                    errors.append(f"Asked for a {expected}, got {elem.elem_id}")
+            except Exception as e:
+                errors.append(repr(e))
+
+    workers = [threading.Thread(target = work, args = (worker,)) for worker in range(THREADS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    assert client.pending == {}
+
+def test_constructor_params_dont_leak(kms, client, pipeline):
+    def work(worker):
+        for i in range(PER_THREAD):
+            if((worker + i) % 2):
+                pipeline.add_endpoint("PlayerEndpoint", uri = f"rtsp://camera/{worker}/{i}", buffer_size = worker)
+            else:
+                pipeline.add_endpoint("WebRtcEndpoint", webrtc_recv_only = bool(worker % 3))
+
+    workers = [threading.Thread(target = work, args = (worker,)) for worker in range(THREADS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    creates = [r["params"] for r in list(kms.requests) if r["method"] == "create" and r["params"]["type"] != "MediaPipeline"]
+    assert len(creates) == THREADS * PER_THREAD
+
+    for params in creates:
+        constructor = params["constructorParams"]
+        assert constructor["mediaPipeline"] == pipeline.pipeline_id
+        if(params["type"] == "WebRtcEndpoint"):
+            assert set(constructor) == {"mediaPipeline", "recvonly", "sendonly"}
+        else:
+            assert set(constructor) == {"mediaPipeline", "uri", "networkCache"}
+            worker = int(constructor["uri"].split("/")[-2])
+            assert constructor["networkCache"] == worker
+
+def test_invokes_from_many_threads_get_their_own_results(kms, client, pipeline):
+    kms.results["getName"] = lambda params: params["object"]
+    elements = [pipeline.add_endpoint("WebRtcEndpoint") for _ in range(THREADS)]
+    mismatched = []
+
+    def work(elem):
+        params = {"object": elem.elem_id, "operation": "getName", "sessionId": elem.session_id}
+        for _ in range(PER_THREAD):
+            resp = client._invoke(params)
+            if(resp["payload"]["value"] != elem.elem_id):
+                mismatched.append(resp)
+
+    workers = [threading.Thread(target = work, args = (elem,)) for elem in elements]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert mismatched == []
+    assert len(invoked(kms, "getName")) == THREADS * PER_THREAD
+
+def test_failing_pending_requests_races_other_poppers(client):
+    errors = []
+
+    def popper(pop):
+        try:
+            pop()
+        except Exception as e:
+            errors.append(e)
+
+    fail = lambda: client.fail_pending_requests(KurentoConnectionException("Connection to KMS was lost"))
+    time_out = lambda: [client.request_timed_out(req_id) for req_id in range(2000)]
+    for _ in range(20):
+        for req_id in range(2000):
+            client.register_request(req_id)
+
+        threads = [threading.Thread(target = popper, args = (pop,)) for pop in (fail, fail, fail, time_out)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert client.pending == {}
@@ -0,0 +1,149 @@
+# EventBuffer policies for listeners that can't keep up
+import threading
+import time
+
+import pytest
+
+from pyforkurento import EventBuffer
+from pyforkurento import KurentoClient
+from pyforkurento import KurentoOperationException
+
+
+class HeldPool(object):
+    # Callback pool that runs nothing until told to, as a busy callback would
+    def __init__(self):
+        self.queued = []
+
+    def submit(self, key, func):
+        self.queued.append(func)
+
+    def run(self):
+        while self.queued:
+            self.queued.pop(0)()
+
+
+def event(subscriber, n):
+    return {"subscriber": subscriber, "n": n}
+
+def attached(buffer, pool, got):
+    buffer.attach(got.append, pool, "key")
+    return buffer
+
+
+def test_drop_oldest_keeps_the_latest():
+    pool, got = HeldPool(), []
+    buffer = attached(EventBuffer(3, "drop_oldest"), pool, got)
+    for n in range(10):
+        buffer.offer(event("a", n))
+
+    pool.run()
+    assert [e["n"] for e in got] == [7, 8, 9]
+    assert buffer.stats()["dropped"] == 7
+
+def test_coalesce_keeps_the_latest_per_key_in_place():
+    pool, got = HeldPool(), []
+    buffer = attached(EventBuffer(10, "coalesce"), pool, got)
+    for n, subscriber in enumerate(["a", "b", "a", "c", "a", "b"]):
+        buffer.offer(event(subscriber, n))
+
+    pool.run()
+    assert [(e["subscriber"], e["n"]) for e in got] == [("a", 4), ("b", 5), ("c", 3)]
+    assert buffer.stats()["coalesced"] == 3
+
+def test_coalesce_drops_the_oldest_when_full():
+    pool, got = HeldPool(), []
+    buffer = attached(EventBuffer(2, "coalesce"), pool, got)
+    for n, subscriber in enumerate(["a", "b", "c"]):
+        buffer.offer(event(subscriber, n))
+
+    pool.run()
+    assert [e["subscriber"] for e in got] == ["b", "c"]
+
+def test_block_waits_for_room():
+    pool, got = HeldPool(), []
+    buffer = attached(EventBuffer(2, "block"), pool, got)
+    buffer.offer(event("a", 0))
+    buffer.offer(event("a", 1))
+
+    offered = threading.Event()
+    dispatcher = threading.Thread(target = lambda: (buffer.offer(event("a", 2)), offered.set()))
+    dispatcher.start()
+    assert not offered.wait(0.2) # Full, so the dispatcher waits
+
+    pool.queued.pop(0)() # The callback takes one
+    assert offered.wait(1)
+    dispatcher.join()
+
+    pool.run()
+    assert [e["n"] for e in got] == [0, 1, 2]
+    assert buffer.stats()["blocked"] == 1
+    assert buffer.stats()["dropped"] == 0
+
+def test_close_releases_a_blocked_dispatcher():
+    pool, got = HeldPool(), []
+    buffer = attached(EventBuffer(1, "block"), pool, got)
+    buffer.offer(event("a", 0))
+
+    dispatcher = threading.Thread(target = buffer.offer, args = (event("a", 1),))
+    dispatcher.start()
+    buffer.close()
+    dispatcher.join(1)
+    assert not dispatcher.is_alive()
+
+def test_bad_settings_are_refused():
+    with pytest.raises(KurentoOperationException):
+        EventBuffer(1, "sometimes")
+    with pytest.raises(KurentoOperationException):
+        EventBuffer(0)
+
+def test_buffers_feed_listeners_through_the_client(kms, client, pipeline):
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    release = threading.Event()
+    got = []
+
+    def slow(e):
+        release.wait(2)
+        got.append(e["payload"]["n"])
+
+    buffer = EventBuffer(2, "drop_oldest")
+    rtc.add_event_listener("OnIceCandidate", slow, buffer = buffer)
+    for n in range(20):
+        kms.emit(rtc.elem_id, "OnIceCandidate", {"n": n})
+
+    give_up = threading.Event()
+    while buffer.stats()["dropped"] + buffer.stats()["pending"] + 1 < 20 and not give_up.wait(0.01):
+        pass
+    release.set()
+
+    while len(got) < 3 and not give_up.wait(0.01):
+        pass
+    assert got[-2:] == [18, 19]
+
+def test_block_pushes_back_on_the_socket(kms, monkeypatch):
+    monkeypatch.setattr(KurentoClient, "MAX_QUEUED_EVENTS", 8)
+    cli = KurentoClient(kms.url, heartbeat_interval = None)
+    try:
+        rtc = cli.create_media_pipeline().add_endpoint("WebRtcEndpoint")
+        release = threading.Event()
+        got = []
+
+        def slow(e):
+            release.wait(5)
+            got.append(e["payload"]["n"])
+
+        rtc.add_event_listener("OnIceCandidate", slow, buffer = EventBuffer(2, "block"))
+        for n in range(200):
+            kms.emit(rtc.elem_id, "OnIceCandidate", {"n": n})
+
+        give_up = time.monotonic() + 3
+        while cli.connection_stats()["events_paused"] == 0 and time.monotonic() < give_up:
+            time.sleep(0.01)
+        assert cli.connection_stats()["events_paused"] >= 1
+        assert cli.subscriptions_queue.qsize() <= 8
+
+        release.set()
+        while len(got) < 200 and time.monotonic() < give_up + 5:
+            time.sleep(0.01)
+        assert got == list(range(200))
+    finally:
+        cli.__del__()
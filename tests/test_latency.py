@@ -0,0 +1,78 @@
+# Pipeline latency stats & measuring the latency each element adds
+import pytest
+
+from pyforkurento import KurentoOperationException
+
+from conftest import invoked
+
+
+def latencies(ms_by_element, e2e_ms = None, legacy = False):
+    # getStats results reporting a VIDEO input latency per element id, & an E2E latency for the given ones
+    def get_stats(params):
+        ms = ms_by_element[params["object"]]
+        if legacy:
+            stat = {"type": "endpoint", "inputVideoLatency": ms * 1e6}
+        else:
+            stat = {"type": "endpoint", "inputLatency": [{"type": "VIDEO", "avg": ms * 1e6}, {"type": "AUDIO", "avg": (ms - 1) * 1e6}]}
+        if(e2e_ms and params["object"] in e2e_ms):
+            stat["E2ELatency"] = [{"type": "VIDEO", "avg": e2e_ms[params["object"]] * 1e6}]
+        return {"element": stat, "rtp": {"type": "inboundrtp", "bytesReceived": 0}}
+
+    return get_stats
+
+
+def test_set_latency_stats_invokes_the_pipeline(kms, pipeline):
+    pipeline.set_latency_stats(True)
+    pipeline.set_latency_stats(False)
+
+    calls = invoked(kms, "setLatencyStats")
+    assert [call["params"]["object"] for call in calls] == [pipeline.pipeline_id] * 2
+    assert [call["params"]["operationParams"] for call in calls] == [{"latencyStats": True}, {"latencyStats": False}]
+    assert calls[0]["params"]["sessionId"] == pipeline.session_id
+
+def test_get_latency_stats_returns_the_value(kms, pipeline):
+    kms.results["getLatencyStats"] = True
+    assert pipeline.get_latency_stats() is True
+    assert invoked(kms, "getLatencyStats")[0]["params"]["object"] == pipeline.pipeline_id
+
+def test_measure_latency_attributes_delay_to_elements(kms, pipeline):
+    player, rtp, rtc = pipeline.add_endpoint("PlayerEndpoint", uri = "file:///tmp/in.webm"), pipeline.add_endpoint("RtpEndpoint"), pipeline.add_endpoint("WebRtcEndpoint")
+    kms.results["getLatencyStats"] = False
+    kms.results["getStats"] = latencies({player.elem_id: 5, rtp.elem_id: 12, rtc.elem_id: 40}, e2e_ms = {rtc.elem_id: 55})
+
+    report = pipeline.measure_latency(player, rtp, rtc, samples = 3, interval = 0.01)
+
+    # Turned on for the measurement, then back off
+    assert [call["params"]["operationParams"]["latencyStats"] for call in invoked(kms, "setLatencyStats")] == [True, False]
+    stats_calls = [call["params"]["object"] for call in invoked(kms, "getStats")]
+    assert sorted(stats_calls) == sorted([player.elem_id, rtp.elem_id, rtc.elem_id] * 3)
+
+    assert [row["element"] for row in report] == [player.elem_id, rtp.elem_id, rtc.elem_id]
+    assert [row["type"] for row in report] == ["PlayerEndpoint", "RTPEndpoint", "WebRTCEndpoint"]
+    assert report[0]["input_ms"] == pytest.approx({"VIDEO": 5, "AUDIO": 4})
+    assert report[2]["e2e_ms"] == pytest.approx({"VIDEO": 55})
+    assert report[0]["e2e_ms"] == {}
+    assert [row["processing_ms"] for row in report] == pytest.approx([7, 28, 15]) # The last one up to its output
+
+def test_measure_latency_leaves_stats_on_if_they_were(kms, pipeline):
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    kms.results["getLatencyStats"] = True
+    kms.results["getStats"] = latencies({rtc.elem_id: 9}, legacy = True)
+
+    report = pipeline.measure_latency(rtc, samples = 2, interval = 0.01, media_type = "VIDEO")
+
+    assert invoked(kms, "setLatencyStats") == []
+    assert report == [{"element": rtc.elem_id, "type": "WebRTCEndpoint", "input_ms": {"VIDEO": pytest.approx(9)}, "e2e_ms": {}, "processing_ms": None}]
+
+def test_measure_latency_turns_stats_back_off_after_an_error(kms, pipeline):
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    kms.results["getLatencyStats"] = False
+    del kms.objects[rtc.elem_id] # getStats fails
+
+    with pytest.raises(KurentoOperationException):
+        pipeline.measure_latency(rtc, samples = 2, interval = 0.01)
+    assert [call["params"]["operationParams"]["latencyStats"] for call in invoked(kms, "setLatencyStats")] == [True, False]
+
+def test_measure_latency_isnt_available_in_transactions(pipeline):
+    with pytest.raises(KurentoOperationException):
+        pipeline.transaction().measure_latency()
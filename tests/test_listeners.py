@@ -0,0 +1,93 @@
+# Routing events to the listeners of each element, & removing listeners
+import asyncio
+import time
+
+from pyforkurento import AsyncKurentoClient
+
+
+def wait_for(condition, timeout = 5):
+    give_up = time.monotonic() + timeout
+    while(not condition() and time.monotonic() < give_up):
+        time.sleep(0.01)
+    return condition()
+
+def emitted(kms, elem, n, what = "OnIceCandidate"):
+    return kms.emit(elem.elem_id, what, {"candidate": n})
+
+
+def test_events_reach_every_listener_of_their_element(kms, client, pipeline):
+    rtc, other = pipeline.add_endpoint("WebRtcEndpoint"), pipeline.add_endpoint("WebRtcEndpoint")
+    got = {name: [] for name in ("first", "second", "third", "other", "everything")}
+
+    for name in ("first", "second", "third"):
+        rtc.add_event_listener("OnIceCandidate", lambda event, name = name: got[name].append(event["payload"]["candidate"]))
+    other.add_event_listener("OnIceCandidate", lambda event: got["other"].append(event["payload"]["candidate"]))
+    client.on_event("OnIceCandidate", lambda event: got["everything"].append((event["subscriber"], event["payload"]["candidate"])))
+
+    for n in range(3):
+        assert emitted(kms, rtc, n)
+    assert emitted(kms, other, "x")
+
+    assert wait_for(lambda: len(got["everything"]) == 4 and all(len(got[name]) == 3 for name in ("first", "second", "third")))
+    assert got["first"] == got["second"] == got["third"] == [0, 1, 2] # Each in order
+    assert got["other"] == ["x"]
+    assert got["everything"] == [(rtc.elem_id, 0), (rtc.elem_id, 1), (rtc.elem_id, 2), (other.elem_id, "x")]
+
+def test_off_event_removes_only_that_listener(kms, client, pipeline):
+    rtc, other = pipeline.add_endpoint("WebRtcEndpoint"), pipeline.add_endpoint("WebRtcEndpoint")
+    removed, kept, shared = [], [], []
+
+    def on_removed(event):
+        removed.append(event)
+
+    def on_kept(event):
+        kept.append(event)
+
+    def on_shared(event):
+        shared.append(event)
+
+    rtc.add_event_listener("OnIceCandidate", on_removed)
+    rtc.add_event_listener("OnIceCandidate", on_kept)
+    rtc.add_event_listener("OnIceCandidate", on_shared)
+    other.add_event_listener("OnIceCandidate", on_shared) # Same callback on another element
+
+    client.off_event("OnIceCandidate", on_removed, rtc.elem_id)
+    client.off_event("OnIceCandidate", on_shared, rtc.elem_id)
+    assert [buffer.callback for buffer in client.listeners[(rtc.elem_id, "OnIceCandidate")]] == [on_kept]
+
+    emitted(kms, rtc, 1)
+    emitted(kms, other, 2)
+    assert wait_for(lambda: kept and shared)
+    assert client.callback_pool.wait_idle(5)
+    assert removed == []
+    assert [event["payload"]["candidate"] for event in kept] == [1]
+    assert [event["subscriber"] for event in shared] == [other.elem_id]
+
+def test_remove_event_listener_unsubscribes(kms, client, pipeline):
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    got = []
+    callback = got.append
+    subscription = rtc.add_event_listener("OnIceCandidate", callback)["payload"]["value"]
+
+    resp = rtc.remove_event_listener("OnIceCandidate", callback, subscription)
+
+    assert resp["resp_success"]
+    unsubscribes = [r["params"] for r in list(kms.requests) if r["method"] == "unsubscribe"]
+    assert unsubscribes == [{"object": rtc.elem_id, "subscription": subscription, "sessionId": rtc.session_id}]
+    assert (rtc.elem_id, "OnIceCandidate") not in client.listeners
+    assert not emitted(kms, rtc, 1) # KMS no longer sends it
+
+def test_remove_event_listener_is_awaitable(kms):
+    async def session():
+        cli = await AsyncKurentoClient.connect(kms.url, heartbeat_interval = None)
+        try:
+            rtc = await (await cli.create_media_pipeline()).add_endpoint("WebRtcEndpoint")
+            callback = lambda event: None
+            subscription = (await rtc.add_event_listener("OnIceCandidate", callback))["payload"]["value"]
+
+            assert (await rtc.remove_event_listener("OnIceCandidate", callback, subscription))["resp_success"]
+            assert cli.listeners == {}
+        finally:
+            await cli.close()
+
+    asyncio.run(session())
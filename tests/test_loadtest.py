@@ -0,0 +1,20 @@
+# The load test harness, run small against the fake server
+from pyforkurento.loadtest import run
+
+from conftest import invoked
+
+
+def test_run_reports_each_stage(kms):
+    stages = run(kms.url, ramp = (2, 4), callers = 8, connections = 2)
+
+    assert [stage["concurrency"] for stage in stages] == [2, 4]
+    for stage in stages:
+        assert stage["calls"] == 8
+        assert stage["errors"] == 0 and stage["error_rate"] == 0 and stage["error_types"] == {}
+        assert stage["calls_per_s"] > 0
+        assert 0 < stage["setup_p50_ms"] <= stage["setup_p90_ms"] <= stage["setup_p99_ms"] <= stage["setup_max_ms"]
+        assert stage["rss_mb"] is None or stage["rss_mb"] > 0
+        assert stage["listeners_left"] == 0 # Dropped as each call's pipeline is disposed of
+
+    assert len(invoked(kms, "processOffer")) == 16
+    assert len([r for r in list(kms.requests) if r["method"] == "release"]) == 16
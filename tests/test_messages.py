@@ -0,0 +1,85 @@
+# Replies & events read like the dicts they replace; media objects are slotted
+import time
+
+import pytest
+
+from pyforkurento import endpoints # Imported so that every element class is defined when collecting
+from pyforkurento import filters
+from pyforkurento import hubs
+from pyforkurento.events import Event
+from pyforkurento.events import EventRecord
+from pyforkurento.media_element import MediaElement
+from pyforkurento.parse_payloads import Response
+from pyforkurento.pipeline import MediaPipeline
+
+
+def subclasses(cls):
+    return [cls] + [sub for direct in cls.__subclasses__() for sub in subclasses(direct)]
+
+
+def test_response_reads_like_a_dict():
+    resp = Response(7, True, {"value": "pipe", "sessionId": "s"})
+
+    assert resp["payload"]["value"] == "pipe"
+    assert resp["resp_success"] is True
+    assert resp.get("resp_id") == 7
+    assert resp.get("result") is None and resp.get("result", "none") == "none"
+    assert "payload" in resp and "result" not in resp
+    with pytest.raises(KeyError):
+        resp["result"]
+
+    assert resp.keys() == ["resp_id", "resp_success", "payload"]
+    assert dict(resp) == {"resp_id": 7, "resp_success": True, "payload": {"value": "pipe", "sessionId": "s"}}
+    assert resp == {"resp_id": 7, "resp_success": True, "payload": {"value": "pipe", "sessionId": "s"}}
+    assert len(resp) == 3
+
+def test_replies_from_kms_are_responses(kms, client, pipeline):
+    resp = client.send_request("invoke", {"object": pipeline.pipeline_id, "operation": "getName", "sessionId": pipeline.session_id}).result(5)
+
+    assert isinstance(resp, Response)
+    assert resp["resp_success"] and resp.get("resp_success")
+    assert resp["payload"]["sessionId"] == pipeline.session_id
+    assert "payload" in resp
+
+def test_events_read_like_dicts(kms, client, pipeline):
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    got = []
+    rtc.add_event_listener("OnIceCandidate", got.append)
+    kms.emit(rtc.elem_id, "OnIceCandidate", {"candidate": {"sdpMid": "0"}})
+
+    give_up = time.monotonic() + 5
+    while(not got and time.monotonic() < give_up):
+        time.sleep(0.01)
+
+    event = got[0]
+    assert isinstance(event, Event)
+    assert event["subscription_type"] == "OnIceCandidate"
+    assert event.get("subscriber") == rtc.elem_id
+    assert event["payload"]["candidate"] == {"sdpMid": "0"}
+    assert "payload" in event and "frame" not in event
+    assert event.get("frame") is None # Internal, not a key
+    with pytest.raises(KeyError):
+        event["data"]
+    assert set(dict(event)) == {"method", "subscription_type", "subscriber", "payload", "received_at"}
+
+    record = EventRecord(event)
+    assert dict(record) == {"type": "OnIceCandidate", "object": rtc.elem_id, "received_at": event["received_at"], "payload": event["payload"]}
+
+@pytest.mark.parametrize("cls", subclasses(MediaElement) + subclasses(MediaPipeline) + [Response, Event, EventRecord], ids = lambda cls: cls.__name__)
+def test_every_class_in_the_chain_is_slotted(cls):
+    # One class without __slots__ anywhere in the chain gives every instance a __dict__
+    assert all("__slots__" in vars(klass) for klass in cls.__mro__[:-1])
+
+def test_media_objects_reject_stray_attributes(kms, pipeline):
+    objects = [
+        pipeline,
+        pipeline.add_endpoint("WebRtcEndpoint"),
+        pipeline.add_endpoint("PlayerEndpoint", uri = "rtsp://camera/1"),
+        pipeline.apply_filter("ZBarFilter"),
+        pipeline.add_hub("Composite")
+    ]
+
+    for obj in objects:
+        assert not hasattr(obj, "__dict__")
+        with pytest.raises(AttributeError):
+            obj.stray = 1
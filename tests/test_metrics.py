@@ -0,0 +1,123 @@
+# Request & event metrics: snapshots, histograms & the Prometheus text format
+import re
+import time
+
+import pytest
+
+from pyforkurento import KurentoClient
+from pyforkurento import KurentoOperationException
+from pyforkurento import KurentoTimeoutException
+from pyforkurento.metrics import LATENCY_BUCKETS
+from pyforkurento.metrics import LatencyHistogram
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+@pytest.fixture
+def metered(kms):
+    # A pipeline, an endpoint & a mix of requests that succeed, fail & time out
+    cli = KurentoClient(kms.url, heartbeat_interval = None, request_timeout = 0.3)
+    rtc = cli.create_media_pipeline().add_endpoint("WebRtcEndpoint")
+    for _ in range(3):
+        rtc.process_offer("v=0")
+
+    kms.silent.add("gatherCandidates")
+    with pytest.raises(KurentoTimeoutException):
+        rtc.gather_ice_candidates()
+
+    rtc.add_event_listener("OnIceCandidate", lambda e: None)
+    kms.emit(rtc.elem_id, "OnIceCandidate", {"candidate": {}}, count = 4)
+    deadline = time.monotonic() + 5
+    while(cli.metrics.events["OnIceCandidate"] < 4 and time.monotonic() < deadline):
+        time.sleep(0.01)
+
+    del kms.objects[rtc.elem_id]
+    with pytest.raises(KurentoOperationException):
+        rtc.process_offer("v=0")
+
+    yield cli
+    cli.__del__()
+
+def parse_prometheus(text):
+    # Returns {metric name: (type, help)} & a list of (sample name, labels, value). Fails on lines that aren't valid
+    headers = {}
+    samples = []
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            name, help_text = line[len("# HELP "):].split(" ", 1)
+            headers.setdefault(name, [None, None])[1] = help_text
+        elif line.startswith("# TYPE "):
+            name, kind = line[len("# TYPE "):].split(" ")
+            assert kind in ("counter", "gauge", "histogram")
+            headers.setdefault(name, [None, None])[0] = kind
+        else:
+            match = SAMPLE.match(line)
+            assert match, line
+            name, labels, value = match.groups()
+            samples.append((name, dict(LABEL.findall(labels or "")), float(value)))
+
+    return {name: tuple(header) for name, header in headers.items()}, samples
+
+
+def test_snapshot_counts_requests_by_outcome(metered):
+    requests = metered.metrics_snapshot()["requests"]
+
+    assert requests["create"]["count"] == 2
+    assert requests["invoke:processOffer"]["count"] == 4 # The failed one got a reply too
+    assert requests["invoke:processOffer"]["error"] == 1
+    assert requests["invoke:gatherCandidates"] == {"count": 0, "timeout": 1}
+    assert requests["subscribe"]["count"] == 1
+    for stats in (requests["create"], requests["invoke:processOffer"]):
+        assert 0 < stats["p50_ms"] <= stats["p90_ms"] <= stats["p99_ms"]
+
+def test_snapshot_counts_events_and_reads_gauges(metered):
+    snapshot = metered.metrics_snapshot()
+
+    assert snapshot["events"]["OnIceCandidate"]["total"] == 4
+    assert snapshot["connected"] == 1
+    assert snapshot["pending_requests"] == 0
+    assert snapshot["requests_in_flight"] == 0
+
+def test_histogram_buckets_are_cumulative():
+    histogram = LatencyHistogram()
+    for seconds in (0.0001, 0.0005, 0.003, 0.003, 0.2, 60.0):
+        histogram.observe(seconds)
+
+    buckets = dict(histogram.cumulative())
+    assert buckets[0.0005] == 2 # Bounds are inclusive
+    assert buckets[0.001] == 2
+    assert buckets[0.005] == 4
+    assert buckets[0.25] == 5
+    assert buckets[LATENCY_BUCKETS[-1]] == 5
+    assert buckets[float("inf")] == histogram.count == 6
+    assert histogram.sum == pytest.approx(60.2066)
+    assert 0.0025 <= histogram.quantile(0.5) <= 0.005
+
+def test_prometheus_text_parses(metered):
+    headers, samples = parse_prometheus(metered.metrics_prometheus({"instance": "test"}))
+
+    # Every sample belongs to a family with a TYPE & HELP header, and carries the extra label
+    for name, labels, value in samples:
+        family = re.sub(r'_(bucket|sum|count)$', "", name) if name not in headers else name
+        kind, help_text = headers[family]
+        assert kind is not None and help_text
+        assert labels["instance"] == "test"
+
+    assert headers["pyforkurento_request_duration_seconds"][0] == "histogram"
+    assert headers["pyforkurento_request_failures_total"][0] == "counter"
+    assert headers["pyforkurento_connected"][0] == "gauge"
+
+    # Bucket totals rise with le and end at +Inf, which equals _count
+    offers = {"method": "invoke", "operation": "processOffer", "instance": "test"}
+    buckets = [(labels["le"], value) for name, labels, value in samples if name == "pyforkurento_request_duration_seconds_bucket" and {k: v for k, v in labels.items() if k != "le"} == offers]
+    assert [le for le, _ in buckets] == [repr(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+    totals = [value for _, value in buckets]
+    assert totals == sorted(totals)
+    count = [value for name, labels, value in samples if name == "pyforkurento_request_duration_seconds_count" and labels == offers]
+    assert totals[-1] == count[0] == 4
+
+    failures = {(labels["operation"], labels["reason"]): value for name, labels, value in samples if name == "pyforkurento_request_failures_total"}
+    assert failures == {("processOffer", "error"): 1, ("gatherCandidates", "timeout"): 1}
+    events = [value for name, labels, value in samples if name == "pyforkurento_events_total" and labels["type"] == "OnIceCandidate"]
+    assert events == [4]
@@ -0,0 +1,63 @@
+# Reading events: envelopes & lazy decoding
+import json
+import time
+
+import pytest
+
+from pyforkurento.codec import get_codec
+from pyforkurento.events import Event
+from pyforkurento.parse_payloads import event_envelope
+
+def event_frame(obj, what, data, **dumps_options):
+    return json.dumps({"jsonrpc": "2.0", "method": "onEvent", "params": {"value": {"data": dict(data, source = obj, type = what), "object": obj, "type": what}}}, **dumps_options)
+
+
+@pytest.mark.parametrize("dumps_options", [{"separators": (",", ":")}, {}])
+def test_envelope_is_read_without_parsing(dumps_options):
+    frame = event_frame("pipe/rtc", "OnIceCandidate", {"candidate": {"sdpMid": "0"}}, **dumps_options)
+    assert event_envelope(frame) == ("OnIceCandidate", "pipe/rtc")
+
+@pytest.mark.parametrize("frame", [
+    '{"jsonrpc":"2.0","id":3,"result":{"value":"x"}}', # A reply
+    event_frame('pipe/"odd"', "OnIceCandidate", {}, separators = (",", ":")), # Escaped characters
+    b'{"jsonrpc":"2.0","method":"onEvent"}', # Bytes
+    json.dumps({"jsonrpc": "2.0", "method": "onEvent", "params": {"value": {"object": "o", "type": "T", "data": {}}}}, separators = (",", ":")) # Data last
+])
+def test_envelope_leaves_other_frames_to_the_codec(frame):
+    assert event_envelope(frame) is None
+
+def test_event_payload_is_decoded_on_first_read():
+    frame = event_frame("pipe/rtc", "MediaFlowIn", {"state": "FLOWING"}, separators = (",", ":"))
+    decoded = []
+    codec = get_codec("json")
+
+    def decode(data):
+        decoded.append(data)
+        return codec.loads(data)
+
+    event = Event("onEvent", "MediaFlowIn", "pipe/rtc", 0.0, frame = frame, decode = decode)
+    assert decoded == []
+    assert event["subscriber"] == "pipe/rtc"
+    assert decoded == []
+
+    assert event["payload"]["state"] == "FLOWING"
+    assert event.payload["state"] == "FLOWING"
+    assert len(decoded) == 1
+
+def test_unheard_events_are_not_decoded(kms, client, pipeline):
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    got = []
+    listener = got.append
+    rtc.add_event_listener("OnIceCandidate", listener)
+    client.off_event("OnIceCandidate", listener, rtc.elem_id)
+
+    skipped = client.events_skipped
+    kms.emit(rtc.elem_id, "OnIceCandidate", {"candidate": {}}, count = 5)
+    kms.emit(rtc.elem_id, "MediaFlowIn", {"state": "FLOWING"}) # Not subscribed, so never sent
+
+    give_up = time.monotonic() + 2
+    while client.events_skipped - skipped < 5 and time.monotonic() < give_up:
+        time.sleep(0.01)
+
+    assert client.events_skipped - skipped == 5
+    assert got == []
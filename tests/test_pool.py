@@ -0,0 +1,70 @@
+# Sessions sharing pooled KMS connections
+import pytest
+
+from pyforkurento.pool import KurentoConnectionPool
+
+from conftest import invoked
+
+
+@pytest.fixture
+def pool(kms):
+    pool = KurentoConnectionPool(kms.url, size = 2, heartbeat_interval = None, request_timeout = 5)
+    yield pool
+    pool.close()
+
+
+def test_sessions_work_like_clients(kms, pool):
+    session = pool.client()
+    pipeline = session.create_media_pipeline()
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    other = pipeline.add_endpoint("WebRtcEndpoint")
+
+    rtc.connect(other) # Serialised from a template & queued with send_payload()
+    rtc.add_ice_candidate({"candidate": "candidate:1", "sdpMid": "0", "sdpMLineIndex": 0})
+    assert len(invoked(kms, "connect")) == 1
+    assert len(invoked(kms, "addIceCandidate")) == 1
+
+def test_sessions_read_the_connections_state(kms, pool):
+    session = pool.client()
+    rtc = session.create_media_pipeline().add_endpoint("WebRtcEndpoint")
+    rtc.add_event_listener("OnIceCandidate", lambda e: None)
+
+    assert session.connected
+    assert [(stat["subscriber"], stat["event"]) for stat in session.event_stats()] == [(rtc.elem_id, "OnIceCandidate")]
+    assert session.metrics_gauges()["connected"][2] == 1
+    assert "pyforkurento_request_duration_seconds" in session.metrics_prometheus()
+
+def test_sessions_share_connections_up_to_the_pool_size(kms, pool):
+    sessions = [pool.client() for _ in range(5)]
+    assert len({session.connection for session in sessions}) == 2
+    assert sorted(stat["sessions"] for stat in pool.stats()) == [2, 3]
+
+    for session in sessions:
+        session.close_connection()
+    assert [stat["sessions"] for stat in pool.stats()] == [0, 0]
+
+def test_disposing_a_pipeline_drops_its_listeners(kms, pool):
+    session = pool.client()
+    pipeline = session.create_media_pipeline()
+    for _ in range(3):
+        rtc = pipeline.add_endpoint("WebRtcEndpoint")
+        rtc.add_event_listener("OnIceCandidate", lambda e: None)
+        rtc.add_event_listener("MediaFlowIn", lambda e: None)
+    assert len(session.connection.listeners) == 6
+
+    pipeline.dispose()
+    assert session.connection.listeners == {}
+
+def test_closing_a_session_drops_its_listeners(kms):
+    pool = KurentoConnectionPool(kms.url, size = 1, heartbeat_interval = None, request_timeout = 5)
+    try:
+        leaving, staying = pool.client(), pool.client()
+        staying_callback = lambda e: None
+        staying.on_event("OnIceCandidate", staying_callback)
+        leaving.on_event("OnIceCandidate", lambda e: None)
+        leaving.create_media_pipeline().add_endpoint("WebRtcEndpoint").add_event_listener("MediaFlowIn", lambda e: None)
+
+        leaving.close_connection()
+        assert [buffer.callback for buffers in staying.connection.listeners.values() for buffer in buffers] == [staying_callback]
+    finally:
+        pool.close()
@@ -0,0 +1,110 @@
+# Reconnecting after a dropped connection & resuming KMS sessions
+import time
+
+import pytest
+
+from pyforkurento import KurentoClient
+from pyforkurento import KurentoConnectionException
+from pyforkurento import RetryPolicy
+
+
+def wait_for(check, timeout = 3):
+    give_up = time.monotonic() + timeout
+    while not check():
+        if(time.monotonic() > give_up):
+            return False
+        time.sleep(0.01)
+    return True
+
+def reconnecting_client(kms, policy):
+    return KurentoClient(kms.url, heartbeat_interval = None, request_timeout = 3, reconnect_policy = RetryPolicy(retries = 5, backoff = 0.02), in_flight_policy = policy)
+
+
+def test_reconnects_and_resumes_sessions(kms):
+    cli = reconnecting_client(kms, "fail")
+    try:
+        pipeline = cli.create_media_pipeline()
+        got = []
+        rtc = pipeline.add_endpoint("WebRtcEndpoint")
+        rtc.add_event_listener("OnIceCandidate", got.append)
+
+        kms.drop_connections()
+        assert wait_for(lambda: cli.connection_stats()["reconnects"] == 1 and cli.connection_stats()["sessions_resumed"] == 1)
+
+        connects = [r for r in list(kms.requests) if r["method"] == "connect"]
+        assert connects[-1]["params"]["sessionId"] == pipeline.session_id
+
+        # Same media objects & subscriptions carry on
+        assert rtc.process_offer("v=0") == "v=0 fake-sdp-answer"
+        kms.emit(rtc.elem_id, "OnIceCandidate", {"candidate": {}})
+        assert wait_for(lambda: len(got) == 1)
+    finally:
+        cli.__del__()
+
+def test_fail_policy_fails_requests_in_flight(kms):
+    cli = reconnecting_client(kms, "fail")
+    try:
+        pipeline = cli.create_media_pipeline()
+        kms.silent.add("getName")
+        fut = cli._request_nowait("invoke", {"object": pipeline.pipeline_id, "operation": "getName", "sessionId": pipeline.session_id})
+        time.sleep(0.05)
+        kms.drop_connections()
+
+        with pytest.raises(KurentoConnectionException):
+            fut.result(3)
+    finally:
+        cli.__del__()
+
+def test_replay_policy_resends_idempotent_requests(kms):
+    cli = reconnecting_client(kms, "replay")
+    try:
+        pipeline = cli.create_media_pipeline()
+        kms.results["getName"] = "pipeline"
+        kms.silent.add("getName")
+        fut = cli._request_nowait("invoke", {"object": pipeline.pipeline_id, "operation": "getName", "sessionId": pipeline.session_id})
+        time.sleep(0.05)
+        kms.silent.discard("getName")
+        kms.drop_connections()
+
+        assert fut.result(3)["payload"]["value"] == "pipeline"
+    finally:
+        cli.__del__()
+
+def test_replay_policy_fails_written_requests_that_arent_idempotent(kms):
+    cli = reconnecting_client(kms, "replay")
+    try:
+        pipeline = cli.create_media_pipeline()
+        kms.silent.add("create")
+        fut = cli._request_nowait("create", {"type": "WebRtcEndpoint", "constructorParams": {"mediaPipeline": pipeline.pipeline_id}, "sessionId": pipeline.session_id})
+        time.sleep(0.05)
+        kms.silent.discard("create")
+        kms.drop_connections()
+
+        with pytest.raises(KurentoConnectionException):
+            fut.result(3)
+        assert len([r for r in list(kms.requests) if r["method"] == "create"]) == 2 # The pipeline & the lost endpoint, never re-sent
+        assert cli.pending == {}
+    finally:
+        cli.__del__()
+
+def test_replay_policy_sends_requests_queued_across_a_reconnect_once(kms):
+    cli = reconnecting_client(kms, "replay")
+    try:
+        for _ in range(5):
+            before = len(kms.requests)
+            kms.drop_connections()
+
+            # Keep requests coming while it reconnects, so some are still queued when the held ones are replayed
+            futures = []
+            give_up = time.monotonic() + 0.3
+            while time.monotonic() < give_up:
+                futures.append(cli.send_request("create", {"type": "MediaPipeline", "constructorParams": {}, "properties": {}}))
+                time.sleep(0.0005)
+            for fut in futures:
+                fut.exception(5) # Those written to the dead connection fail
+
+            ids = [r["id"] for r in list(kms.requests)[before:] if r["method"] == "create"]
+            assert len(ids) == len(set(ids))
+            assert {fut.req_id for fut in futures if fut.exception() is None} <= set(ids)
+    finally:
+        cli.__del__()
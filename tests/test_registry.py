@@ -0,0 +1,73 @@
+# The client's media object registry: cached reads, coalescing & invalidation
+import threading
+import time
+
+from pyforkurento import KurentoClient
+
+from conftest import invoked
+
+
+def test_reads_are_cached(kms, client, pipeline):
+    kms.results["isMediaFlowingIn"] = True
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+
+    assert rtc.is_media_flowing_in() is True
+    assert rtc.is_media_flowing_in() is True
+    assert len(invoked(kms, "isMediaFlowingIn")) == 1
+
+    rtc.is_media_flowing_in("AUDIO") # Other params, other value
+    assert len(invoked(kms, "isMediaFlowingIn")) == 2
+
+def test_identical_reads_in_flight_are_coalesced(kms, client, pipeline):
+    kms.results["isMediaFlowingOut"] = False
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    kms.latency = 0.1
+
+    got = []
+    readers = [threading.Thread(target = lambda: got.append(rtc.is_media_flowing_out())) for _ in range(20)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+
+    assert got == [False] * 20
+    assert len(invoked(kms, "isMediaFlowingOut")) == 1
+
+def test_events_invalidate_cached_values(kms, client, pipeline):
+    kms.results["isMediaFlowingIn"] = False
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    rtc.watch()
+    assert rtc.is_media_flowing_in() is False
+
+    kms.results["isMediaFlowingIn"] = True
+    kms.emit(rtc.elem_id, "MediaFlowIn", {"state": "FLOWING", "mediaType": "VIDEO"})
+    give_up = time.monotonic() + 2
+    while client.registry.stats()["invalidations"] == 0 and time.monotonic() < give_up:
+        time.sleep(0.01)
+
+    assert rtc.is_media_flowing_in() is True
+    assert len(invoked(kms, "isMediaFlowingIn")) == 2
+
+def test_values_expire(kms):
+    cli = KurentoClient(kms.url, heartbeat_interval = None, property_ttl = 0.1)
+    try:
+        rtc = cli.create_media_pipeline().add_endpoint("WebRtcEndpoint")
+        rtc.get_sink_connections()
+        rtc.get_sink_connections()
+        time.sleep(0.15)
+        rtc.get_sink_connections()
+        assert len(invoked(kms, "getSinkConnections")) == 2
+    finally:
+        cli.__del__()
+
+def test_registry_tracks_objects_and_connections(kms, client, pipeline):
+    player = pipeline.add_endpoint("PlayerEndpoint", uri = "rtsp://camera")
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    player.connect(rtc)
+
+    assert client.registry.info(player.elem_id)["sinks"] == [rtc.elem_id]
+    assert sorted(client.registry.find(pipeline = pipeline.pipeline_id)) == sorted([player.elem_id, rtc.elem_id])
+
+    pipeline.dispose()
+    assert client.registry.info(rtc.elem_id) is None
+    assert client.registry.info(pipeline.pipeline_id) is None
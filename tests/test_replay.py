@@ -0,0 +1,40 @@
+# Recording a session's frames & replaying them
+import time
+
+import pytest
+
+from pyforkurento import KurentoClient
+from pyforkurento.replay import ReplayKurentoClient
+
+
+@pytest.fixture
+def recording(kms, tmp_path):
+    path = str(tmp_path / "frames.log.gz")
+    cli = KurentoClient(kms.url, heartbeat_interval = None, recorder = path)
+    rtc = cli.create_media_pipeline().add_endpoint("WebRtcEndpoint")
+    got = []
+    rtc.add_event_listener("OnIceCandidate", got.append)
+    kms.emit(rtc.elem_id, "OnIceCandidate", {"candidate": {}}, count = 200)
+
+    give_up = time.monotonic() + 3
+    while len(got) < 200 and time.monotonic() < give_up:
+        time.sleep(0.01)
+    cli.__del__()
+    return path
+
+
+def test_replay_waits_for_the_callbacks(recording):
+    replay = ReplayKurentoClient(recording, speed = None)
+    try:
+        got = []
+
+        def slow(event):
+            time.sleep(0.001)
+            got.append(event)
+
+        replay.on_event("OnIceCandidate", slow)
+        replay.replay()
+        assert len(got) == 200
+        assert replay.metrics_snapshot()["requests"]["create"]["count"] == 2
+    finally:
+        replay.__del__()
@@ -0,0 +1,119 @@
+# StatsSampler aggregates over the StatsRing, with NumPy & with the pure Python fallback
+import math
+import time
+
+import pytest
+
+from pyforkurento import stats
+from pyforkurento.stats import StatsSampler
+
+
+@pytest.fixture(params = ["numpy", "python"])
+def backend(request, monkeypatch):
+    if(request.param == "numpy"):
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(stats, "numpy", None)
+    return request.param
+
+class Endpoint(object):
+    # Stands in for a WebRtcEndpoint where only the id is read
+    def __init__(self, elem_id, session_id = None):
+        self.elem_id = elem_id
+        self.session_id = session_id
+
+
+def row(received = math.nan, sent = math.nan, packets = math.nan, lost = math.nan, jitter = math.nan, rtt = math.nan):
+    return (received, sent, packets, lost, jitter, rtt)
+
+def write_rounds(sampler, rounds, make_rows, step = 1.0):
+    # Rounds step seconds apart, the last one now
+    start = time.monotonic() - (rounds - 1) * step
+    for i in range(rounds):
+        sampler.ring.write(start + i * step, make_rows(i))
+
+
+def test_figures_and_fleet_spread(backend):
+    sampler = StatsSampler(None, capacity = 20)
+    rates = {f"ep{n}": 1000 * (n + 1) for n in range(5)} # bits per second in, twice that out
+    write_rounds(sampler, 10, lambda i: {ep: row(rate * i / 8, rate * i / 4, 100 * i, 5 * i, jitter = 0.01 * (n + 1), rtt = 0.1 if i % 2 else 0.3) for n, (ep, rate) in enumerate(rates.items())})
+
+    endpoint = sampler.endpoint_stats(Endpoint("ep1"))
+    assert endpoint["bitrate_in_bps"] == pytest.approx(2000)
+    assert endpoint["bitrate_out_bps"] == pytest.approx(4000)
+    assert endpoint["packet_loss"] == pytest.approx(5 / 105)
+    assert endpoint["jitter"] == pytest.approx(0.02)
+    assert endpoint["rtt"] == pytest.approx(0.2)
+
+    fleet = sampler.fleet_stats(percentiles = (50, 90))
+    assert fleet["endpoints"] == 5
+    bitrate = fleet["bitrate_in_bps"]
+    assert bitrate["count"] == 5
+    assert bitrate["mean"] == pytest.approx(3000)
+    assert bitrate["max"] == pytest.approx(5000)
+    assert bitrate["p50"] == pytest.approx(3000)
+    assert bitrate["p90"] == pytest.approx(4600) # Interpolated between the 4th & 5th
+    assert fleet["jitter"]["p90"] == pytest.approx(0.046)
+
+def test_gaps_are_skipped(backend):
+    sampler = StatsSampler(None, capacity = 20)
+    # ep0 is missing from odd rounds; ep1 never reports inbound streams
+    write_rounds(sampler, 6, lambda i: dict({"ep1": row(sent = 1000 * i, jitter = 0.5)}, **({} if i % 2 else {"ep0": row(1000 * i, jitter = 0.01 * i)})))
+
+    ep0 = sampler.endpoint_stats(Endpoint("ep0"))
+    assert ep0["bitrate_in_bps"] == pytest.approx(8000) # From the first & last samples it has, rounds 0 & 4
+    assert ep0["jitter"] == pytest.approx(0.02) # Mean of 0, 0.02 & 0.04
+    assert ep0["bitrate_out_bps"] is None
+
+    ep1 = sampler.endpoint_stats(Endpoint("ep1"))
+    assert ep1["bitrate_in_bps"] is None and ep1["packet_loss"] is None
+    assert ep1["bitrate_out_bps"] == pytest.approx(8000)
+
+    assert sampler.fleet_stats()["bitrate_in_bps"]["count"] == 1
+
+def test_ring_wraps_around(backend):
+    sampler = StatsSampler(None, capacity = 4)
+    # 1000 bytes/s for six rounds, then 3000 bytes/s. Only the last four rounds are kept
+    received = lambda i: 1000 * min(i, 5) + 3000 * max(0, i - 5)
+    write_rounds(sampler, 10, lambda i: {"ep": row(received(i), jitter = float(i))})
+
+    ring = sampler.ring
+    assert ring.rounds == 10
+    assert ring.window() == [2, 3, 0, 1] # Oldest first, across the wrap
+    assert sampler.endpoint_stats(Endpoint("ep"))["bitrate_in_bps"] == pytest.approx(8 * 3000)
+    assert sampler.endpoint_stats(Endpoint("ep"))["jitter"] == pytest.approx(7.5) # Rounds 6 to 9
+    assert sampler.endpoint_stats(Endpoint("ep"), window = 1.5)["jitter"] == pytest.approx(8.5) # Rounds 8 & 9
+
+def test_removed_endpoints_free_their_row(backend):
+    sampler = StatsSampler(None, capacity = 8)
+    write_rounds(sampler, 3, lambda i: {"old": row(1000 * i), "kept": row(2000 * i)})
+    sampler.remove(Endpoint("old"))
+    assert sampler.endpoint_stats(Endpoint("old")) is None
+
+    write_rounds(sampler, 3, lambda i: {"new": row(500 * i), "kept": row(2000 * i)})
+    assert sampler.ring.slots["new"] == 0 # Reused, without old's samples
+    assert sampler.endpoint_stats(Endpoint("new"))["bitrate_in_bps"] == pytest.approx(4000)
+    assert sampler.aggregates()["endpoints"] == ["kept", "new"]
+
+def test_rows_grow_past_the_initial_room(backend):
+    sampler = StatsSampler(None, capacity = 4)
+    sampler.ring = stats.StatsRing(4, rows = 2)
+    write_rounds(sampler, 3, lambda i: {f"ep{n}": row(1000 * n * i) for n in range(5)})
+
+    assert sampler.ring.rows == 8
+    assert list(sampler.aggregates()["bitrate_in_bps"]) == pytest.approx([8000 * n for n in range(5)])
+
+def test_sample_reads_get_stats(backend, kms, client, pipeline):
+    endpoints = [pipeline.add_endpoint("WebRtcEndpoint") for _ in range(3)]
+    sampler = StatsSampler(client, capacity = 10, timeout = 5)
+    sampler.add(*endpoints)
+
+    for i in range(3):
+        kms.results["getStats"] = {"in": {"type": "inbound-rtp", "bytesReceived": 1000 * i, "packetsReceived": 10 * i, "packetsLost": i, "jitter": 0.01}, "out": {"type": "outbound-rtp", "bytesSent": 500 * i, "roundTripTime": 0.05}}
+        assert sampler.sample() == 3
+
+    fleet = sampler.fleet_stats()
+    assert fleet["rounds"] == 3 and fleet["errors"] == 0
+    assert fleet["packet_loss"]["count"] == 3
+    assert fleet["packet_loss"]["mean"] == pytest.approx(2 / 22)
+    assert fleet["rtt"]["max"] == pytest.approx(0.05)
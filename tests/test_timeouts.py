@@ -0,0 +1,106 @@
+# Request timeouts & deadlines
+import time
+
+import pytest
+
+from pyforkurento import KurentoClient
+from pyforkurento import KurentoTimeoutException
+from pyforkurento import RetryPolicy
+
+
+@pytest.fixture
+def quick(kms):
+    cli = KurentoClient(kms.url, heartbeat_interval = None, request_timeout = 0.3)
+    yield cli
+    cli.__del__()
+
+
+def test_unanswered_request_times_out(kms, quick):
+    rtc = quick.create_media_pipeline().add_endpoint("WebRtcEndpoint")
+    kms.silent.add("processOffer")
+
+    start = time.monotonic()
+    with pytest.raises(KurentoTimeoutException):
+        rtc.process_offer("v=0")
+
+    assert 0.25 < time.monotonic() - start < 2
+    assert quick.pending == {}
+
+def test_late_reply_is_dropped(kms, quick):
+    rtc = quick.create_media_pipeline().add_endpoint("WebRtcEndpoint")
+    kms.latency = 0.5
+    with pytest.raises(KurentoTimeoutException):
+        rtc.process_offer("v=0")
+
+    kms.latency = 0.0
+    time.sleep(0.5) # The late reply arrives & is dropped
+    assert rtc.process_offer("v=0") == "v=0 fake-sdp-answer"
+    assert quick.pending == {}
+
+def test_deadline_caps_a_block_of_requests(kms, quick):
+    quick.request_timeout = 5
+    rtc = quick.create_media_pipeline().add_endpoint("WebRtcEndpoint")
+    kms.silent.add("processOffer")
+
+    start = time.monotonic()
+    with pytest.raises(KurentoTimeoutException):
+        with quick.deadline(0.4):
+            rtc.connect()
+            rtc.process_offer("v=0")
+
+    assert time.monotonic() - start < 1.5
+
+def test_nested_deadline_only_shortens(kms, quick):
+    quick.request_timeout = 5
+    with quick.deadline(0.2):
+        with quick.deadline(10):
+            assert quick.time_left() <= 0.2
+
+def test_idempotent_requests_are_retried(kms):
+    cli = KurentoClient(kms.url, heartbeat_interval = None, request_timeout = 0.2, retry_policy = RetryPolicy(retries = 2, backoff = 0.01))
+    try:
+        kms.silent.add("ping")
+        before = len(kms.requests)
+        with pytest.raises(KurentoTimeoutException):
+            cli.ping()
+        assert len([r for r in list(kms.requests)[before:] if r["method"] == "ping"]) == 3
+
+        rtc = cli.create_media_pipeline().add_endpoint("WebRtcEndpoint")
+        kms.silent.add("processOffer")
+        before = len(kms.requests)
+        with pytest.raises(KurentoTimeoutException):
+            rtc.process_offer("v=0")
+        assert len([r for r in list(kms.requests)[before:] if r["method"] == "invoke"]) == 1 # Not idempotent
+    finally:
+        cli.__del__()
+
+def test_gather_forgets_requests_it_gave_up_on(kms, quick):
+    pipeline = quick.create_media_pipeline()
+    kms.silent.add("create")
+    futures = [pipeline.add_endpoint_nowait("WebRtcEndpoint") for _ in range(3)]
+    assert all(fut.req_id in quick.pending for fut in futures)
+
+    with pytest.raises(KurentoTimeoutException):
+        quick.gather(futures, timeout = 0.1)
+
+    assert quick.pending == {}
+    assert all(isinstance(fut.exception(0), KurentoTimeoutException) for fut in futures)
+
+def test_requests_nobody_waits_for_time_out(kms, quick):
+    pipeline = quick.create_media_pipeline()
+    kms.silent.add("getName")
+    fut = quick.send_request("invoke", {"object": pipeline.pipeline_id, "operation": "getName", "sessionId": pipeline.session_id})
+
+    assert isinstance(fut.exception(2), KurentoTimeoutException)
+    assert quick.pending == {}
+
+def test_requests_sent_without_waiting_keep_to_the_deadline(kms, quick):
+    quick.request_timeout = 5
+    pipeline = quick.create_media_pipeline()
+    kms.silent.add("getName")
+    with quick.deadline(0.2):
+        fut = quick.send_request("invoke", {"object": pipeline.pipeline_id, "operation": "getName", "sessionId": pipeline.session_id})
+
+    start = time.monotonic()
+    assert isinstance(fut.exception(2), KurentoTimeoutException)
+    assert time.monotonic() - start < 1
@@ -0,0 +1,65 @@
+# Tracers: the records they get & CallSetupTimer's phase timings
+import time
+
+import pytest
+
+from pyforkurento import CallSetupTimer
+from pyforkurento import KurentoClient
+from pyforkurento import Tracer
+from pyforkurento.events import UNDECODED
+
+
+@pytest.fixture
+def timer(kms):
+    timer = CallSetupTimer()
+    cli = KurentoClient(kms.url, heartbeat_interval = None, tracers = [timer])
+    yield cli, timer
+    cli.__del__()
+
+
+def connect_ms(timer, rtc):
+    return [setup["phases"]["connect"] for setup in timer.sessions(include_open = True) if setup["endpoint"] == rtc.elem_id][0]
+
+def test_connect_to_itself_is_timed_once(kms, timer):
+    cli, timer = timer
+    rtc = cli.create_media_pipeline().add_endpoint("WebRtcEndpoint")
+    kms.latency = 0.1
+    rtc.connect()
+
+    assert 90 <= connect_ms(timer, rtc) < 180
+
+def test_connect_is_timed_for_both_ends(kms, timer):
+    cli, timer = timer
+    pipeline = cli.create_media_pipeline()
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    other = pipeline.add_endpoint("WebRtcEndpoint")
+    kms.latency = 0.1
+    rtc.connect(other)
+
+    assert 90 <= connect_ms(timer, rtc) < 180
+    assert 90 <= connect_ms(timer, other) < 180
+
+def test_tracers_dont_decode_events(kms):
+    class Events(Tracer):
+        def __init__(self):
+            self.events = []
+
+        def on_event_received(self, event):
+            self.events.append(event)
+
+    tracer = Events()
+    cli = KurentoClient(kms.url, heartbeat_interval = None, tracers = [tracer])
+    try:
+        rtc = cli.create_media_pipeline().add_endpoint("WebRtcEndpoint")
+        rtc._subscribe("OnIceCandidate") # Subscribed, but nothing listens
+        kms.emit(rtc.elem_id, "OnIceCandidate", {"candidate": {"sdpMid": "0"}}, count = 3)
+
+        give_up = time.monotonic() + 2
+        while len(tracer.events) < 3 and time.monotonic() < give_up:
+            time.sleep(0.01)
+
+        assert [(event["type"], event["object"]) for event in tracer.events] == [("OnIceCandidate", rtc.elem_id)] * 3
+        assert all(event.event._payload is UNDECODED for event in tracer.events)
+        assert tracer.events[0]["payload"]["candidate"] == {"sdpMid": "0"}
+    finally:
+        cli.__del__()
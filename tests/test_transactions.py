@@ -0,0 +1,75 @@
+# Operations batched into one 'transaction' request, with newref: placeholders
+def test_elements_created_in_a_transaction_get_real_ids(kms, client, pipeline):
+    existing = pipeline.add_endpoint("WebRtcEndpoint")
+    before = len(kms.requests)
+
+    with pipeline.transaction() as tx:
+        tx.enlist(existing)
+        player = tx.add_endpoint("PlayerEndpoint", uri = "rtsp://camera")
+        rtc = tx.add_endpoint("WebRtcEndpoint")
+        assert player.elem_id.startswith("newref:")
+        player.connect(rtc)
+        rtc.connect(existing)
+        answer = rtc.process_offer("v=0")
+
+    sent = list(kms.requests)[before:]
+    assert [r["method"] for r in sent] == ["transaction"]
+
+    operations = sent[0]["params"]["operations"]
+    assert [op["method"] for op in operations] == ["create", "create", "invoke", "invoke", "invoke"]
+    assert operations[2]["params"]["object"] == f"newref:{operations[0]['id']}"
+    assert operations[2]["params"]["operationParams"]["sink"] == f"newref:{operations[1]['id']}"
+    assert operations[3]["params"]["operationParams"]["sink"] == existing.elem_id
+
+    # Placeholders resolved on commit
+    assert player.elem_id.endswith("_kurento.PlayerEndpoint")
+    assert rtc.elem_id.endswith("_kurento.WebRtcEndpoint")
+    assert answer.result(1) == "v=0 fake-sdp-answer"
+    assert len(tx.results) == 5
+
+    # Elements go back to the real client
+    assert rtc.pipeline is client
+    assert existing.pipeline is client
+    assert rtc.process_offer("v=1") == "v=0 fake-sdp-answer"
+
+def test_transaction_registers_elements_and_connections(kms, client, pipeline):
+    with pipeline.transaction() as tx:
+        player = tx.add_endpoint("PlayerEndpoint", uri = "rtsp://camera")
+        rtc = tx.add_endpoint("WebRtcEndpoint")
+        player.connect(rtc)
+
+    info = client.registry.info(rtc.elem_id)
+    assert info["type"] == "WebRtcEndpoint"
+    assert info["pipeline"] == pipeline.pipeline_id
+    assert info["sources"] == [player.elem_id]
+
+def test_exception_discards_the_transaction(kms, client, pipeline):
+    existing = pipeline.add_endpoint("WebRtcEndpoint")
+    before = len(kms.requests)
+
+    try:
+        with pipeline.transaction() as tx:
+            tx.enlist(existing)
+            tx.add_endpoint("WebRtcEndpoint")
+            raise ValueError("changed my mind")
+    except ValueError:
+        pass
+
+    assert len(kms.requests) == before
+    assert existing.pipeline is client
+
+def test_nowait_methods_are_recorded_too(kms, client, pipeline):
+    before = len(kms.requests)
+
+    with pipeline.transaction() as tx:
+        player = tx.add_endpoint_nowait("PlayerEndpoint", uri = "rtsp://camera")
+        face = tx.apply_filter_nowait("FaceOverlayFilter")
+        mixer = tx.add_hub_nowait("Composite")
+        assert player.result(0).elem_id.startswith("newref:")
+        player.result(0).connect(face.result(0))
+
+    assert [r["method"] for r in list(kms.requests)[before:]] == ["transaction"]
+    assert player.result(0).elem_id.endswith("_kurento.PlayerEndpoint")
+    assert face.result(0).elem_id.endswith("_kurento.FaceOverlayFilter")
+    assert mixer.result(0).elem_id.endswith("_kurento.Composite")
+    assert client.registry.info(face.result(0).elem_id)["sources"] == [player.result(0).elem_id]
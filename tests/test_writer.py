@@ -0,0 +1,35 @@
+# The writer thread: frames queued during a write go out together, each once
+import json
+import threading
+
+REQUESTS = 200
+
+
+def test_frames_queued_during_a_write_are_batched(kms, client, pipeline):
+    rtc = pipeline.add_endpoint("WebRtcEndpoint")
+    batches = []
+    first_write = threading.Event()
+    release = threading.Event()
+    send_frames = client.send_frames
+
+    def recording_send_frames(payloads, conn = None):
+        batches.append([json.loads(payload)["id"] for payload in payloads])
+        first_write.set()
+        release.wait(5) # Hold the writer so that the rest queue up behind this write
+        return send_frames(payloads, conn)
+
+    client.send_frames = recording_send_frames
+    params = {"object": rtc.elem_id, "operation": "getName", "sessionId": rtc.session_id}
+    futures = [client.send_request("invoke", params)]
+    assert first_write.wait(5)
+    futures = futures + [client.send_request("invoke", params) for _ in range(REQUESTS - 1)]
+    release.set()
+    client.gather(futures)
+
+    sent = [req_id for batch in batches for req_id in batch]
+    assert sorted(sent) == sorted(fut.req_id for fut in futures) # Each written exactly once
+    assert len(batches) < REQUESTS / 10
+    assert max(len(batch) for batch in batches) > 1
+
+    received = [r["id"] for r in list(kms.requests) if r["method"] == "invoke"]
+    assert sorted(received) == sorted(sent)